@@ -0,0 +1,279 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import STORAGE_READ_WORKERS, STORAGE_WRITE_QUEUE, STORAGE_TIMEOUT
+from exporters import ExportFilter, build_export
+from simple_storage import SimpleStorageManager
+from sinks import RecordChange, SaleRow
+from tracing import bind_context, span
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBusyError(Exception):
+    """Очередь записи переполнена и место в ней не освободилось за отведенное время"""
+
+
+class AsyncStorage:
+    """
+    Асинхронный фасад над SimpleStorageManager.
+
+    Файловые операции и запросы к Google Sheets выполняются вне цикла
+    событий: запись - в одном потоке-писателе (строки попадают в журнал
+    в порядке вызовов), чтение и статистика - в отдельном пуле потоков.
+    Очередь записи ограничена STORAGE_WRITE_QUEUE, ожидание места в ней
+    и чтения ограничены STORAGE_TIMEOUT секундами.
+    """
+
+    def __init__(self, manager: SimpleStorageManager, write_queue: int = STORAGE_WRITE_QUEUE,
+                 read_workers: int = STORAGE_READ_WORKERS, timeout: float = STORAGE_TIMEOUT):
+        self.manager = manager
+        self.write_queue = write_queue
+        self.timeout = timeout
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage-writer')
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='storage-reader')
+        # Семафор создается при первой записи - уже внутри цикла событий бота
+        self._write_slots: Optional[asyncio.Semaphore] = None
+        self._pending_writes = 0
+        self._index_saving = False
+
+    @property
+    def google_sheets(self):
+        return self.manager.google_sheets
+
+    @property
+    def fanout(self):
+        return self.manager.fanout
+
+    @property
+    def filename(self) -> str:
+        return self.manager.filename
+
+    async def add(self, buyer: str, datetime: str, amount: str, source: str,
+                  message_key: Optional[str] = None, author: Optional[int] = None) -> bool:
+        """
+        Добавляет запись о продаже: CSV пишется в потоке-писателе,
+        остальные приемники получают запись через свои очереди
+
+        Args:
+            message_key: "чат:сообщение" Telegram, из которого создана запись (для правок)
+            author: id пользователя Telegram (для /undo)
+
+        Returns:
+            bool: True если запись сохранена в CSV
+
+        Raises:
+            StorageBusyError: если очередь записи не освободилась за timeout секунд
+        """
+        if self._write_slots is None:
+            self._write_slots = asyncio.Semaphore(self.write_queue)
+        try:
+            with span('storage.queue_wait'):
+                await asyncio.wait_for(self._write_slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise StorageBusyError(f"очередь записи занята ({self._pending_writes} в ожидании)")
+
+        self._pending_writes += 1
+        try:
+            # Саму запись не прерываем по таймауту: строка, уже переданная писателю, будет записана
+            row = SaleRow([buyer, datetime, amount, source], message_key, author)
+            success = await self.manager.fanout.publish(row, executor=self._writer)
+        finally:
+            self._pending_writes -= 1
+            self._write_slots.release()
+
+        if success:
+            logger.info("Добавлена запись: %s, %s, %s, %s", buyer, datetime, amount, source)
+            self._save_index_if_needed()
+        return success
+
+    async def add_batch(self, rows: List[List[str]]) -> bool:
+        """
+        Добавляет пачку записей [buyer, datetime, amount, source] одной записью в CSV
+        (например, при импорте документа); занимает одно место в очереди записи
+
+        Raises:
+            StorageBusyError: если очередь записи не освободилась за timeout секунд
+        """
+        if self._write_slots is None:
+            self._write_slots = asyncio.Semaphore(self.write_queue)
+        try:
+            await asyncio.wait_for(self._write_slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise StorageBusyError(f"очередь записи занята ({self._pending_writes} в ожидании)")
+
+        self._pending_writes += 1
+        try:
+            success = await self.manager.fanout.publish_batch(rows, executor=self._writer)
+        finally:
+            self._pending_writes -= 1
+            self._write_slots.release()
+
+        if success:
+            logger.info("Добавлено записей пачкой: %d", len(rows))
+            self._save_index_if_needed()
+        return success
+
+    async def amend(self, message_key: str, record: List[str],
+                    **meta) -> Tuple[Optional[int], Optional[RecordChange]]:
+        """
+        Исправляет запись, созданную сообщением message_key: правка дописывается
+        в журнал правок потоком-писателем (по порядку с записями), остальные
+        приемники получают ее через свои очереди
+
+        Returns:
+            Tuple: номер записи (None - сообщение записи не создавало) и опубликованная
+            правка (None - запись отменена или не изменилась, см. is_retracted)
+        """
+        def change():
+            row_id = self.manager.index.row_for_message(message_key)
+            if row_id is None:
+                return None, None
+            return row_id, self.manager.change_record(row_id, record, **meta)
+
+        loop = asyncio.get_running_loop()
+        row_id, record_change = await loop.run_in_executor(self._writer, bind_context(change))
+        if record_change is not None:
+            await self.manager.fanout.publish_change(record_change, executor=self._writer)
+        return row_id, record_change
+
+    def is_retracted(self, row_id: int) -> bool:
+        """Запись отменена (/undo)"""
+        return self.manager.changes.is_retracted(row_id)
+
+    async def undo(self, author: int, **meta) -> Optional[Tuple[int, List[str]]]:
+        """
+        Отменяет последнюю неотмененную запись автора: в журнал правок дописывается
+        отметка об отмене, CSV не переписывается
+
+        Returns:
+            Tuple[int, List[str]]: номер и строка отмененной записи или None, если отменять нечего
+        """
+        def change():
+            row_id = self.manager.index.last_by_author(author, skip=self.manager.changes.retracted())
+            if row_id is None:
+                return None
+            return self.manager.change_record(row_id, None, user_id=author, **meta)
+
+        loop = asyncio.get_running_loop()
+        record_change = await loop.run_in_executor(self._writer, bind_context(change))
+        if record_change is None:
+            return None
+        await self.manager.fanout.publish_change(record_change, executor=self._writer)
+        return record_change.row_id, record_change.old
+
+    def _save_index_if_needed(self):
+        # Индекс сохраняется в пуле чтения, чтобы не задерживать ни цикл событий, ни писателя
+        if self.manager.index.needs_save and not self._index_saving:
+            self._index_saving = True
+            self._readers.submit(self._save_index)
+
+    def _save_index(self):
+        try:
+            self.manager.index.save()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить индекс журнала: {e}")
+        finally:
+            self._index_saving = False
+
+    async def _read(self, method: Callable, *args, timeout: Optional[float] = None) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._readers, bind_context(method), *args)
+        return await asyncio.wait_for(future, timeout or self.timeout)
+
+    async def stats(self, export_filter: Optional[ExportFilter] = None) -> dict:
+        """Статистика продаж за период, по покупателю или источнику (см. SimpleStorageManager.get_stats)"""
+        if export_filter is None:
+            return await self._read(self.manager.get_stats)
+        return await self._read(
+            self.manager.get_stats,
+            export_filter.date_from, export_filter.date_to, export_filter.buyer, export_filter.source
+        )
+
+    async def records(self) -> Optional[List[List]]:
+        """Все записи CSV (см. SimpleStorageManager.get_all_records)"""
+        return await self._read(self.manager.get_all_records)
+
+    async def read_ledger(self) -> bytes:
+        """Содержимое CSV файла целиком - для отправки в чат"""
+        return await self._read(self._read_file)
+
+    def _read_file(self) -> bytes:
+        with open(self.manager.filename, 'rb') as file:
+            return file.read()
+
+    def ledger_version(self) -> Optional[Tuple[int, int, int]]:
+        """Версия журнала (размер CSV, mtime в нс, число правок) - меняется при каждой записи и правке"""
+        try:
+            stat = os.stat(self.manager.filename)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns, self.manager.changes.count
+
+    async def export(self, export_filter: ExportFilter, export_format: str):
+        """Выгрузка с отбором и правками (см. exporters.build_export) в пуле чтения без таймаута"""
+        return await self.run(
+            functools.partial(build_export, overrides=self.manager.changes.snapshot()),
+            self.manager.filename, export_filter, export_format
+        )
+
+    async def find(self, buyers: List[str], words: List[str], offset: int = 0,
+                   limit: int = 10) -> Tuple[int, List[Tuple[int, List[str]]]]:
+        """
+        Поиск по индексу журнала (см. LedgerIndex.search)
+
+        Returns:
+            Tuple[int, List]: всего найдено и записи (номер, строка) с offset, новые первыми
+        """
+        def search():
+            overrides = self.manager.changes.snapshot()
+            row_ids = self.manager.index.search(buyers, words, overrides)
+            records = self.manager.index.read(row_ids[offset:offset + limit])
+            return len(row_ids), [(row_id, overrides.get(row_id, row)) for row_id, row in records]
+        return await self._read(search)
+
+    async def top(self, kind: str, metric: str, limit: int,
+                  export_filter: ExportFilter) -> List[Tuple[str, Dict[str, float]]]:
+        """Лидеры среди покупателей или источников за период (см. LedgerStats.top)"""
+        return await self._read(
+            self.manager.stats.top, kind, metric, limit, export_filter.date_from, export_filter.date_to
+        )
+
+    async def recent(self, limit: int, before: Optional[int] = None) -> List[Tuple[int, List[str]]]:
+        """
+        Последние записи журнала с учетом правок, новые первыми: номера берутся
+        из индекса с конца, строки читаются по смещениям (см. LedgerIndex.recent)
+
+        Args:
+            before: Курсор - номер записи, с которой закончилась предыдущая страница
+        """
+        def read():
+            overrides = self.manager.changes.snapshot()
+            retracted = {row_id for row_id, row in overrides.items() if row is None}
+            records = self.manager.index.read(self.manager.index.recent(limit, before, retracted))
+            return [(row_id, overrides.get(row_id, row)) for row_id, row in records]
+        return await self._read(read)
+
+    async def run(self, method: Callable, *args) -> Any:
+        """Выполняет долгую блокирующую операцию (например, сверку) в пуле чтения без таймаута"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, method, *args)
+
+    def snapshot(self) -> Dict[str, int]:
+        """Глубина очереди записи"""
+        return {
+            'pending_writes': self._pending_writes,
+            'write_queue': self.write_queue,
+        }
+
+    def close(self):
+        """Дожидается выполнения поставленных операций, сохраняет индекс и останавливает потоки"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        try:
+            self.manager.index.save()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить индекс журнала: {e}")
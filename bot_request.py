@@ -0,0 +1,25 @@
+import logging
+import time
+from typing import Optional, Tuple
+from telegram.request import HTTPXRequest, RequestData
+from metrics import TELEGRAM_ERRORS, TELEGRAM_REQUEST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class MeasuredHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий время каждого запроса к Bot API по имени метода (sendMessage, ...)"""
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception:
+            TELEGRAM_ERRORS.inc(method=api_method)
+            raise
+        TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, method=api_method)
+        if code >= 400:
+            TELEGRAM_ERRORS.inc(method=api_method)
+        return code, payload
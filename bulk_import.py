@@ -0,0 +1,184 @@
+import asyncio
+import csv
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
+from config import IMPORT_CHUNK_LINES, EXPORT_SPOOL_BYTES
+from message_parser import SaleMessageParser
+from metrics import Counter
+from tracing import bind_context
+
+logger = logging.getLogger(__name__)
+
+IMPORTED_LINES = Counter('salesbot_import_lines_total', 'Строки импортированных документов', ['outcome'])
+
+# Расширения документов, которые принимает импорт
+IMPORT_EXTENSIONS = ('txt', 'csv', 'json', 'jsonl')
+
+_FIELDS = ('buyer', 'datetime', 'amount', 'source')
+
+
+def _record_text(item) -> str:
+    """Текст записи из элемента JSON: строка, {"text": ...} или объект с полями записи"""
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict):
+        if 'text' in item:
+            return str(item['text'])
+        return ' '.join(str(item[field]) for field in _FIELDS if item.get(field))
+    if isinstance(item, list):
+        return ' '.join(str(value) for value in item)
+    return str(item)
+
+
+def iter_document_lines(path: str, extension: str) -> Iterator[str]:
+    """
+    Строки документа по одной: каждая строка - одно сообщение о продаже
+
+    .txt - строка файла, .csv - строка таблицы (ячейки через пробел, заголовок
+    пропускается), .jsonl - один JSON элемент на строку, .json - массив элементов
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        if extension == 'txt':
+            for line in file:
+                yield line.strip()
+        elif extension == 'csv':
+            for number, row in enumerate(csv.reader(file)):
+                if number == 0 and row and row[0] == 'Ник покупателя':
+                    continue
+                yield ' '.join(cell.strip() for cell in row if cell.strip())
+        elif extension == 'jsonl':
+            for line in file:
+                line = line.strip()
+                try:
+                    yield _record_text(json.loads(line)) if line else ''
+                except ValueError:
+                    # Строка уйдет в отклоненные с причиной от парсера
+                    yield line
+        else:
+            # Обычный JSON читается целиком - размер ограничен IMPORT_MAX_BYTES
+            data = json.load(file)
+            for item in data if isinstance(data, list) else [data]:
+                yield _record_text(item)
+
+
+class ImportResult:
+    """Итог импорта: сколько строк прочитано, записано, отклонено, и файл отклоненных строк"""
+
+    def __init__(self):
+        self.lines = 0
+        self.imported = 0
+        self.rejected = 0
+        self.started_at = time.perf_counter()
+        self.rejects = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode='w+', newline='',
+                                                     encoding='utf-8')
+        self._reject_writer = csv.writer(self.rejects)
+        self._reject_writer.writerow(['Строка', 'Текст', 'Причина'])
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def reject(self, number: int, text: str, reason: str):
+        self.rejected += 1
+        self._reject_writer.writerow([number, text, reason])
+
+    def rejects_bytes(self) -> bytes:
+        self.rejects.seek(0)
+        return self.rejects.read().encode('utf-8')
+
+    def close(self):
+        self.rejects.close()
+
+
+class BulkImporter:
+    """
+    Импорт записей из документа.
+
+    Строки читаются и разбираются SaleMessageParser пачками по
+    IMPORT_CHUNK_LINES в пуле потоков, корректные записи каждой пачки
+    пишутся в хранилище одной операцией (CSV сразу, остальные приемники -
+    через свои очереди), отклоненные - в файл с причиной.
+    """
+
+    def __init__(self, parser: SaleMessageParser, storage, chunk_lines: int = IMPORT_CHUNK_LINES):
+        self.parser = parser
+        self.storage = storage
+        self.chunk_lines = chunk_lines
+
+    def _parse_chunk(self, lines: Iterator[Tuple[int, str]], result: ImportResult) -> Optional[List[List[str]]]:
+        """Разбирает следующую пачку строк; None - строки закончились"""
+        chunk = list(itertools.islice(lines, self.chunk_lines))
+        if not chunk:
+            return None
+        rows = []
+        for number, text in chunk:
+            if not text:
+                continue
+            result.lines += 1
+            try:
+                parsed = self.parser.parse_message(text)
+                is_valid, error_message = self.parser.validate_parsed_data(parsed)
+            except Exception as e:
+                is_valid, error_message = False, f"ошибка разбора: {e}"
+            if is_valid:
+                rows.append([parsed[field] for field in _FIELDS])
+            else:
+                result.reject(number, text, error_message)
+        return rows
+
+    async def run(self, path: str, extension: str,
+                  progress: Optional[Callable[[ImportResult], Awaitable[None]]] = None) -> ImportResult:
+        """
+        Импортирует документ
+
+        Args:
+            path: Путь к скачанному документу
+            extension: Расширение (см. IMPORT_EXTENSIONS)
+            progress: Вызывается после каждой пачки
+        """
+        loop = asyncio.get_running_loop()
+        result = ImportResult()
+        lines = enumerate(iter_document_lines(path, extension), start=1)
+        parse_chunk = bind_context(self._parse_chunk)
+        try:
+            while True:
+                rows = await loop.run_in_executor(None, parse_chunk, lines, result)
+                if rows is None:
+                    break
+                if rows:
+                    if not await self.storage.add_batch(rows):
+                        raise IOError("не удалось записать пачку в CSV")
+                    result.imported += len(rows)
+                if progress is not None:
+                    await progress(result)
+        except Exception:
+            result.close()
+            raise
+        finally:
+            IMPORTED_LINES.inc(result.imported, outcome='imported')
+            IMPORTED_LINES.inc(result.rejected, outcome='rejected')
+        logger.info(
+            "Импорт завершен: строк %d, записано %d, отклонено %d за %.1f с",
+            result.lines, result.imported, result.rejected, result.seconds
+        )
+        return result
+
+
+def format_progress(result: ImportResult, done: bool = False) -> str:
+    header = "✅ Импорт завершен" if done else "⏳ Импорт..."
+    return (
+        f"{header}\n\n"
+        f"📄 Прочитано строк: {result.lines}\n"
+        f"💾 Записано: {result.imported}\n"
+        f"❌ Отклонено: {result.rejected}\n"
+        f"⏱ {result.seconds:.1f} с"
+    )
+
+
+def document_extension(file_name: Optional[str]) -> str:
+    return os.path.splitext(file_name or '')[1].lstrip('.').lower()
@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,8 +18,149 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 SHEET_NAME = os.getenv("SHEET_NAME", "Лист1")
 SHEET_RANGE = os.getenv("SHEET_RANGE", "A:D")
 
+# Чтение из Google Sheets страницами (строк на страницу / страниц на один batch_get)
+SHEETS_PAGE_SIZE = int(os.getenv("SHEETS_PAGE_SIZE", 500))
+SHEETS_PAGES_PER_BATCH = int(os.getenv("SHEETS_PAGES_PER_BATCH", 4))
+
+# Шардирование листов: "none" - все в SHEET_NAME, "month" - лист на каждый месяц (ГГГГ-ММ)
+SHEETS_SHARDING = os.getenv("SHEETS_SHARDING", "none")
+# Лист-шаблон для новых листов периодов (пусто - создавать лист с заголовками)
+SHEETS_TEMPLATE_SHEET = os.getenv("SHEETS_TEMPLATE_SHEET", "")
+# Лист со сводкой по периодам и как часто его обновлять (записей / секунд)
+SHEETS_SUMMARY_SHEET = os.getenv("SHEETS_SUMMARY_SHEET", "Сводка")
+SHEETS_SUMMARY_FLUSH_EVERY = int(os.getenv("SHEETS_SUMMARY_FLUSH_EVERY", 20))
+SHEETS_SUMMARY_FLUSH_SECONDS = int(os.getenv("SHEETS_SUMMARY_FLUSH_SECONDS", 60))
+
+# Квоты Google Sheets API: запросов в минуту на чтение и запись
+SHEETS_READS_PER_MINUTE = float(os.getenv("SHEETS_READS_PER_MINUTE", 60))
+SHEETS_WRITES_PER_MINUTE = float(os.getenv("SHEETS_WRITES_PER_MINUTE", 60))
+# Повторы после ответа 429 и нижняя граница скорости (доля от квоты)
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", 5))
+SHEETS_MIN_RATE_FACTOR = float(os.getenv("SHEETS_MIN_RATE_FACTOR", 0.1))
+
+# Сверка CSV и Google Sheets: размер блока строк для хэш-дерева
+SYNC_BLOCK_SIZE = int(os.getenv("SYNC_BLOCK_SIZE", 200))
+# Сколько строк отправлять в Google Sheets одним запросом при дозаписи
+SYNC_WRITE_BATCH = int(os.getenv("SYNC_WRITE_BATCH", 500))
+
+# Приемники записей кроме основного CSV: sheets, sqlite, jsonl или свой класс "модуль:Класс"
+SALE_SINKS = os.getenv("SALE_SINKS", "sheets")
+# Повторы записи пачки в приемник перед тем, как пачка будет отброшена
+SINK_MAX_RETRIES = int(os.getenv("SINK_MAX_RETRIES", 3))
+
+def sink_setting(sink_name: str, key: str, default):
+    """Настройка приемника из переменной SINK_<ИМЯ>_<КЛЮЧ>, например SINK_SHEETS_BATCH_SIZE"""
+    return os.getenv(f"SINK_{sink_name.upper()}_{key}", default)
+
+# Администраторы бота (Telegram user id через запятую) - для служебных команд
+ADMIN_IDS = {
+    int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",")
+    if user_id.isdigit()
+}
+
+# Работа с хранилищем вне цикла событий: потоков для чтения, длина очереди записи,
+# сколько секунд ждать места в очереди или результата чтения
+STORAGE_READ_WORKERS = int(os.getenv("STORAGE_READ_WORKERS", 2))
+STORAGE_WRITE_QUEUE = int(os.getenv("STORAGE_WRITE_QUEUE", 1000))
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT", 30))
+
+# Трассировка: обновления дольше SLOW_TRACE_MS пишутся в журнал медленных обновлений (JSONL с ротацией)
+SLOW_TRACE_MS = float(os.getenv("SLOW_TRACE_MS", 1000))
+SLOW_LOG_FILE = os.getenv("SLOW_LOG_FILE", "slow_updates.jsonl")
+SLOW_LOG_MAX_BYTES = int(os.getenv("SLOW_LOG_MAX_BYTES", 5 * 1024 * 1024))
+SLOW_LOG_BACKUPS = int(os.getenv("SLOW_LOG_BACKUPS", 3))
+# Сколько последних медленных обновлений держать в памяти для /trace
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", 50))
+
+# Профилирование по /profile: максимальное окно (сек) и сколько строк показывать
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 120))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", 30))
+
+# Файл, куда записываются все входящие обновления для loadtest.py replay (пусто - не записывать)
+RECORD_UPDATES_FILE = os.getenv("RECORD_UPDATES_FILE", "")
+
+# Ограничение частоты: сообщений в минуту и запас подряд на пользователя и на чат
+FLOOD_USER_PER_MINUTE = float(os.getenv("FLOOD_USER_PER_MINUTE", 30))
+FLOOD_USER_BURST = float(os.getenv("FLOOD_USER_BURST", 10))
+FLOOD_CHAT_PER_MINUTE = float(os.getenv("FLOOD_CHAT_PER_MINUTE", 120))
+FLOOD_CHAT_BURST = float(os.getenv("FLOOD_CHAT_BURST", 30))
+# Команды (/stats, /sync, ...) идут через отдельную корзину пользователя
+FLOOD_COMMAND_PER_MINUTE = float(os.getenv("FLOOD_COMMAND_PER_MINUTE", 20))
+FLOOD_COMMAND_BURST = float(os.getenv("FLOOD_COMMAND_BURST", 5))
+# Предупреждать о превышении не чаще раза в столько секунд на пользователя
+FLOOD_NOTICE_INTERVAL = float(os.getenv("FLOOD_NOTICE_INTERVAL", 30))
+# Очередь приема: сколько обновлений может быть в обработке и ожидании одновременно,
+# что делать при заполнении (reject / defer / drop_duplicates) и сколько секунд ждать при defer
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 200))
+OVERLOAD_POLICY = os.getenv("OVERLOAD_POLICY", "defer")
+OVERLOAD_DEFER_SECONDS = float(os.getenv("OVERLOAD_DEFER_SECONDS", 10))
+
+# Ответы в чаты: подтверждения одного чата за REPLY_COALESCE_SECONDS уходят одним сообщением,
+# а в течение REPLY_EDIT_WINDOW секунд дописываются правкой прошлого (не больше REPLY_MAX_ENTRIES строк)
+REPLY_COALESCE_SECONDS = float(os.getenv("REPLY_COALESCE_SECONDS", 1.5))
+REPLY_EDIT_WINDOW = float(os.getenv("REPLY_EDIT_WINDOW", 60))
+REPLY_MAX_ENTRIES = int(os.getenv("REPLY_MAX_ENTRIES", 20))
+# Лимиты Telegram на исходящие сообщения: в минуту на чат и в секунду на весь бот
+TELEGRAM_CHAT_PER_MINUTE = float(os.getenv("TELEGRAM_CHAT_PER_MINUTE", 20))
+TELEGRAM_GLOBAL_PER_SECOND = float(os.getenv("TELEGRAM_GLOBAL_PER_SECOND", 25))
+
+# Через сколько секунд затишья после записи в журнал готовить в фоне новую выгрузку для /export
+EXPORT_PREBUILD_DELAY = float(os.getenv("EXPORT_PREBUILD_DELAY", 5))
+
+# Выгрузки /export с отбором: сколько байт держать в памяти, прежде чем временный файл уйдет на диск
+EXPORT_SPOOL_BYTES = int(os.getenv("EXPORT_SPOOL_BYTES", 1024 * 1024))
+
+# Импорт документов: строк в пачке разбора и записи, максимальный размер файла (Bot API отдает до 20 МБ),
+# как часто обновлять сообщение о ходе импорта (сек)
+IMPORT_CHUNK_LINES = int(os.getenv("IMPORT_CHUNK_LINES", 500))
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", 20 * 1024 * 1024))
+IMPORT_PROGRESS_SECONDS = float(os.getenv("IMPORT_PROGRESS_SECONDS", 2))
+
+# Индекс журнала (<журнал>.index.json): сохранять после стольких новых записей; записей на странице /find
+# и /list по умолчанию, больше скольких записей /list не показывает за раз
+INDEX_SAVE_EVERY = int(os.getenv("INDEX_SAVE_EVERY", 200))
+FIND_PAGE_SIZE = int(os.getenv("FIND_PAGE_SIZE", 10))
+LIST_MAX_RECORDS = int(os.getenv("LIST_MAX_RECORDS", 50))
+
+# Сколько лидеров показывает /top по умолчанию (не больше LIST_MAX_RECORDS)
+TOP_SIZE = int(os.getenv("TOP_SIZE", 10))
+
+# Журналы по чатам: "single" - общий журнал, "chat" - свой CSV и лист Google Sheets у каждого чата.
+# Каталог журналов чатов, сколько журналов держать открытыми, название листа чата
+# (шаблон с {chat_id} или явные названия "chat_id=Лист,...")
+TENANT_MODE = os.getenv("TENANT_MODE", "single")
+TENANT_DIR = os.getenv("TENANT_DIR", "ledgers")
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", 32))
+TENANT_SHEET_TEMPLATE = os.getenv("TENANT_SHEET_TEMPLATE", "Чат {chat_id}")
+TENANT_SHEETS = os.getenv("TENANT_SHEETS", "")
+
+# Сколько обновлений Telegram обрабатывать одновременно (обновления одного чата - всегда по очереди)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", 16))
+
+# Логирование: уровень, формат (text / json), доля пропускаемых записей ниже WARNING
+# по логгерам ("message_parser=0.01,async_storage=0.1"), длина очереди вывода
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Логгеры библиотек, у которых выводятся только предупреждения и ошибки
+LOG_QUIET_LOGGERS = os.getenv("LOG_QUIET_LOGGERS", "httpx,httpcore,apscheduler")
+
 # Railway / Server
 PORT = int(os.getenv("PORT", 8000))
+# Токен для служебных HTTP адресов (/debug/stats); пусто - адреса закрыты
+ADMIN_HTTP_TOKEN = os.getenv("ADMIN_HTTP_TOKEN", "")
+
+# Режим получения обновлений: "polling" или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес для вебхука (на Railway берется из RAILWAY_PUBLIC_DOMAIN)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or (
+    f"https://{os.getenv('RAILWAY_PUBLIC_DOMAIN')}" if os.getenv("RAILWAY_PUBLIC_DOMAIN") else ""
+)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TELEGRAM_BOT_TOKEN.encode()).hexdigest()[:32]
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
 
 # Helper to obtain Google credentials
 def get_google_credentials():
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from typing import IO, Optional, Tuple, Union
+from config import EXPORT_PREBUILD_DELAY
+from exporters import ExportFilter
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+EXPORTS = Counter(
+    'salesbot_exports_total', 'Отправки /export: по file_id, из готовой выгрузки или с построением', ['source']
+)
+
+# Версия журнала: размер и время изменения CSV файла, число правок (см. AsyncStorage.ledger_version)
+Version = Tuple[int, int, int]
+
+
+class ExportCache:
+    """
+    Повторная отправка /export по file_id и подготовка выгрузки заранее.
+
+    После загрузки файла Telegram возвращает file_id - пока журнал не
+    изменился (та же версия), /export отправляет этот file_id без повторной
+    загрузки. После записей в журнал, когда они стихнут на prebuild_delay
+    секунд, выгрузка строится в фоне во временный файл на диске, чтобы
+    следующий /export не ждал ее построения. Содержимое журнала в памяти
+    между отправками не держится.
+    """
+
+    def __init__(self, storage, prebuild_delay: float = EXPORT_PREBUILD_DELAY):
+        self.storage = storage
+        self.prebuild_delay = prebuild_delay
+        self._file_id: Optional[str] = None
+        self._file_version: Optional[Version] = None
+        self._prebuilt: Optional[IO[bytes]] = None
+        self._prebuilt_version: Optional[Version] = None
+        self._changed_at = 0.0
+        self._prebuild_task: Optional[asyncio.Task] = None
+
+    def _version(self) -> Optional[Version]:
+        return self.storage.ledger_version()
+
+    def _drop_prebuilt(self):
+        if self._prebuilt is not None:
+            self._prebuilt.close()
+        self._prebuilt = self._prebuilt_version = None
+
+    async def _build(self) -> IO[bytes]:
+        output, _ = await self.storage.export(ExportFilter(), 'csv')
+        return output
+
+    async def document(self) -> Tuple[Union[str, IO[bytes]], Optional[Version]]:
+        """
+        file_id последней загрузки, если журнал не менялся, иначе выгрузка
+
+        Returns:
+            Tuple: file_id или временный файл (закрывает вызывающий) и версия журнала,
+            снятая до построения выгрузки
+        """
+        # Если запись успеет между stat и построением, выгрузка окажется новее версии -
+        # в худшем случае файл будет загружен лишний раз, но устаревшим не окажется
+        version = self._version()
+        if self._file_id is not None and version == self._file_version:
+            EXPORTS.inc(source='file_id')
+            return self._file_id, version
+        if self._prebuilt is not None and version == self._prebuilt_version:
+            EXPORTS.inc(source='prebuilt')
+            # Готовый файл переходит к вызывающему
+            output, self._prebuilt, self._prebuilt_version = self._prebuilt, None, None
+            return output, version
+        self._drop_prebuilt()
+        EXPORTS.inc(source='build')
+        return await self._build(), version
+
+    def remember(self, version: Optional[Version], sent_message):
+        """Запоминает file_id из ответа Telegram на загрузку выгрузки версии version"""
+        if version is None or sent_message is None or sent_message.document is None:
+            return
+        self._file_id = sent_message.document.file_id
+        self._file_version = version
+
+    def changed(self):
+        """Журнал изменился: когда записи стихнут на prebuild_delay секунд, в фоне строится новая выгрузка"""
+        self._changed_at = time.monotonic()
+        if self._prebuild_task is None or self._prebuild_task.done():
+            self._prebuild_task = asyncio.create_task(self._prebuild())
+
+    async def _prebuild(self):
+        # Каждая новая запись откладывает построение: под потоком записей выгрузка не строится впустую
+        delay = self.prebuild_delay
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._changed_at + self.prebuild_delay - time.monotonic()
+        version = self._version()
+        if version == self._file_version or version == self._prebuilt_version:
+            return
+        try:
+            output = await self._build()
+            try:
+                # Готовая выгрузка ждет /export на диске, а не в памяти
+                await self.storage.run(output.rollover)
+            except Exception:
+                output.close()
+                raise
+        except Exception as e:
+            logger.warning(f"Не удалось подготовить выгрузку заранее: {e}")
+            return
+        self._drop_prebuilt()
+        self._prebuilt, self._prebuilt_version = output, version
+
+    async def stop(self):
+        """Отменяет отложенную подготовку и удаляет готовую выгрузку"""
+        if self._prebuild_task is not None and not self._prebuild_task.done():
+            self._prebuild_task.cancel()
+        self._drop_prebuilt()
+
+    def snapshot(self) -> dict:
+        """Актуальны ли запомненный file_id и готовая выгрузка"""
+        version = self._version()
+        return {
+            'file_id_fresh': self._file_id is not None and version == self._file_version,
+            'prebuilt_fresh': self._prebuilt is not None and version == self._prebuilt_version,
+        }
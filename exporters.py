@@ -0,0 +1,275 @@
+import csv
+import gzip
+import io
+import re
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+from config import EXPORT_SPOOL_BYTES
+from ledger_changes import resolve_rows
+
+# Форматы выгрузки: имя в команде -> расширение файла
+EXPORT_FORMATS = {
+    'csv': 'csv',
+    'gz': 'csv.gz',
+    'gzip': 'csv.gz',
+    'xlsx': 'xlsx',
+}
+
+_DATE_PATTERN = re.compile(r'^(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?$')
+# Недопустимые в XML 1.0 управляющие символы
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class ExportArgumentError(ValueError):
+    """Аргументы /export не удалось разобрать"""
+
+
+class ExportFilter:
+    """Отбор записей для выгрузки: диапазон дат публикации, покупатель, источник"""
+
+    def __init__(self, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                 buyer: Optional[str] = None, source: Optional[str] = None):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.buyer = buyer.lower().lstrip('@') if buyer else None
+        self.source = source.lower() if source else None
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.date_from or self.date_to or self.buyer or self.source)
+
+    def matches(self, row: List[str]) -> bool:
+        if len(row) < 4:
+            return False
+        if self.buyer and row[0].lower().lstrip('@') != self.buyer:
+            return False
+        if self.source and self.source not in row[3].lower():
+            return False
+        if self.date_from or self.date_to:
+            published = row_date(row)
+            if published is None:
+                return False
+            if self.date_from and published < self.date_from:
+                return False
+            if self.date_to and published > self.date_to:
+                return False
+        return True
+
+
+def row_date(row: List[str]) -> Optional[date]:
+    """Дата публикации записи ('15.09.2025 12:30' -> date) или None"""
+    try:
+        return datetime.strptime(row[1][:10], '%d.%m.%Y').date()
+    except (ValueError, IndexError):
+        return None
+
+
+def _parse_date(token: str, today: date) -> Optional[date]:
+    if token == 'сегодня':
+        return today
+    if token == 'вчера':
+        return today - timedelta(days=1)
+    match = _DATE_PATTERN.match(token)
+    if not match:
+        return None
+    day, month, year = match.groups()
+    try:
+        return date(int(year) if year else today.year, int(month), int(day))
+    except ValueError:
+        raise ExportArgumentError(f"некорректная дата: {token}")
+
+
+def parse_filter_args(args: List[str], today: Optional[date] = None) -> ExportFilter:
+    """
+    Разбирает условия отбора [с] [по] [@покупатель] [источник]
+
+    Даты - ДД.ММ или ДД.ММ.ГГГГ (а также "сегодня" и "вчера"), первая - начало
+    диапазона, вторая - конец. Остальные слова составляют источник.
+    """
+    today = today or date.today()
+    dates: List[date] = []
+    buyer = None
+    source_words = []
+    for token in args:
+        if token.startswith('@'):
+            buyer = token
+            continue
+        parsed = _parse_date(token.lower(), today)
+        if parsed is not None:
+            if len(dates) == 2:
+                raise ExportArgumentError("укажите не больше двух дат")
+            dates.append(parsed)
+            continue
+        source_words.append(token)
+
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+    if date_from and date_to and date_from > date_to:
+        date_from, date_to = date_to, date_from
+    return ExportFilter(date_from, date_to, buyer, ' '.join(source_words) or None)
+
+
+def parse_export_args(args: List[str], today: Optional[date] = None) -> Tuple[ExportFilter, str]:
+    """
+    Разбирает аргументы /export [с] [по] [@покупатель] [источник] [формат]
+
+    Формат - csv, gz или xlsx, остальное - условия отбора (см. parse_filter_args).
+
+    Returns:
+        Tuple[ExportFilter, str]: фильтр и формат выгрузки
+    """
+    export_format = 'csv'
+    rest = []
+    for token in args:
+        if token.lower() in EXPORT_FORMATS:
+            export_format = token.lower()
+        else:
+            rest.append(token)
+    return parse_filter_args(rest, today), export_format
+
+
+def iter_ledger(filename: str) -> Iterator[List[str]]:
+    """Строки CSV журнала по одной, включая заголовок"""
+    with open(filename, 'r', newline='', encoding='utf-8') as file:
+        for row in csv.reader(file):
+            yield row
+
+
+def iter_filtered(filename: str, export_filter: ExportFilter,
+                  overrides: Optional[Dict[int, Optional[List[str]]]] = None) -> Iterator[List[str]]:
+    """Заголовок и подходящие под фильтр записи журнала (с подставленными правками overrides)"""
+    rows = iter_ledger(filename)
+    header = next(rows, None)
+    if header is not None:
+        yield header
+    for _, row in resolve_rows(rows, overrides):
+        if export_filter.matches(row):
+            yield row
+
+
+# Сколько строк CSV копить в памяти перед записью в файл выгрузки
+_CSV_CHUNK_ROWS = 1000
+
+
+def _write_csv(rows: Iterator[List[str]], output: IO[bytes]) -> int:
+    # Строки пишутся в StringIO и кодируются пачками: TextIOWrapper поверх
+    # SpooledTemporaryFile в Python 3.9 не работает (нет readable)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % _CSV_CHUNK_ROWS == 0:
+            output.write(buffer.getvalue().encode('utf-8'))
+            buffer.seek(0)
+            buffer.truncate()
+    output.write(buffer.getvalue().encode('utf-8'))
+    return count
+
+
+def _write_csv_gzip(rows: Iterator[List[str]], output: IO[bytes]) -> int:
+    with gzip.GzipFile(fileobj=output, mode='wb', filename='sales_data.csv') as compressed:
+        return _write_csv(rows, compressed)
+
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Продажи" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _xlsx_row(row: List[str]) -> str:
+    cells = ''.join(
+        f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_XML_INVALID.sub("", value))}</t></is></c>'
+        for value in row
+    )
+    return f'<row>{cells}</row>'
+
+
+def _write_xlsx(rows: Iterator[List[str]], output: IO[bytes]) -> int:
+    """Минимальная книга XLSX: лист пишется в архив построчно, без общей таблицы строк"""
+    count = 0
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', _XLSX_ROOT_RELS)
+        archive.writestr('xl/workbook.xml', _XLSX_WORKBOOK)
+        archive.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            for row in rows:
+                sheet.write(_xlsx_row(row).encode('utf-8'))
+                count += 1
+            sheet.write(b'</sheetData></worksheet>')
+    return count
+
+
+_WRITERS = {
+    'csv': _write_csv,
+    'gz': _write_csv_gzip,
+    'gzip': _write_csv_gzip,
+    'xlsx': _write_xlsx,
+}
+
+
+def build_export(filename: str, export_filter: ExportFilter, export_format: str,
+                 spool_bytes: int = EXPORT_SPOOL_BYTES,
+                 overrides: Optional[Dict[int, Optional[List[str]]]] = None) -> Tuple[IO[bytes], int]:
+    """
+    Выгрузка журнала во временный файл
+
+    Записи читаются и пишутся по одной, поэтому память не зависит от размера
+    журнала: до spool_bytes файл держится в памяти, дальше - на диске.
+    Исправленные записи (overrides) выгружаются в новом виде, отмененные пропускаются.
+
+    Returns:
+        Tuple[IO[bytes], int]: файл, перемотанный в начало, и число записей без заголовка
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+    try:
+        count = _WRITERS[export_format](iter_filtered(filename, export_filter, overrides), output)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output, max(count - 1, 0)
+
+
+def export_filename(export_format: str) -> str:
+    return f"sales_data.{EXPORT_FORMATS[export_format]}"
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from telegram import Update
+from telegram.ext import filters
+from config import (
+    FLOOD_USER_PER_MINUTE, FLOOD_USER_BURST, FLOOD_CHAT_PER_MINUTE, FLOOD_CHAT_BURST,
+    FLOOD_COMMAND_PER_MINUTE, FLOOD_COMMAND_BURST, INGEST_QUEUE_SIZE, OVERLOAD_POLICY, OVERLOAD_DEFER_SECONDS, FLOOD_NOTICE_INTERVAL
+)
+from metrics import Counter
+from rate_limiter import TokenBucket
+from reply_scheduler import ReplyScheduler
+
+logger = logging.getLogger(__name__)
+
+FLOOD_SHED = Counter(
+    'salesbot_flood_shed_total', 'Обновления, отброшенные ограничением частоты или перегрузкой', ['reason']
+)
+
+# Политики при заполненной очереди приема
+POLICIES = ('reject', 'defer', 'drop_duplicates')
+
+# Как часто убирать корзины простаивающих пользователей и чатов (по числу обновлений)
+_PRUNE_EVERY = 1000
+
+_NOTICES = {
+    'user': "⏳ Слишком много сообщений подряд. Подождите немного и повторите.",
+    'chat': "⏳ В этом чате слишком много сообщений. Подождите немного и повторите.",
+    'command': "⏳ Слишком много команд подряд. Подождите немного и повторите.",
+}
+
+
+class FloodControl:
+    """
+    Ограничение частоты сообщений и защита от перегрузки.
+
+    Перед обработкой обновление проходит корзины токенов своего
+    пользователя и чата: тот, кто пишет слишком часто, получает короткое
+    предупреждение, а лишние сообщения отбрасываются. Токен берется,
+    только если он есть во всех корзинах обновления. Команды проходят
+    через отдельную корзину пользователя, чтобы поток сообщений о
+    продажах не блокировал /stats и /sync, а команды - сообщения. Прошедшие
+    обновления занимают место в общей очереди приема (INGEST_QUEUE_SIZE
+    обновлений в обработке или в ожидании). Когда очередь заполнена,
+    действует OVERLOAD_POLICY:
+
+    - reject - отказать с коротким сообщением;
+    - defer - ждать места до OVERLOAD_DEFER_SECONDS, потом отказать;
+    - drop_duplicates - молча отбросить сообщение, если такое же из этого
+      чата уже ждет обработки, остальные - как defer.
+
+    Освободившееся место отдается ждущим обновлениям по очереди (FIFO), а
+    новые обновления встают за ними: иначе новое сообщение чата могло бы
+    обогнать ждущее и нарушить порядок обработки внутри чата.
+
+    Предупреждения уходят через ReplyScheduler бота - в рамках тех же
+    лимитов Telegram, что и остальные ответы.
+    """
+
+    def __init__(self, user_per_minute: float = FLOOD_USER_PER_MINUTE, user_burst: float = FLOOD_USER_BURST,
+                 chat_per_minute: float = FLOOD_CHAT_PER_MINUTE, chat_burst: float = FLOOD_CHAT_BURST,
+                 command_per_minute: float = FLOOD_COMMAND_PER_MINUTE, command_burst: float = FLOOD_COMMAND_BURST,
+                 queue_size: int = INGEST_QUEUE_SIZE, policy: str = OVERLOAD_POLICY,
+                 defer_seconds: float = OVERLOAD_DEFER_SECONDS, replies: Optional[ReplyScheduler] = None):
+        if policy not in POLICIES:
+            logger.warning(f"Неизвестная OVERLOAD_POLICY={policy}, используется defer")
+            policy = 'defer'
+        self.user_per_minute = user_per_minute
+        self.user_burst = user_burst
+        self.chat_per_minute = chat_per_minute
+        self.chat_burst = chat_burst
+        self.command_per_minute = command_per_minute
+        self.command_burst = command_burst
+        self.queue_size = queue_size
+        self.policy = policy
+        self.defer_seconds = defer_seconds
+        self.replies = replies or ReplyScheduler()
+        self.in_flight = 0
+        self.shed = 0
+        self._user_buckets: Dict[int, TokenBucket] = {}
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._command_buckets: Dict[int, TokenBucket] = {}
+        # (chat_id, текст) -> сколько таких сообщений в очереди
+        self._pending_texts: Dict[Tuple[int, str], int] = {}
+        self._notified_at: Dict[int, float] = {}
+        # Обновления, ждущие места в очереди приема, в порядке прихода
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._admitted = 0
+
+    @staticmethod
+    def _bucket(buckets: Dict[int, TokenBucket], key: int, rate: float, burst: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _prune(self, now: float):
+        """Полная корзина ничем не отличается от новой - ее можно забыть"""
+        for buckets in (self._user_buckets, self._chat_buckets, self._command_buckets):
+            for key in [key for key, bucket in buckets.items() if bucket.current(now) >= bucket.capacity]:
+                del buckets[key]
+        self._notified_at = {
+            user_id: at for user_id, at in self._notified_at.items() if now - at < FLOOD_NOTICE_INTERVAL
+        }
+
+    @staticmethod
+    def _text_key(update: Update) -> Optional[Tuple[int, str]]:
+        message = update.effective_message
+        if message is None or not message.text:
+            return None
+        return update.effective_chat.id, message.text
+
+    async def admit(self, update: object) -> bool:
+        """
+        Решает, обрабатывать ли обновление. Если да - оно занимает место
+        в очереди приема до вызова release.
+        """
+        if not isinstance(update, Update) or update.effective_user is None or update.effective_chat is None:
+            self._enter(None)
+            return True
+
+        now = time.monotonic()
+        self._admitted += 1
+        if self._admitted % _PRUNE_EVERY == 0:
+            self._prune(now)
+
+        user_id = update.effective_user.id
+        if filters.COMMAND.check_update(update):
+            buckets = [
+                ('command', self._bucket(self._command_buckets, user_id, self.command_per_minute, self.command_burst)),
+            ]
+        else:
+            buckets = [
+                ('user', self._bucket(self._user_buckets, user_id, self.user_per_minute, self.user_burst)),
+                ('chat', self._bucket(
+                    self._chat_buckets, update.effective_chat.id, self.chat_per_minute, self.chat_burst
+                )),
+            ]
+        # Сначала проверяются все корзины: отказ по чату не должен тратить токен пользователя
+        for reason, bucket in buckets:
+            if bucket.current(now) < 1:
+                await self._reject(update, reason, _NOTICES[reason])
+                return False
+        for _, bucket in buckets:
+            bucket.try_acquire(now)
+
+        key = self._text_key(update)
+        if self.in_flight >= self.queue_size or self._waiters:
+            if self.policy == 'drop_duplicates' and key is not None and self._pending_texts.get(key):
+                self._count_shed('duplicate')
+                return False
+            if self.policy == 'reject' or not await self._wait_for_room():
+                await self._reject(update, 'queue', "⏳ Бот сейчас перегружен. Отправьте сообщение еще раз через минуту.")
+                return False
+            # Место уже занято за этим обновлением в release
+            self._track(key)
+            return True
+
+        self._enter(key)
+        return True
+
+    def _enter(self, key: Optional[Tuple[int, str]]):
+        self.in_flight += 1
+        self._track(key)
+
+    def _track(self, key: Optional[Tuple[int, str]]):
+        if key is not None:
+            self._pending_texts[key] = self._pending_texts.get(key, 0) + 1
+
+    async def _wait_for_room(self) -> bool:
+        """Ждет, пока release передаст этому обновлению место, не дольше defer_seconds"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.defer_seconds)
+            return True
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Место уже передано, но обработки не будет - отдаем его следующему
+                self._free()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+        # Место могло быть передано в момент истечения ожидания
+        return not waiter.cancelled()
+
+    async def release(self, update: object):
+        """Освобождает место в очереди приема после обработки обновления или передает его первому ждущему"""
+        key = self._text_key(update) if isinstance(update, Update) and update.effective_chat else None
+        if key is not None and key in self._pending_texts:
+            self._pending_texts[key] -= 1
+            if not self._pending_texts[key]:
+                del self._pending_texts[key]
+        self._free()
+
+    def _free(self):
+        self.in_flight -= 1
+        # Передача без await между освобождением и захватом: новое обновление не успеет занять место
+        while self._waiters and self.in_flight < self.queue_size:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _count_shed(self, reason: str):
+        self.shed += 1
+        FLOOD_SHED.inc(reason=reason)
+
+    async def _reject(self, update: Update, reason: str, notice: str):
+        """Отбрасывает обновление; предупреждение - не чаще раза в FLOOD_NOTICE_INTERVAL на пользователя"""
+        self._count_shed(reason)
+        user_id = update.effective_user.id
+        now = time.monotonic()
+        if now - self._notified_at.get(user_id, -FLOOD_NOTICE_INTERVAL) < FLOOD_NOTICE_INTERVAL:
+            return
+        self._notified_at[user_id] = now
+        logger.warning(f"Обновление от {user_id} отброшено ({reason})")
+        if update.effective_message is not None:
+            try:
+                await self.replies.reply(update.effective_message, notice)
+            except Exception as e:
+                logger.error(f"Не удалось отправить предупреждение о частоте: {e}")
+
+    def snapshot(self) -> Dict[str, int]:
+        """Глубина очереди приема и количество отброшенных обновлений"""
+        return {
+            'in_flight': self.in_flight,
+            'queue_size': self.queue_size,
+            'shed': self.shed,
+            'waiting': len(self._waiters),
+            'tracked_users': len(self._user_buckets),
+            'tracked_chats': len(self._chat_buckets),
+        }
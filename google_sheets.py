@@ -1,26 +1,192 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import functools
 import gspread
+import hashlib
 import json
 import os
+import re
+import threading
+import time
 from google.oauth2.service_account import Credentials
 import logging
-from typing import List, Optional
-from config import GOOGLE_SHEETS_ID, SHEET_NAME, get_google_credentials, is_google_sheets_enabled
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from rate_limiter import get_rate_limiter
+from config import (
+    GOOGLE_SHEETS_ID, SHEET_NAME, SHEETS_PAGE_SIZE, SHEETS_PAGES_PER_BATCH,
+    SHEETS_SHARDING, SHEETS_TEMPLATE_SHEET, SHEETS_SUMMARY_SHEET,
+    SHEETS_SUMMARY_FLUSH_EVERY, SHEETS_SUMMARY_FLUSH_SECONDS,
+    get_google_credentials, is_google_sheets_enabled
+)
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Номер строки из диапазона ответа API, например "'Лист1'!A18:D18" -> 18
+_UPDATED_ROW_RE = re.compile(r'![A-Z]+(\d+)')
+# Дата публикации в записи: ДД.ММ.ГГГГ
+_RECORD_DATE_RE = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})')
+# Название листа-шарда: ГГГГ-ММ
+_PERIOD_TITLE_RE = re.compile(r'^\d{4}-\d{2}$')
+# Длина хэша строки (SHA-1, см. sheets_sync.row_hash)
+_HASH_SIZE = 20
+_NUMBER_RE = re.compile(r'(\d+(?:[.,]\d+)?)')
+
+def _locked(method):
+    """Метод менеджера под его блокировкой (см. GoogleSheetsManager._lock)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _cells(row: List[str]) -> List[str]:
+    """Четыре ячейки строки без пробелов по краям - для сравнения строк листа и журнала"""
+    return [str(value).strip() for value in (list(row) + [''] * 4)[:4]]
+
+
+class _WorksheetState:
+    """Открытый лист с локальным кэшем прочитанных строк и курсором чтения"""
+    
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        # Кэш строк листа (включая заголовок) и номер следующей непрочитанной строки
+        self.cache: List[List[str]] = []
+        self.next_row = 1
+        # Хэши строк кэша для сверки: верны для первых hashed строк кэша
+        self.hashes = bytearray()
+        self.hashed = 0
+        # Хэши полных блоков строк данных для (размер блока, строк заголовка)
+        self.leaves: List[bytes] = []
+        self._leaves_key: Optional[Tuple[int, int]] = None
+    
+    def _changed(self, index: int):
+        """Строка кэша index (0-based) изменилась - ее хэш и хэши блоков после нее пересчитываются"""
+        self.hashed = min(self.hashed, index)
+    
+    def set_row(self, index: int, row: List[str]):
+        """Заменяет строку кэша; хэши сбрасываются, только если строка действительно другая"""
+        if self.cache[index] != row:
+            self.cache[index] = row
+            self._changed(index)
+    
+    def invalidate(self, from_row: Optional[int] = None):
+        """Сбрасывает кэш начиная со строки from_row (1-based), без аргумента - полностью"""
+        if from_row is None or from_row < 1:
+            from_row = 1
+        if from_row < self.next_row:
+            del self.cache[from_row - 1:]
+            self.next_row = from_row
+            self._changed(from_row - 1)
+    
+    def on_rows_written(self, response: Optional[dict], rows: List[List[str]]):
+        """
+        Обновляет кэш после собственной записи в лист.
+        
+        Если строки легли ровно на курсор, дописываем их в кэш без чтения,
+        иначе (кто-то писал в лист параллельно) сбрасываем кэш с первой
+        затронутой строки - при следующем чтении она будет перечитана.
+        """
+        first_row = None
+        try:
+            updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+            match = _UPDATED_ROW_RE.search(updated_range)
+            if match:
+                first_row = int(match.group(1))
+        except (AttributeError, ValueError):
+            first_row = None
+            
+        if first_row == self.next_row:
+            self.cache.extend([list(row) for row in rows])
+            self.next_row += len(rows)
+        else:
+            self.invalidate(first_row)
+    
+    def header_rows(self, headers: List[str]) -> int:
+        """Количество строк заголовка в начале листа (по данным кэша)"""
+        return 1 if self.cache and self.cache[0] == headers else 0
+    
+    def data_end(self, headers: List[str]) -> int:
+        """Индекс в кэше после последней непустой строки данных"""
+        offset = self.header_rows(headers)
+        end = len(self.cache)
+        while end > offset and not any(self.cache[end - 1]):
+            end -= 1
+        return end
+    
+    def data_rows(self, headers: List[str], start: int = 0, end: Optional[int] = None) -> List[List[str]]:
+        """Строки данных из кэша (без заголовка и пустого хвоста), с start по end"""
+        offset = self.header_rows(headers)
+        stop = self.data_end(headers)
+        if end is not None:
+            stop = min(stop, offset + end)
+        return self.cache[offset + start:stop]
+    
+    def data_leaves(self, headers: List[str], block_size: int, row_hash: Callable[[List[str]], bytes]) -> List[bytes]:
+        """
+        Хэши блоков строк данных, как sheets_sync.block_hashes: SHA-1 подряд
+        идущих хэшей строк. Хэши строк и полных блоков хранятся между
+        вызовами - заново считаются только строки и блоки после первой
+        измененной строки кэша.
+        """
+        offset = self.header_rows(headers)
+        end = self.data_end(headers)
+        if self._leaves_key != (block_size, offset):
+            self._leaves_key, self.leaves = (block_size, offset), []
+        del self.leaves[max(self.hashed - offset, 0) // block_size:]
+        del self.hashes[self.hashed * _HASH_SIZE:]
+        for row in self.cache[self.hashed:end]:
+            self.hashes += row_hash(row)
+        self.hashed = end
+        
+        step = block_size * _HASH_SIZE
+        full_blocks = (end - offset) // block_size
+        with memoryview(self.hashes) as view:
+            data = view[offset * _HASH_SIZE:end * _HASH_SIZE]
+            for block in range(len(self.leaves), full_blocks):
+                self.leaves.append(hashlib.sha1(data[block * step:(block + 1) * step]).digest())
+            leaves = list(self.leaves)
+            if (end - offset) % block_size:
+                leaves.append(hashlib.sha1(data[full_blocks * step:]).digest())
+            data.release()
+        return leaves
+
 class GoogleSheetsManager:
     """Класс для работы с Google Sheets"""
     
-    def __init__(self):
+    def __init__(self, connect: bool = True, sheet_name: Optional[str] = None):
+        """
+        Args:
+            connect: Подключиться к таблице из настроек (False - таблицу передают позже через attach)
+            sheet_name: Основной лист (по умолчанию SHEET_NAME)
+        """
         self.sheet_id = GOOGLE_SHEETS_ID
-        self.sheet_name = SHEET_NAME
+        self.sheet_name = sheet_name or SHEET_NAME
+        self.headers = ['Ник покупателя', 'Дата и время публикации', 'Сумма', 'Источник размещения']
+        self.summary_headers = ['Период', 'Записей', 'USDT', '₽']
+        self.page_size = SHEETS_PAGE_SIZE
+        self.pages_per_batch = SHEETS_PAGES_PER_BATCH
+        # Шардирование по месяцам: каждая запись уходит на лист своего периода (ГГГГ-ММ)
+        self.sharding = SHEETS_SHARDING == "month"
+        self.template_sheet_name = SHEETS_TEMPLATE_SHEET
+        self.summary_sheet_name = SHEETS_SUMMARY_SHEET
+        # Все запросы к API идут через общий ограничитель квот
+        self.rate_limiter = get_rate_limiter()
+        # Кэш листов, курсоры и сводку меняют поток приемников, сверка в пуле чтения
+        # и подключение листов чатов - методы, которые их трогают, работают под блокировкой
+        self._lock = threading.RLock()
+        self.spreadsheet = None
         self.worksheet = None
-        self._setup_connection()
+        # Кэш открытых листов: название -> состояние (кэш строк и курсор)
+        self._sheets: Dict[str, _WorksheetState] = {}
+        # Сводка по периодам: период -> [записей, USDT, ₽]; пишется пачками
+        self._summary: Dict[str, List[float]] = {}
+        self._summary_worksheet = None
+        self._summary_pending = 0
+        self._summary_flushed_at = time.monotonic()
+        if connect:
+            self._setup_connection()
     
     def _setup_connection(self):
         """Настройка подключения к Google Sheets"""
@@ -48,16 +214,132 @@ class GoogleSheetsManager:
             
             # Подключаемся к Google Sheets
             gc = gspread.authorize(creds)
-            spreadsheet = gc.open_by_key(self.sheet_id)
-            self.worksheet = spreadsheet.worksheet(self.sheet_name)
+            self.attach(self._read(gc.open_by_key, self.sheet_id))
             
             logger.info("Подключение к Google Sheets установлено")
             
         except Exception as e:
             logger.error(f"Ошибка подключения к Google Sheets: {e}")
             logger.info("Google Sheets отключен, данные будут сохраняться только в CSV")
+            self.spreadsheet = None
             self.worksheet = None
     
+    def _read(self, method, *args, **kwargs):
+        """Запрос к API на чтение через ограничитель квот"""
+        return self.rate_limiter.call('read', method, *args, **kwargs)
+    
+    def _write(self, method, *args, **kwargs):
+        """Запрос к API на запись через ограничитель квот (в приоритете перед чтением)"""
+        return self.rate_limiter.call('write', method, *args, **kwargs)
+    
+    @_locked
+    def attach(self, spreadsheet, create: bool = False):
+        """
+        Подключает открытую таблицу: основной лист, при шардировании - сводку
+        
+        Args:
+            create: Создать основной лист с заголовками, если его нет
+        """
+        self.spreadsheet = spreadsheet
+        self._sheets = {}
+        try:
+            self.worksheet = self._read(spreadsheet.worksheet, self.sheet_name)
+            self._sheets[self.sheet_name] = _WorksheetState(self.worksheet)
+        except gspread.exceptions.WorksheetNotFound:
+            if create and not self.sharding:
+                self.worksheet = self._create_shard(self.sheet_name)
+                self._sheets[self.sheet_name] = _WorksheetState(self.worksheet)
+            elif not self.sharding:
+                raise
+            # При шардировании основной лист не обязателен - записи идут в листы периодов
+            self.worksheet = None
+            
+        if self.sharding:
+            self._load_summary()
+    
+    @_locked
+    def for_sheet(self, sheet_name: str) -> 'GoogleSheetsManager':
+        """
+        Менеджер другого листа той же таблицы - с общим подключением и квотами.
+        Лист создается, если его нет; листы по месяцам для него не ведутся.
+        """
+        manager = GoogleSheetsManager(connect=False, sheet_name=sheet_name)
+        manager.sharding = False
+        if self.spreadsheet is not None:
+            try:
+                manager.attach(self.spreadsheet, create=True)
+            except Exception as e:
+                logger.error(f"Не удалось подключить лист {sheet_name}: {e}")
+                manager.spreadsheet = None
+                manager.worksheet = None
+        return manager
+    
+    def shard_title(self, datetime: str) -> str:
+        """Название листа для записи: период ГГГГ-ММ по дате публикации или основной лист"""
+        if not self.sharding:
+            return self.sheet_name
+        match = _RECORD_DATE_RE.search(datetime or '')
+        if match:
+            day, month, year = match.groups()
+            return f"{year}-{int(month):02d}"
+        return time.strftime('%Y-%m')
+    
+    @_locked
+    def _state(self, title: Optional[str] = None, create: bool = False) -> Optional[_WorksheetState]:
+        """
+        Состояние листа по названию (по умолчанию - основной лист).
+        
+        Открытые листы кэшируются; лист периода при create=True создается
+        по шаблону заголовков, если его еще нет.
+        """
+        title = title or self.sheet_name
+        state = self._sheets.get(title)
+        if state is not None:
+            return state
+        if self.spreadsheet is None:
+            return None
+            
+        try:
+            worksheet = self._read(self.spreadsheet.worksheet, title)
+        except gspread.exceptions.WorksheetNotFound:
+            if not create:
+                return None
+            worksheet = self._create_shard(title)
+            
+        state = _WorksheetState(worksheet)
+        self._sheets[title] = state
+        return state
+    
+    def _create_shard(self, title: str):
+        """Создает лист периода: копией листа-шаблона или пустым листом с заголовками"""
+        template = None
+        if self.template_sheet_name:
+            try:
+                template = self._read(self.spreadsheet.worksheet, self.template_sheet_name)
+            except gspread.exceptions.WorksheetNotFound:
+                logger.warning(f"Лист-шаблон {self.template_sheet_name} не найден, создаю лист без шаблона")
+                
+        if template is not None:
+            worksheet = self._write(self.spreadsheet.duplicate_sheet, template.id, new_sheet_name=title)
+        else:
+            worksheet = self._write(self.spreadsheet.add_worksheet, title=title, rows=1000, cols=len(self.headers))
+            self._write(worksheet.update, 'A1:D1', [self.headers])
+        logger.info(f"Создан лист {title}")
+        return worksheet
+    
+    def has_sheet(self, title: Optional[str] = None) -> bool:
+        """Проверяет, есть ли лист в таблице (без создания)"""
+        return self._state(title) is not None
+    
+    def shard_titles(self) -> List[str]:
+        """Листы с данными: основной лист и листы периодов по порядку"""
+        if self.spreadsheet is None:
+            return []
+        titles = [worksheet.title for worksheet in self._read(self.spreadsheet.worksheets)]
+        periods = sorted(title for title in titles if _PERIOD_TITLE_RE.match(title))
+        return ([self.sheet_name] if self.sheet_name in titles else []) + periods
+    
+    @_locked
     def add_record(self, buyer: str, datetime: str, amount: str, source: str) -> bool:
         """
         Добавляет запись в Google Sheets
@@ -71,62 +353,329 @@ class GoogleSheetsManager:
         Returns:
             bool: True если запись успешно добавлена
         """
-        if not self.worksheet:
+        if not self.is_connected():
             logger.warning("Google Sheets не подключен")
             return False
         
         try:
-            # Добавляем строку в конец таблицы
+            # Добавляем строку в конец листа (при шардировании - листа периода)
+            title = self.shard_title(datetime)
+            state = self._state(title, create=True)
             row = [buyer, datetime, amount, source]
-            self.worksheet.append_row(row)
+            response = self._write(state.worksheet.append_row, row)
+            state.on_rows_written(response, [row])
             
-            logger.info(f"Запись добавлена в Google Sheets: {row}")
+            logger.debug("Запись добавлена в Google Sheets (%s): %s", title, row)
+            self._count_in_summary(title, [row])
             return True
             
         except Exception as e:
             logger.error(f"Ошибка при добавлении записи в Google Sheets: {e}")
             return False
     
-    def get_all_records(self) -> Optional[List[List]]:
+    @_locked
+    def append_records(self, rows: List[List[str]], batch_size: int = 500, title: Optional[str] = None) -> int:
         """
-        Получает все записи из Google Sheets
+        Дописывает строки в конец листа пачками (один запрос на пачку)
         
         Returns:
-            List[List]: Список всех записей или None при ошибке
+            int: Количество записанных строк
         """
-        if not self.worksheet:
+        state = self._state(title, create=True) if self.is_connected() else None
+        if state is None:
             logger.warning("Google Sheets не подключен")
-            return None
+            return 0
+            
+        written = 0
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            response = self._write(state.worksheet.append_rows, chunk)
+            state.on_rows_written(response, chunk)
+            written += len(chunk)
+        if written:
+            self._count_in_summary(title or self.sheet_name, rows)
+        return written
+    
+    @_locked
+    def update_rows(self, updates: Dict[int, List[List[str]]], title: Optional[str] = None) -> int:
+        """
+        Перезаписывает несколько диапазонов строк одним batch_update
+        
+        Args:
+            updates: {номер первой строки листа (1-based): строки}
+            
+        Returns:
+            int: Количество перезаписанных строк
+        """
+        state = self._state(title)
+        if state is None or not updates:
+            return 0
+            
+        data = []
+        for first_row, rows in sorted(updates.items()):
+            padded = [(list(row) + [''] * 4)[:4] for row in rows]
+            data.append({
+                'range': f"A{first_row}:D{first_row + len(padded) - 1}",
+                'values': padded,
+            })
+        self._write(state.worksheet.batch_update, data)
+        
+        # Пишем сквозь кэш: перезаписанные строки, попавшие в кэш, заменяем
+        for first_row, rows in updates.items():
+            for i, row in enumerate(rows):
+                index = first_row - 1 + i
+                if index < len(state.cache):
+                    state.set_row(index, list(row) if any(row) else [])
+        return sum(len(rows) for rows in updates.values())
+    
+    @_locked
+    def replace_record(self, old: List[str], new: List[str], hint: Optional[int] = None) -> bool:
+        """
+        Заменяет строку записи old на new одним обновлением диапазона A:D
+        
+        Строка ищется на листе, куда попала old: сначала по подсказке hint
+        (номер записи в журнале - без шардирования он совпадает с номером
+        строки данных), иначе по кэшу листа с конца. Если исправленная запись
+        относится к другому месяцу, строка удаляется со старого листа и
+        дописывается на лист нового месяца. Сводка по периодам получает
+        разницу: минус старая запись, плюс новая. Пустая new (отмена) остается
+        на месте пустой строкой.
         
+        Returns:
+            bool: True если строка найдена и перезаписана
+        """
+        if not self.is_connected():
+            return False
+        title = self.shard_title(old[1] if len(old) > 1 else '')
+        state = self._state(title)
+        if state is None:
+            return False
+            
+        target = _cells(old)
+        row = None
+        if hint is not None and not self.sharding:
+            candidate = (state.header_rows(self.headers) if state.cache else 1) + hint
+            fresh = self.refresh_rows([(candidate, candidate)], title)
+            if fresh and _cells(fresh[candidate][0]) == target:
+                row = candidate
+        if row is None:
+            if self.fetch_new_rows(title) is None:
+                return False
+            for index in range(len(state.cache) - 1, -1, -1):
+                if _cells(state.cache[index]) == target:
+                    row = index + 1
+                    break
+        if row is None:
+            return False
+            
+        new_title = self.shard_title(new[1]) if any(new) else title
+        if new_title == title:
+            self.update_rows({row: [new]}, title)
+        else:
+            self._write(state.worksheet.delete_rows, row)
+            state.invalidate(row)
+            self.append_records([new], title=new_title)
+        self._count_in_summary(title, [old], sign=-1)
+        if new_title == title and any(new):
+            self._count_in_summary(title, [new])
+        return True
+    
+    @_locked
+    def refresh_rows(self, row_ranges: List[Tuple[int, int]], title: Optional[str] = None) -> Dict[int, List[List[str]]]:
+        """
+        Перечитывает из листа только указанные диапазоны строк (одним batch_get)
+        и обновляет ими кэш.
+        
+        Args:
+            row_ranges: Список (первая строка, последняя строка), 1-based
+            
+        Returns:
+            Dict: {первая строка диапазона: прочитанные строки}
+        """
+        state = self._state(title)
+        if state is None or not row_ranges:
+            return {}
+            
+        value_ranges = self._read(
+            state.worksheet.batch_get,
+            [f"A{first}:D{last}" for first, last in row_ranges]
+        )
+        result = {}
+        for (first, last), value_range in zip(row_ranges, value_ranges):
+            rows = [list(values) for values in value_range]
+            rows += [[] for _ in range(last - first + 1 - len(rows))]
+            for i, row in enumerate(rows):
+                index = first - 1 + i
+                if index < len(state.cache):
+                    state.set_row(index, row)
+            result[first] = rows
+        return result
+    
+    @_locked
+    def header_rows(self, title: Optional[str] = None) -> int:
+        """Количество строк заголовка в начале листа (по данным кэша)"""
+        state = self._state(title)
+        return state.header_rows(self.headers) if state else 0
+    
+    @_locked
+    def cached_data_rows(self, title: Optional[str] = None, start: int = 0,
+                         end: Optional[int] = None) -> List[List[str]]:
+        """Строки данных из локального кэша (без заголовка и пустого хвоста), с start по end"""
+        state = self._state(title)
+        return state.data_rows(self.headers, start, end) if state else []
+    
+    @_locked
+    def cached_data_leaves(self, block_size: int, row_hash: Callable[[List[str]], bytes],
+                           title: Optional[str] = None) -> Tuple[int, List[bytes]]:
+        """
+        Число строк данных в кэше и хэши их блоков (см. _WorksheetState.data_leaves) -
+        для сверки без повторного хэширования неизмененных строк
+        """
+        state = self._state(title)
+        if state is None:
+            return 0, []
+        leaves = state.data_leaves(self.headers, block_size, row_hash)
+        return state.data_end(self.headers) - state.header_rows(self.headers), leaves
+    
+    @_locked
+    def invalidate_cache(self, from_row: Optional[int] = None, title: Optional[str] = None):
+        """
+        Сбрасывает локальный кэш чтения начиная со строки from_row (1-based).
+        Без аргумента кэш сбрасывается полностью.
+        """
+        state = self._state(title)
+        if state is not None:
+            state.invalidate(from_row)
+    
+    def _fetch_pages(self, worksheet, start_row: int) -> Iterator[List[List[str]]]:
+        """
+        Читает строки листа начиная со start_row страницами через batch_get.
+        
+        За один запрос запрашивается pages_per_batch диапазонов вида A{n}:D{m}.
+        API обрезает пустые строки в конце диапазона, поэтому неполная
+        страница еще не конец листа: стертые строки отдаются пустыми, если
+        за ними есть данные. Чтение прекращается на пустой странице за
+        пределами сетки листа (row_count), пустой хвост не отдается.
+        """
+        row = start_row
+        row_count = getattr(worksheet, 'row_count', 0) or 0
+        # Пустые строки, про которые еще неизвестно, есть ли после них данные
+        blank = 0
+        while True:
+            ranges = []
+            for i in range(self.pages_per_batch):
+                first = row + i * self.page_size
+                ranges.append(f"A{first}:D{first + self.page_size - 1}")
+                
+            value_ranges = self._read(worksheet.batch_get, ranges)
+            for i, value_range in enumerate(value_ranges):
+                page = [list(values) for values in value_range]
+                last = row + (i + 1) * self.page_size - 1
+                if not page and last >= row_count:
+                    return
+                if page:
+                    yield [[] for _ in range(blank)] + page
+                    blank = 0
+                blank += self.page_size - len(page)
+            row += self.pages_per_batch * self.page_size
+    
+    @_locked
+    def fetch_new_rows(self, title: Optional[str] = None) -> Optional[List[List[str]]]:
+        """
+        Дочитывает в кэш только новые строки листа (после курсора)
+        
+        Returns:
+            List[List]: Новые строки или None при ошибке
+        """
+        state = self._state(title)
+        if state is None:
+            logger.warning("Google Sheets не подключен")
+            return None
+            
         try:
-            # Получаем все записи
-            records = self.worksheet.get_all_values()
-            logger.info(f"Получено {len(records)} записей из Google Sheets")
-            return records
+            new_rows = []
+            for page in self._fetch_pages(state.worksheet, state.next_row):
+                new_rows.extend(page)
+            state.cache.extend(new_rows)
+            state.next_row += len(new_rows)
+            if new_rows:
+                logger.info(f"Прочитано {len(new_rows)} новых строк из Google Sheets")
+            return new_rows
             
         except Exception as e:
-            logger.error(f"Ошибка при получении записей из Google Sheets: {e}")
+            logger.error(f"Ошибка при чтении новых строк из Google Sheets: {e}")
+            return None
+    
+    @_locked
+    def get_all_records(self, title: Optional[str] = None) -> Optional[List[List]]:
+        """
+        Получает все записи из Google Sheets
+        
+        Ранее прочитанные строки берутся из локального кэша,
+        из листа дочитываются только новые.
+        
+        Returns:
+            List[List]: Список всех записей или None при ошибке
+        """
+        state = self._state(title)
+        if state is None:
+            logger.warning("Google Sheets не подключен")
             return None
+        
+        if self.fetch_new_rows(title) is None:
+            return None
+    
+        logger.info(f"Получено {len(state.cache)} записей из Google Sheets")
+        return [list(row) for row in state.cache]
     
-    def setup_headers(self) -> bool:
+    def iter_record_pages(self) -> Iterator[List[List[str]]]:
+        """
+        Постранично отдает записи всех листов с данными без заголовков
+        (для восстановления локального CSV). Прочитанные страницы попадают в кэш.
+        """
+        if not self.is_connected():
+            logger.warning("Google Sheets не подключен")
+            return
+            
+        for title in self.shard_titles():
+            with self._lock:
+                state = self._state(title)
+                state.invalidate()
+            first_page = True
+            for page in self._fetch_pages(state.worksheet, 1):
+                with self._lock:
+                    state.cache.extend(page)
+                    state.next_row += len(page)
+                if first_page and page[0] == self.headers:
+                    page = page[1:]
+                first_page = False
+                if page:
+                    yield page
+    
+    @_locked
+    def setup_headers(self, title: Optional[str] = None) -> bool:
         """
         Настраивает заголовки в Google Sheets
         
         Returns:
             bool: True если заголовки успешно настроены
         """
-        if not self.worksheet:
-            logger.warning("Google Sheets не подключен")
-            return False
+        state = self._state(title)
+        if state is None:
+            # При шардировании основного листа может не быть - листы периодов создаются с заголовками
+            if not self.is_connected():
+                logger.warning("Google Sheets не подключен")
+                return False
+            return self.sharding
         
         try:
-            # Проверяем, есть ли уже заголовки
-            existing_data = self.worksheet.get_all_values()
+            # Проверяем только первую строку, не скачивая весь лист
+            first_row = self._read(state.worksheet.get, 'A1:D1')
             
-            if not existing_data:
+            if not first_row or not any(first_row[0]):
                 # Добавляем заголовки
-                headers = ['Ник покупателя', 'Дата и время публикации', 'Сумма', 'Источник размещения']
-                self.worksheet.append_row(headers)
+                self._write(state.worksheet.update, 'A1:D1', [self.headers])
+                state.invalidate(1)
                 logger.info("Заголовки добавлены в Google Sheets")
             
             return True
@@ -135,6 +684,83 @@ class GoogleSheetsManager:
             logger.error(f"Ошибка при настройке заголовков: {e}")
             return False
     
+    def _load_summary(self):
+        """Читает текущую сводку по периодам одним запросом диапазона"""
+        self._summary = {}
+        try:
+            self._summary_worksheet = self._read(self.spreadsheet.worksheet, self.summary_sheet_name)
+        except gspread.exceptions.WorksheetNotFound:
+            self._summary_worksheet = None
+            return
+            
+        for row in self._read(self._summary_worksheet.get, 'A2:D'):
+            if not row or not _PERIOD_TITLE_RE.match(row[0]):
+                continue
+            values = (list(row[1:]) + ['0'] * 3)[:3]
+            try:
+                self._summary[row[0]] = [float(str(value).replace(',', '.') or 0) for value in values]
+            except ValueError:
+                continue
+    
+    @_locked
+    def _count_in_summary(self, title: str, rows: List[List[str]], sign: int = 1):
+        """
+        Учитывает записанные (sign=1) или убранные с листа (sign=-1) строки в сводке;
+        в лист сводка уходит пачками
+        """
+        if not self.sharding or not _PERIOD_TITLE_RE.match(title):
+            return
+            
+        totals = self._summary.setdefault(title, [0, 0.0, 0.0])
+        for row in rows:
+            totals[0] += sign
+            amount = row[2] if len(row) > 2 else ''
+            number_match = _NUMBER_RE.search(amount)
+            value = float(number_match.group(1).replace(',', '.')) if number_match else 0.0
+            if 'usdt' in amount.lower():
+                totals[1] += sign * value
+            elif '₽' in amount:
+                totals[2] += sign * value
+                
+        self._summary_pending += len(rows)
+        elapsed = time.monotonic() - self._summary_flushed_at
+        if self._summary_pending >= SHEETS_SUMMARY_FLUSH_EVERY or elapsed >= SHEETS_SUMMARY_FLUSH_SECONDS:
+            self.flush_summary()
+    
+    @_locked
+    def flush_summary(self) -> bool:
+        """
+        Записывает сводку по периодам на отдельный лист одним запросом
+        
+        Returns:
+            bool: True если сводка записана (или записывать нечего)
+        """
+        if not self.sharding or not self.is_connected() or not self._summary_pending:
+            return True
+            
+        try:
+            if self._summary_worksheet is None:
+                self._summary_worksheet = self._write(
+                    self.spreadsheet.add_worksheet,
+                    title=self.summary_sheet_name, rows=100, cols=len(self.summary_headers)
+                )
+                
+            values = [self.summary_headers]
+            for period in sorted(self._summary):
+                count, usdt_total, rub_total = self._summary[period]
+                values.append([period, int(count), round(usdt_total, 2), round(rub_total, 2)])
+            self._write(self._summary_worksheet.update, f"A1:D{len(values)}", values)
+            
+            self._summary_pending = 0
+            self._summary_flushed_at = time.monotonic()
+            return True
+            
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении сводки в Google Sheets: {e}")
+            return False
+    
     def is_connected(self) -> bool:
         """Проверяет, подключен ли Google Sheets"""
+        if self.sharding:
+            return self.spreadsheet is not None
         return self.worksheet is not None
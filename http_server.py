@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Ограничения на размер запроса
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+# Сколько держать простаивающее keep-alive соединение
+KEEP_ALIVE_TIMEOUT = 75
+
+
+class Request:
+    """Входящий HTTP запрос"""
+
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    """Ответ обработчика"""
+
+    def __init__(self, status: int = 200, body: bytes = b'', content_type: str = 'text/plain; charset=utf-8',
+                 headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.body = body if isinstance(body, bytes) else str(body).encode('utf-8')
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class AsyncHTTPServer:
+    """
+    Минимальный HTTP/1.1 сервер на asyncio, работающий в цикле событий бота.
+
+    Обработчики регистрируются по методу и пути и возвращают Response.
+    Поддерживает keep-alive, чтобы Telegram мог переиспользовать
+    соединения при доставке вебхуков.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler: Handler):
+        """Регистрирует обработчик для метода и пути"""
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, limit=MAX_HEADER_BYTES
+        )
+        logger.info(f"HTTP сервер запущен на порту {self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._write(writer, Response(431, b'Request Header Fields Too Large'), False)
+                    return
+
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ', 2)
+                except ValueError:
+                    await self._write(writer, Response(400, b'Bad Request'), False)
+                    return
+
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    await self._write(writer, Response(400, b'Bad Request'), False)
+                    return
+                if length > MAX_BODY_BYTES:
+                    await self._write(writer, Response(413, b'Payload Too Large'), False)
+                    return
+                body = await reader.readexactly(length) if length else b''
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                request = Request(method.upper(), target, headers, body)
+                response = await self._dispatch(request)
+                await self._write(writer, response, keep_alive, head_only=request.method == 'HEAD')
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None and request.method == 'HEAD':
+            handler = self._routes.get(('GET', request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return Response(405, b'Method Not Allowed')
+            return Response(404, b'Not Found')
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Ошибка обработчика {request.method} {request.path}: {e}")
+            return Response(500, b'Internal Server Error')
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, response: Response, keep_alive: bool, head_only: bool = False):
+        """Отправляет ответ; на HEAD - только заголовки с тем же Content-Length, что у GET"""
+        reason = HTTPStatus(response.status).phrase
+        lines = [
+            f"HTTP/1.1 {response.status} {reason}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {len(response.body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        lines += [f"{name}: {value}" for name, value in response.headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (b'' if head_only else response.body))
+        await writer.drain()
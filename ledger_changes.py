@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LedgerChanges:
+    """
+    Журнал правок записей: <журнал>.changes.jsonl.
+
+    CSV журнал никогда не переписывается: исправление записи (amend) или
+    ее отмена (retract) дописывается сюда отдельной строкой, а в памяти
+    держится итог - номер записи -> актуальная строка или None для
+    отмененной. Статистика, выгрузки и поиск подставляют итог при чтении.
+    """
+
+    def __init__(self, filename: str):
+        self.path = f"{filename}.changes.jsonl"
+        self._lock = threading.Lock()
+        self.overrides: Dict[int, Optional[List[str]]] = {}
+        # Сколько правок записано - входит в версию журнала
+        self.count = 0
+
+    def load(self):
+        """Читает журнал правок (последняя правка записи побеждает)"""
+        self.overrides = {}
+        self.count = 0
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    change = json.loads(line)
+                    self._apply(change['op'], int(change['row']), change.get('record'))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Пропущена поврежденная строка журнала правок: {e}")
+        if self.count:
+            logger.info(f"Журнал правок: {self.count} правок, затронуто записей {len(self.overrides)}")
+
+    def _apply(self, op: str, row_id: int, record: Optional[List[str]]):
+        self.overrides[row_id] = list(record) if op == 'amend' else None
+        self.count += 1
+
+    def append(self, op: str, row_id: int, record: Optional[List[str]] = None, **meta):
+        """
+        Дописывает правку
+
+        Args:
+            op: 'amend' (исправление) или 'retract' (отмена)
+            row_id: Номер записи в журнале
+            record: Новая строка для amend
+            meta: Кто и откуда изменил (user_id, message_id, ...)
+        """
+        entry = {'op': op, 'row': row_id, 'at': round(time.time(), 3), **meta}
+        if op == 'amend':
+            entry['record'] = list(record)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self._apply(op, row_id, record)
+
+    def resolve(self, row_id: int, row: List[str]) -> Optional[List[str]]:
+        """Актуальная строка записи; None - запись отменена"""
+        if row_id in self.overrides:
+            return self.overrides[row_id]
+        return row
+
+    def snapshot(self) -> Dict[int, Optional[List[str]]]:
+        """Копия итога правок - для чтения в других потоках, пока писатель дописывает новые"""
+        with self._lock:
+            return dict(self.overrides)
+
+    def is_retracted(self, row_id: int) -> bool:
+        return row_id in self.overrides and self.overrides[row_id] is None
+
+    def retracted(self) -> Set[int]:
+        """Номера отмененных записей"""
+        with self._lock:
+            return {row_id for row_id, row in self.overrides.items() if row is None}
+
+    def resolve_all(self, rows: Iterable[List[str]]) -> Iterator[Tuple[int, List[str]]]:
+        """(номер, актуальная строка) для строк данных журнала по порядку, без отмененных"""
+        return resolve_rows(rows, self.snapshot())
+
+
+def resolve_rows(rows: Iterable[List[str]],
+                 overrides: Dict[int, Optional[List[str]]]) -> Iterator[Tuple[int, List[str]]]:
+    """Подставляет правки в строки данных журнала (номера с 1) и пропускает отмененные"""
+    for row_id, row in enumerate(rows, start=1):
+        resolved = overrides.get(row_id, row) if overrides else row
+        if resolved is not None:
+            yield row_id, resolved
@@ -0,0 +1,322 @@
+import bisect
+import csv
+import io
+import json
+import logging
+import os
+import re
+import threading
+from array import array
+from typing import Container, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from config import INDEX_SAVE_EVERY
+
+logger = logging.getLogger(__name__)
+
+# Версия формата файла индекса: при несовпадении индекс строится заново
+_FORMAT_VERSION = 3
+
+_TOKEN = re.compile(r'\w+')
+
+
+def normalize_buyer(buyer: str) -> str:
+    """'@Maxim' -> 'maxim'"""
+    return buyer.strip().lstrip('@').lower().replace('ё', 'е')
+
+
+def source_tokens(source: str) -> List[str]:
+    """'Бизнес и Бизнес' -> ['бизнес', 'и']"""
+    return list(dict.fromkeys(_TOKEN.findall(source.lower().replace('ё', 'е'))))
+
+
+def normalize_source(source: str) -> str:
+    """'Русский  Биз!' -> 'русский биз'"""
+    return ' '.join(_TOKEN.findall(source.lower().replace('ё', 'е')))
+
+
+def iter_csv_rows(filename: str, start: int = 0,
+                  until: Optional[int] = None) -> Iterator[Tuple[int, int, List[str]]]:
+    """
+    Строки CSV журнала с байта start (до until или до конца файла)
+
+    Returns:
+        Iterator: (смещение начала строки, смещение конца строки, разобранная строка)
+    """
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        offset = start
+        pending = b''
+        pending_offset = offset
+        for line in file:
+            if until is not None and offset >= until:
+                break
+            if not pending:
+                pending_offset = offset
+            pending += line
+            offset += len(line)
+            # Строка CSV закончилась, если кавычки в ней парные (перевод строки внутри кавычек - часть поля)
+            if pending.count(b'"') % 2 == 0:
+                yield pending_offset, offset, next(csv.reader(io.StringIO(pending.decode('utf-8'))), [])
+                pending = b''
+
+
+class _Postings:
+    """Ключ -> номера строк, плюс отсортированный список ключей для поиска по префиксу"""
+
+    def __init__(self):
+        self.rows: Dict[str, array] = {}
+        self.keys: List[str] = []
+
+    def add(self, key: str, row_id: int):
+        rows = self.rows.get(key)
+        if rows is None:
+            rows = self.rows[key] = array('l')
+            bisect.insort(self.keys, key)
+        rows.append(row_id)
+
+    def prefix(self, prefix: str) -> Set[int]:
+        """Строки всех ключей, начинающихся с prefix"""
+        result: Set[int] = set()
+        start = bisect.bisect_left(self.keys, prefix)
+        for key in self.keys[start:]:
+            if not key.startswith(prefix):
+                break
+            result.update(self.rows[key])
+        return result
+
+    def to_dict(self) -> Dict[str, List[int]]:
+        return {key: rows.tolist() for key, rows in self.rows.items()}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, List[int]]) -> '_Postings':
+        postings = cls()
+        postings.rows = {key: array('l', rows) for key, rows in data.items()}
+        postings.keys = sorted(postings.rows)
+        return postings
+
+
+class LedgerIndex:
+    """
+    Индекс CSV журнала в памяти.
+
+    Номер записи (row id) - ее порядковый номер в журнале без заголовка,
+    начиная с 1. Для каждой записи хранится смещение в файле, поэтому
+    любую запись можно прочитать без просмотра файла с начала, а также
+    обратные индексы: ник покупателя -> записи и слово источника -> записи.
+
+    Индекс обновляется CsvSink при каждой дозаписи (on_append) и
+    сохраняется в <журнал>.index.json; при старте загружается из файла и
+    дочитывает только строки, дописанные после сохранения. Для записей из
+    сообщений Telegram запоминается "чат:сообщение" -> номер записи, чтобы
+    правка сообщения нашла свою запись, и автор -> его записи для /undo.
+
+    Обратные индексы строятся по исходным строкам журнала; исправленные
+    и отмененные записи (LedgerChanges) search сверяет отдельно.
+    """
+
+    def __init__(self, filename: str, save_every: int = INDEX_SAVE_EVERY):
+        self.filename = filename
+        self.path = f"{filename}.index.json"
+        self.save_every = save_every
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.offsets = array('q')
+        # Сколько байт журнала уже проиндексировано
+        self.size = 0
+        self._header_seen = False
+        self._buyers = _Postings()
+        self._sources = _Postings()
+        self._messages: Dict[str, int] = {}
+        self._authors = _Postings()
+        self._unsaved = 0
+
+    @property
+    def rows(self) -> int:
+        return len(self.offsets)
+
+    def _add(self, row: List[str], offset: int):
+        if not self._header_seen:
+            self._header_seen = True
+            return
+        self.offsets.append(offset)
+        row_id = len(self.offsets)
+        if row:
+            self._buyers.add(normalize_buyer(row[0]), row_id)
+        if len(row) > 3:
+            for token in source_tokens(row[3]):
+                self._sources.add(token, row_id)
+        message_key = getattr(row, 'message_key', None)
+        if message_key:
+            self._messages[message_key] = row_id
+        author = getattr(row, 'author', None)
+        if author is not None:
+            self._authors.add(str(author), row_id)
+        self._unsaved += 1
+
+    def row_for_message(self, message_key: str) -> Optional[int]:
+        """Номер записи, созданной сообщением "чат:сообщение", или None"""
+        with self._lock:
+            return self._messages.get(message_key)
+
+    def last_by_author(self, author: int, skip: Container[int] = ()) -> Optional[int]:
+        """Последняя запись автора, кроме номеров из skip (например, отмененных), или None"""
+        with self._lock:
+            rows = self._authors.rows.get(str(author), ())
+            for index in range(len(rows) - 1, -1, -1):
+                if rows[index] not in skip:
+                    return rows[index]
+        return None
+
+    def recent(self, limit: int, before: Optional[int] = None, skip: Container[int] = ()) -> List[int]:
+        """
+        Номера последних записей журнала, новые первыми - без чтения файла
+
+        Args:
+            limit: Сколько записей вернуть
+            before: Курсор - только записи с номером меньше before
+            skip: Номера, которые пропускаются (например, отмененные)
+        """
+        with self._lock:
+            row_id = self.rows if before is None else min(before - 1, self.rows)
+        result = []
+        while row_id > 0 and len(result) < limit:
+            if row_id not in skip:
+                result.append(row_id)
+            row_id -= 1
+        return result
+
+    def on_append(self, rows: List[List[str]], offsets: List[int], end: int):
+        """Строки дописаны в журнал с указанных смещений; end - новый размер файла"""
+        with self._lock:
+            if offsets and offsets[0] != self.size:
+                # Файл менялся в обход индекса - дочитываем пропущенное
+                self._scan(until=offsets[0])
+            for row, offset in zip(rows, offsets):
+                self._add(row, offset)
+            self.size = end
+
+    def _scan(self, until: Optional[int] = None):
+        """Индексирует строки журнала с self.size до until (или до конца файла)"""
+        # Недописанная строка в конце файла не индексируется - ее дочитает следующий проход
+        for offset, end, row in iter_csv_rows(self.filename, self.size, until):
+            self._add(row, offset)
+            self.size = end
+
+    def load(self):
+        """Загружает сохраненный индекс и дочитывает новые строки журнала; при расхождении строит заново"""
+        with self._lock:
+            self._reset()
+            if not os.path.exists(self.filename):
+                return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    data = json.load(file)
+                if data.get('version') != _FORMAT_VERSION or data['size'] > os.path.getsize(self.filename):
+                    raise ValueError("индекс не соответствует журналу")
+                self.offsets = array('q', data['offsets'])
+                self.size = data['size']
+                self._header_seen = True
+                self._buyers = _Postings.from_dict(data['buyers'])
+                self._sources = _Postings.from_dict(data['sources'])
+                self._messages = data['messages']
+                self._authors = _Postings.from_dict(data['authors'])
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Индекс журнала будет построен заново: {e}")
+                self._reset()
+            loaded = self.rows
+            self._scan()
+            logger.info(f"Индекс журнала: {self.rows} записей, дочитано {self.rows - loaded}")
+            if self.rows > loaded:
+                self.save()
+
+    def save(self):
+        """Сохраняет индекс рядом с журналом (через временный файл)"""
+        with self._lock:
+            data = json.dumps({
+                'version': _FORMAT_VERSION,
+                'size': self.size,
+                'offsets': self.offsets.tolist(),
+                'buyers': self._buyers.to_dict(),
+                'sources': self._sources.to_dict(),
+                'messages': self._messages,
+                'authors': self._authors.to_dict(),
+            }, ensure_ascii=False)
+            self._unsaved = 0
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(data)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def needs_save(self) -> bool:
+        return self._unsaved >= self.save_every
+
+    def search(self, buyers: Iterable[str] = (), words: Iterable[str] = (),
+               overrides: Optional[Dict[int, Optional[List[str]]]] = None) -> List[int]:
+        """
+        Записи, подходящие под все условия (без учета регистра, по началу слова)
+
+        Args:
+            buyers: Начала ников покупателей
+            words: Начала слов источника
+            overrides: Исправленные (строка) и отмененные (None) записи - см. LedgerChanges
+
+        Returns:
+            List[int]: Номера записей, новые первыми
+        """
+        buyer_prefixes = [normalize_buyer(buyer) for buyer in buyers]
+        word_prefixes = [token for word in words for token in source_tokens(word)]
+        with self._lock:
+            matched: Optional[Set[int]] = None
+            for prefix in buyer_prefixes:
+                rows = self._buyers.prefix(prefix)
+                matched = rows if matched is None else matched & rows
+            for prefix in word_prefixes:
+                rows = self._sources.prefix(prefix)
+                matched = rows if matched is None else matched & rows
+        if matched is None:
+            return []
+        if overrides:
+            # Индекс знает исходные строки: исправленные записи проверяются по новой строке
+            matched.difference_update(overrides)
+            for row_id, row in overrides.items():
+                if row is not None and self._row_matches(row, buyer_prefixes, word_prefixes):
+                    matched.add(row_id)
+        return sorted(matched, reverse=True)
+
+    @staticmethod
+    def _row_matches(row: List[str], buyer_prefixes: List[str], word_prefixes: List[str]) -> bool:
+        buyer = normalize_buyer(row[0]) if row else ''
+        tokens = source_tokens(row[3]) if len(row) > 3 else []
+        return (all(buyer.startswith(prefix) for prefix in buyer_prefixes)
+                and all(any(token.startswith(prefix) for token in tokens) for prefix in word_prefixes))
+
+    def read(self, row_ids: List[int]) -> List[Tuple[int, List[str]]]:
+        """Читает записи по номерам, переходя сразу к их смещениям в файле"""
+        with self._lock:
+            positions = [(row_id, self.offsets[row_id - 1]) for row_id in row_ids if 0 < row_id <= self.rows]
+        result = []
+        with open(self.filename, 'rb') as file:
+            for row_id, offset in positions:
+                file.seek(offset)
+                chunk = file.readline()
+                while chunk.count(b'"') % 2:
+                    line = file.readline()
+                    if not line:
+                        break
+                    chunk += line
+                result.append((row_id, next(csv.reader(io.StringIO(chunk.decode('utf-8'))), [])))
+        return result
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'rows': self.rows,
+                'buyers': len(self._buyers.keys),
+                'source_tokens': len(self._sources.keys),
+                'messages': len(self._messages),
+                'unsaved': self._unsaved,
+            }
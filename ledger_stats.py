@@ -0,0 +1,318 @@
+import bisect
+import heapq
+import logging
+import re
+import threading
+from array import array
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+from exporters import ExportArgumentError, ExportFilter, parse_filter_args, row_date
+from ledger_changes import LedgerChanges
+from ledger_index import iter_csv_rows, normalize_buyer, normalize_source
+
+logger = logging.getLogger(__name__)
+
+# Показатели дня: записей всего, записей и сумма в USDT, записей и сумма в рублях
+METRICS = ('total', 'usdt_count', 'usdt_total', 'rub_count', 'rub_total')
+
+_NUMBER = re.compile(r'(\d+(?:[.,]\d+)?)')
+
+# День записей без распознанной даты: учитываются в статистике за все время, но не в диапазонах
+_UNDATED = 0
+
+
+def row_metrics(row: List[str]) -> List[float]:
+    """Вклад записи в показатели METRICS"""
+    values = [1.0, 0.0, 0.0, 0.0, 0.0]
+    if len(row) > 2:
+        number = _NUMBER.search(row[2])
+        amount = float(number.group(1).replace(',', '.')) if number else 0.0
+        if 'usdt' in row[2].lower():
+            values[1], values[2] = 1.0, amount
+        elif '₽' in row[2]:
+            values[3], values[4] = 1.0, amount
+    return values
+
+
+def row_day(row: List[str]) -> int:
+    """Порядковый номер дня публикации записи (date.toordinal) или _UNDATED"""
+    published = row_date(row)
+    return published.toordinal() if published else _UNDATED
+
+
+_TOP_KINDS = {
+    'buyers': 'buyers', 'покупатели': 'buyers',
+    'sources': 'sources', 'источники': 'sources',
+}
+_TOP_METRICS = {
+    'count': 'total', 'кол': 'total', 'количество': 'total',
+    'usdt': 'usdt_total',
+    'rub': 'rub_total', 'руб': 'rub_total', 'рубли': 'rub_total', '₽': 'rub_total',
+}
+
+
+def parse_top_args(args: List[str], today: Optional[date] = None,
+                   default_limit: int = 10) -> Tuple[str, str, int, ExportFilter]:
+    """
+    Разбирает аргументы /top [buyers|sources] [count|usdt|rub] [период] [N]
+
+    Период - "неделя" (последние 7 дней), "месяц" и "год" (с начала текущего)
+    или даты, как в /export (см. parse_filter_args).
+
+    Returns:
+        Tuple: что ранжировать, показатель, сколько лидеров, период
+    """
+    today = today or date.today()
+    kind, metric, limit = 'buyers', 'total', default_limit
+    period: Optional[Tuple[date, date]] = None
+    rest = []
+    for token in args:
+        lowered = token.lower()
+        if lowered in _TOP_KINDS:
+            kind = _TOP_KINDS[lowered]
+        elif lowered in _TOP_METRICS:
+            metric = _TOP_METRICS[lowered]
+        elif lowered in ('неделя', 'week'):
+            period = (today - timedelta(days=6), today)
+        elif lowered in ('месяц', 'month'):
+            period = (today.replace(day=1), today)
+        elif lowered in ('год', 'year'):
+            period = (today.replace(month=1, day=1), today)
+        elif token.isdigit():
+            limit = int(token)
+        else:
+            rest.append(token)
+    export_filter = parse_filter_args(rest, today)
+    if export_filter.buyer or export_filter.source:
+        raise ExportArgumentError(f"непонятные слова: {' '.join(rest)}")
+    if period is not None:
+        export_filter = ExportFilter(*period)
+    return kind, metric, limit, export_filter
+
+
+def _series(table: Dict[str, 'DailySums'], key: str) -> 'DailySums':
+    series = table.get(key)
+    if series is None:
+        series = table[key] = DailySums()
+    return series
+
+
+class DailySums:
+    """
+    Показатели по дням и префиксные суммы по ним.
+
+    Дни хранятся по возрастанию, показатели - массивами по дням. Префиксные
+    суммы пересчитываются лениво при запросе и только начиная с самого
+    раннего измененного дня: запись за сегодня пересчитывает один элемент.
+    Сумма за диапазон дат - разность двух префиксов после двоичного поиска
+    границ, без просмотра записей; итог за все время хранится отдельно.
+    """
+
+    def __init__(self):
+        self.days: List[int] = []
+        self.daily = [array('d') for _ in METRICS]
+        self.prefix = [array('d', [0.0]) for _ in METRICS]
+        self.totals = [0.0] * len(METRICS)
+        # Префиксные суммы верны для дней до этого номера (не включая его)
+        self._dirty_from = 0
+
+    @classmethod
+    def from_days(cls, totals: Dict[int, List[float]]) -> 'DailySums':
+        """Показатели из словаря день -> значения METRICS (первый проход по журналу)"""
+        sums = cls()
+        sums.days = sorted(totals)
+        for index, series in enumerate(sums.daily):
+            series.extend(totals[day][index] for day in sums.days)
+            sums.totals[index] = sum(series)
+        return sums
+
+    def add(self, day: int, values: List[float], sign: float = 1.0):
+        position = bisect.bisect_left(self.days, day)
+        if position == len(self.days) or self.days[position] != day:
+            self.days.insert(position, day)
+            for series in self.daily:
+                series.insert(position, 0.0)
+        for index, value in enumerate(values):
+            self.daily[index][position] += sign * value
+            self.totals[index] += sign * value
+        self._dirty_from = min(self._dirty_from, position)
+
+    def _refresh(self):
+        start = self._dirty_from
+        if start >= len(self.days):
+            return
+        for series, prefix in zip(self.daily, self.prefix):
+            del prefix[start + 1:]
+            running = prefix[start]
+            for value in series[start:]:
+                running += value
+                prefix.append(running)
+        self._dirty_from = len(self.days)
+
+    def range(self, first_day: Optional[int] = None, last_day: Optional[int] = None) -> Dict[str, float]:
+        """Показатели за дни first_day..last_day включительно (None - без границы)"""
+        if first_day is None and last_day is None:
+            return dict(zip(METRICS, self.totals))
+        self._refresh()
+        low = 0 if first_day is None else bisect.bisect_left(self.days, max(first_day, _UNDATED + 1))
+        high = len(self.days) if last_day is None else bisect.bisect_right(self.days, last_day)
+        if first_day is None and last_day is not None and self.days and self.days[0] == _UNDATED:
+            # Записи без даты в диапазон не попадают
+            low = 1
+        high = max(high, low)
+        return {name: prefix[high] - prefix[low] for name, prefix in zip(METRICS, self.prefix)}
+
+
+class LedgerStats:
+    """
+    Статистика журнала без просмотра записей при запросе.
+
+    Показатели хранятся по дням публикации (DailySums) для журнала целиком,
+    для каждого покупателя и для каждого источника. Суммы строятся одним
+    проходом по журналу при первом запросе, дальше обновляются при каждой
+    дозаписи (on_append - слушатель CsvSink) и правке (on_change).
+    """
+
+    def __init__(self, filename: str, changes: LedgerChanges):
+        self.filename = filename
+        self.changes = changes
+        # Держится и на время первого прохода, и при правке вместе с записью в журнал правок
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.built = False
+        # Сколько байт журнала учтено
+        self.size = 0
+        self.overall = DailySums()
+        self._buyers: Dict[str, DailySums] = {}
+        self._sources: Dict[str, DailySums] = {}
+        # Разобранные даты: "ДД.ММ.ГГГГ" -> день (записей много, различных дат - сотни)
+        self._day_cache: Dict[str, int] = {}
+
+    def _keys(self, row: List[str]) -> Tuple[int, str, str]:
+        """День, покупатель и источник записи"""
+        day = self._day_cache.get(row[1][:10])
+        if day is None:
+            day = self._day_cache[row[1][:10]] = row_day(row)
+        return day, normalize_buyer(row[0]), normalize_source(row[3]) if len(row) > 3 else ''
+
+    def _add(self, row: List[str], sign: float = 1.0):
+        if len(row) < 3:
+            return
+        day, buyer, source = self._keys(row)
+        values = row_metrics(row)
+        self.overall.add(day, values, sign)
+        _series(self._buyers, buyer).add(day, values, sign)
+        _series(self._sources, source).add(day, values, sign)
+
+    def _build(self):
+        """Первый проход по журналу с учетом правок: суммы копятся в словарях, массивы строятся в конце"""
+        self._reset()
+        overrides = self.changes.snapshot()
+        overall: Dict[int, List[float]] = {}
+        buyers: Dict[str, Dict[int, List[float]]] = {}
+        sources: Dict[str, Dict[int, List[float]]] = {}
+        row_id = -1
+        for offset, end, row in iter_csv_rows(self.filename):
+            row_id += 1
+            self.size = end
+            if row_id == 0:
+                continue
+            row = overrides.get(row_id, row) if overrides else row
+            if row is None or len(row) < 3:
+                continue
+            day, buyer, source = self._keys(row)
+            values = row_metrics(row)
+            for totals in (overall, buyers.setdefault(buyer, {}), sources.setdefault(source, {})):
+                current = totals.get(day)
+                if current is None:
+                    totals[day] = list(values)
+                else:
+                    for index, value in enumerate(values):
+                        current[index] += value
+        self.overall = DailySums.from_days(overall)
+        self._buyers = {key: DailySums.from_days(totals) for key, totals in buyers.items()}
+        self._sources = {key: DailySums.from_days(totals) for key, totals in sources.items()}
+        self.built = True
+        logger.info(f"Статистика журнала построена: {max(row_id, 0)} записей, {len(self.overall.days)} дней")
+
+    def on_append(self, rows: List[List[str]], offsets: List[int], end: int):
+        """Строки дописаны в журнал (см. CsvSink.add_listener)"""
+        with self.lock:
+            if not self.built:
+                return
+            if offsets and offsets[0] > self.size:
+                # Файл дописывали в обход хранилища - статистика будет построена заново
+                self.built = False
+                return
+            for row, offset in zip(rows, offsets):
+                # Строки, которые первый проход уже успел прочитать, не учитываются второй раз
+                if offset >= self.size:
+                    self._add(row)
+            self.size = max(self.size, end)
+
+    def on_change(self, old: List[str], new: Optional[List[str]]):
+        """Запись исправлена (new) или отменена (new is None); вызывать под self.lock вместе с записью правки"""
+        with self.lock:
+            if not self.built:
+                return
+            self._add(old, -1.0)
+            if new is not None:
+                self._add(new)
+
+    def query(self, date_from: Optional[date] = None, date_to: Optional[date] = None,
+              buyer: Optional[str] = None, source: Optional[str] = None) -> Dict[str, float]:
+        """
+        Показатели METRICS за диапазон дат, по всему журналу или по одному
+        покупателю либо источнику (источник сравнивается целиком, без учета регистра)
+        """
+        with self.lock:
+            if not self.built:
+                self._build()
+            series: Optional[DailySums] = self.overall
+            if buyer:
+                series = self._buyers.get(normalize_buyer(buyer))
+            elif source:
+                series = self._sources.get(normalize_source(source))
+            if series is None:
+                return {name: 0.0 for name in METRICS}
+            return series.range(
+                date_from.toordinal() if date_from else None,
+                date_to.toordinal() if date_to else None,
+            )
+
+    def top(self, kind: str, metric: str, limit: int, date_from: Optional[date] = None,
+            date_to: Optional[date] = None) -> List[Tuple[str, Dict[str, float]]]:
+        """
+        Лидеры за период: покупатели (kind='buyers') или источники ('sources')
+        с наибольшим metric (total, usdt_total или rub_total)
+
+        Показатели каждого ключа берутся из его сумм по дням, лучшие limit
+        отбираются кучей размера limit - ни журнал, ни все ключи не сортируются.
+
+        Returns:
+            List: (ключ, показатели METRICS), лучшие первыми
+        """
+        with self.lock:
+            if not self.built:
+                self._build()
+            table = self._buyers if kind == 'buyers' else self._sources
+            first_day = date_from.toordinal() if date_from else None
+            last_day = date_to.toordinal() if date_to else None
+            candidates = (
+                (key, stats) for key, stats in
+                ((key, series.range(first_day, last_day)) for key, series in table.items())
+                # Суммы после отмен могут отличаться от нуля на ошибку округления
+                if stats['total'] >= 0.5 and stats[metric] > 1e-9
+            )
+            return heapq.nlargest(limit, candidates, key=lambda item: (item[1][metric], item[1]['total']))
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'built': int(self.built),
+                'days': len(self.overall.days),
+                'buyers': len(self._buyers),
+                'sources': len(self._sources),
+            }
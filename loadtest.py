@@ -0,0 +1,380 @@
+"""
+Нагрузочный тест и воспроизведение трафика для SalesBot.
+
+    python loadtest.py synthetic --messages 2000 --chats 20 --rate 0
+    python loadtest.py replay updates.jsonl --speed 10
+
+Обновления прогоняются через обработчики SalesBot так же, как их
+вызывает Application (с тем же обработчиком параллельности), но Bot API
+заменен заглушкой, а Google Sheets - таблицей в памяти с задержками.
+CSV пишется во временную папку. Реальные обновления можно записать,
+указав RECORD_UPDATES_FILE при запуске бота.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import gspread
+from telegram import Chat, Document, Message, MessageEntity, Update, User
+from telegram.ext import CallbackContext
+from logging_setup import setup_logging
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class StubBot:
+    """Заглушка Bot API: отвечает после latency секунд и считает вызовы"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.username = 'loadtest_bot'
+        self.defaults = None
+        self.calls: Dict[str, int] = {}
+        self._message_id = 0
+
+    async def _answer(self, method: str, chat_id: int, text: Optional[str] = None) -> Message:
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self._message_id += 1
+        message = Message(self._message_id, datetime.now(), Chat(chat_id, Chat.GROUP), text=text)
+        message.set_bot(self)
+        return message
+
+    async def send_message(self, chat_id: int, text: str, *args, **kwargs) -> Message:
+        return await self._answer('sendMessage', chat_id, text)
+
+    async def edit_message_text(self, text: str, chat_id: Optional[int] = None, *args, **kwargs) -> Message:
+        return await self._answer('editMessageText', chat_id, text)
+
+    async def send_document(self, chat_id: int, document, *args, **kwargs) -> Message:
+        # Повторная отправка по file_id считается отдельно - без загрузки файла
+        message = await self._answer('sendDocumentById' if isinstance(document, str) else 'sendDocument', chat_id)
+        message._unfreeze()
+        message.document = Document(f'stub-file-{message.message_id}', f'stub-{message.message_id}')
+        message._freeze()
+        return message
+
+
+def _row_range(cell_range: str) -> Tuple[int, Optional[int]]:
+    """'A5:D10' -> (5, 10), 'A2:D' -> (2, None)"""
+    match = re.match(r"(?:.*!)?[A-Z]+(\d+)(?::[A-Z]+(\d+)?)?$", cell_range)
+    return int(match.group(1)), int(match.group(2)) if match.group(2) else None
+
+
+class LocalWorksheet:
+    """Лист в памяти с методами gspread, которые использует GoogleSheetsManager"""
+
+    def __init__(self, title: str, latency: float, sheet_id: int):
+        self.title = title
+        self.id = sheet_id
+        self.latency = latency
+        self.rows: List[List[str]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def row_count(self) -> int:
+        """Размер сетки листа: у настоящего листа не меньше числа строк с данными"""
+        return len(self.rows)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _slice(self, cell_range: str) -> List[List[str]]:
+        first, last = _row_range(cell_range)
+        rows = self.rows[first - 1:last or len(self.rows)]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        return [list(row) for row in rows]
+
+    def get(self, cell_range: str, **kwargs) -> List[List[str]]:
+        self._wait()
+        with self._lock:
+            return self._slice(cell_range)
+
+    def batch_get(self, ranges: List[str], **kwargs) -> List[List[List[str]]]:
+        self._wait()
+        with self._lock:
+            return [self._slice(cell_range) for cell_range in ranges]
+
+    def append_row(self, row: List[str], **kwargs) -> Dict:
+        return self.append_rows([row])
+
+    def append_rows(self, rows: List[List[str]], **kwargs) -> Dict:
+        self._wait()
+        with self._lock:
+            first = len(self.rows) + 1
+            self.rows.extend(list(row) for row in rows)
+        return {'updates': {'updatedRange': f"'{self.title}'!A{first}:D{first + len(rows) - 1}"}}
+
+    def update(self, cell_range: str, values: List[List[str]], **kwargs):
+        self._wait()
+        with self._lock:
+            self._put(cell_range, values)
+
+    def batch_update(self, data: List[Dict], **kwargs):
+        self._wait()
+        with self._lock:
+            for item in data:
+                self._put(item['range'], item['values'])
+
+    def delete_rows(self, start_index: int, end_index: Optional[int] = None):
+        self._wait()
+        with self._lock:
+            del self.rows[start_index - 1:end_index or start_index]
+
+    def _put(self, cell_range: str, values: List[List[str]]):
+        first, _ = _row_range(cell_range)
+        while len(self.rows) < first - 1 + len(values):
+            self.rows.append([])
+        for offset, row in enumerate(values):
+            self.rows[first - 1 + offset] = list(row)
+
+
+class LocalSpreadsheet:
+    """Таблица в памяти вместо Google Sheets; latency - задержка каждого запроса, секунд"""
+
+    def __init__(self, sheet_name: str, latency: float = 0.0):
+        self.latency = latency
+        self._sheets: Dict[str, LocalWorksheet] = {}
+        self.add_worksheet(sheet_name)
+
+    def worksheet(self, title: str) -> LocalWorksheet:
+        if title not in self._sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self._sheets[title]
+
+    def worksheets(self) -> List[LocalWorksheet]:
+        return list(self._sheets.values())
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 4, **kwargs) -> LocalWorksheet:
+        worksheet = self._sheets[title] = LocalWorksheet(title, self.latency, len(self._sheets))
+        return worksheet
+
+    def duplicate_sheet(self, source_sheet_id: int, new_sheet_name: str, **kwargs) -> LocalWorksheet:
+        source = next(sheet for sheet in self._sheets.values() if sheet.id == source_sheet_id)
+        worksheet = self.add_worksheet(new_sheet_name)
+        worksheet.rows = [list(row) for row in source.rows]
+        return worksheet
+
+
+# Заготовки для синтетических сообщений
+_BUYERS = ['@swagger', '@nikita', '@ivan', '@maria', '@alex', '@maxim', '@olga', '@n2342rik']
+_SOURCES = ['биб', 'русский биз', 'канал', 'группа', 'блог', 'Бизнес и Бизнес', 'криптоканал']
+_AMOUNTS = ['65юсдт', '200usdt', '6000р', '150₽', '5000р', '0.01btc']
+
+
+def synthetic_text(rng: random.Random) -> str:
+    """Сообщение о продаже в быстром формате, иногда - неразбираемый текст или команда"""
+    roll = rng.random()
+    if roll < 0.05:
+        return 'просто текст без продажи'
+    if roll < 0.07:
+        return '/stats'
+    day, month = rng.randint(1, 28), rng.randint(1, 12)
+    hour, minute = rng.randint(0, 23), rng.choice([0, 15, 30, 45])
+    return (f"{rng.choice(_BUYERS)} {day:02d}.{month:02d} {hour:02d}{minute:02d} "
+            f"{rng.choice(_AMOUNTS)} {rng.choice(_SOURCES)}")
+
+
+def make_update(update_id: int, chat_id: int, user_id: int, text: str, bot: StubBot) -> Update:
+    """Update с текстовым сообщением; команды размечаются как в настоящем Telegram"""
+    entities = []
+    if text.startswith('/'):
+        entities.append(MessageEntity(MessageEntity.BOT_COMMAND, 0, len(text.split()[0])))
+    message = Message(
+        update_id, datetime.now(), Chat(chat_id, Chat.GROUP),
+        from_user=User(user_id, f"user{user_id}", False, username=f"user{user_id}"),
+        text=text, entities=entities,
+    )
+    update = Update(update_id, message=message)
+    message.set_bot(bot)
+    update.set_bot(bot)
+    return update
+
+
+def synthetic_updates(count: int, chats: int, rate: float, bot: StubBot,
+                      seed: int = 1) -> Iterator[Tuple[float, Update]]:
+    """(смещение от начала в секундах, Update); rate - сообщений в секунду, 0 - все сразу"""
+    rng = random.Random(seed)
+    for index in range(count):
+        chat_id = -1000 - rng.randrange(chats)
+        offset = index / rate if rate > 0 else 0.0
+        yield offset, make_update(index + 1, chat_id, rng.randint(1, 50), synthetic_text(rng), bot)
+
+
+def recorded_updates(path: str, speed: float, bot: StubBot) -> Iterator[Tuple[float, Update]]:
+    """Обновления из JSONL, записанного UpdateRecorder; интервалы сжаты в speed раз"""
+    first_ts = None
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            first_ts = item['ts'] if first_ts is None else first_ts
+            yield (item['ts'] - first_ts) / speed, Update.de_json(item['update'], bot)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+class LoadRunner:
+    """Прогоняет обновления через обработчики SalesBot и собирает задержки"""
+
+    def __init__(self, bot, stub: StubBot):
+        self.bot = bot
+        self.stub = stub
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors = 0
+
+    async def _dispatch(self, update: Update):
+        application = self.bot.application
+        for group in sorted(application.handlers):
+            for handler in application.handlers[group]:
+                check = handler.check_update(update)
+                if check is None or check is False:
+                    continue
+                context = CallbackContext.from_update(update, application)
+                handler.collect_additional_context(context, update, application, check)
+                started = time.perf_counter()
+                try:
+                    await handler.callback(update, context)
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Ошибка обработчика {handler.callback.__name__}: {e}")
+                name = getattr(handler.callback, '__name__', type(handler.callback).__name__)
+                self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+                break
+
+    async def _process(self, update: Update, scheduled: float):
+        await self.bot.update_processor.process_update(update, self._dispatch(update))
+        self.latencies.setdefault('end_to_end', []).append(time.perf_counter() - scheduled)
+
+    async def run(self, updates: Iterator[Tuple[float, Update]]) -> Dict:
+        await self.bot.update_processor.initialize()
+        await self.bot.storage.fanout.start()
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        tasks = []
+        for offset, update in updates:
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self._process(update, started + offset)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        # Склеенные подтверждения и фоновые приемники (Google Sheets) дописываются уже после замера
+        await self.bot.replies.stop()
+        await self.bot.tenants.close()
+        await self.bot.storage.fanout.stop()
+        self.bot.storage.close()
+        return self._report(len(tasks), elapsed, time.process_time() - cpu_started)
+
+    def _report(self, count: int, elapsed: float, cpu: float) -> Dict:
+        handlers = {}
+        for name, values in sorted(self.latencies.items()):
+            handlers[name] = {
+                'count': len(values),
+                'p50_ms': round(_percentile(values, 50) * 1000, 2),
+                'p95_ms': round(_percentile(values, 95) * 1000, 2),
+                'p99_ms': round(_percentile(values, 99) * 1000, 2),
+                'max_ms': round(max(values) * 1000, 2),
+            }
+        return {
+            'updates': count,
+            'seconds': round(elapsed, 3),
+            'updates_per_second': round(count / elapsed, 1) if elapsed else 0.0,
+            'errors': self.errors,
+            'flood_shed': self.bot.flood_control.shed,
+            'cpu_seconds': round(cpu, 3),
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) if resource else None,
+            'api_calls': dict(self.stub.calls),
+            'sinks': {name: state['written'] for name, state in self.bot.storage.fanout.snapshot().items()},
+            'handlers': handlers,
+        }
+
+
+def build_bot(workdir: str, sheets_latency: float):
+    """SalesBot с CSV во workdir и таблицей в памяти вместо Google Sheets"""
+    from async_storage import AsyncStorage
+    from google_sheets import GoogleSheetsManager
+    from main import SalesBot
+    from simple_storage import SimpleStorageManager
+
+    sheets = GoogleSheetsManager(connect=False)
+    sheets.attach(LocalSpreadsheet(sheets.sheet_name, sheets_latency))
+    manager = SimpleStorageManager(os.path.join(workdir, 'sales_data.csv'), google_sheets=sheets)
+    return SalesBot(storage=AsyncStorage(manager))
+
+
+def format_report(report: Dict) -> str:
+    lines = [
+        f"Обновлений: {report['updates']} за {report['seconds']} с "
+        f"({report['updates_per_second']} в секунду), ошибок: {report['errors']}",
+        f"Отброшено защитой от флуда и перегрузки: {report['flood_shed']}",
+        f"CPU: {report['cpu_seconds']} с, пик RSS: {report['max_rss_mb']} МБ",
+        f"Вызовы Bot API: {report['api_calls']}",
+        f"Записано в приемники: {report['sinks']}",
+        "",
+        f"{'обработчик':<20} {'кол-во':>7} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'max мс':>9}",
+    ]
+    for name, stats in report['handlers'].items():
+        lines.append(
+            f"{name:<20} {stats['count']:>7} {stats['p50_ms']:>9} {stats['p95_ms']:>9} "
+            f"{stats['p99_ms']:>9} {stats['max_ms']:>9}"
+        )
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест SalesBot")
+    parser.add_argument('--api-latency', type=float, default=0.05, help="задержка Bot API, сек")
+    parser.add_argument('--sheets-latency', type=float, default=0.2, help="задержка запроса к Google Sheets, сек")
+    parser.add_argument('--json', action='store_true', help="отчет в JSON")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    synthetic = commands.add_parser('synthetic', help="сгенерированные сообщения")
+    synthetic.add_argument('--messages', type=int, default=1000)
+    synthetic.add_argument('--chats', type=int, default=10)
+    synthetic.add_argument('--rate', type=float, default=0, help="сообщений в секунду (0 - все сразу)")
+    synthetic.add_argument('--seed', type=int, default=1)
+
+    replay = commands.add_parser('replay', help="записанные обновления (RECORD_UPDATES_FILE)")
+    replay.add_argument('path')
+    replay.add_argument('--speed', type=float, default=1.0, help="ускорение относительно записи")
+
+    args = parser.parse_args()
+    setup_logging()
+
+    stub = StubBot(args.api_latency)
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = build_bot(workdir, args.sheets_latency)
+        if args.command == 'synthetic':
+            updates = synthetic_updates(args.messages, args.chats, args.rate, stub, args.seed)
+        else:
+            updates = recorded_updates(args.path, args.speed, stub)
+        report = asyncio.run(LoadRunner(bot, stub).run(updates))
+
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import atexit
+import json
+import logging
+import queue
+import random
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+from config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES, LOG_QUEUE_SIZE, LOG_QUIET_LOGGERS
+
+# Атрибуты LogRecord, которые не считаются дополнительными полями (extra=...)
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Формат текстового вывода - как был у бота раньше
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON строка на запись: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только долю записей ниже WARNING от перечисленных логгеров.
+
+    Доли задаются в LOG_SAMPLE_RATES: "message_parser=0.01,async_storage=0.1".
+    Имя сравнивается по префиксу, так что "google_sheets" действует и на
+    дочерние логгеры. Предупреждения и ошибки проходят всегда.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            matches = [prefix for prefix in self.rates if name == prefix or name.startswith(prefix + '.')]
+            if matches:
+                rate = self.rates[max(matches, key=len)]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Кладет запись в очередь и сразу возвращается; форматирование и вывод -
+    в потоке QueueListener. При переполненной очереди запись отбрасывается.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Сообщение соберется в потоке вывода; трассировку исключения
+        # нужно превратить в текст сейчас, пока она актуальна
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.replace(' ', '').split(','):
+        name, _, rate = item.partition('=')
+        if name and rate:
+            try:
+                rates[name] = max(0.0, min(1.0, float(rate)))
+            except ValueError:
+                pass
+    return rates
+
+
+def setup_logging():
+    """
+    Настраивает логирование процесса один раз при запуске.
+
+    Обработчики обновлений только кладут записи в очередь, вывод в
+    консоль (текстом или JSON, LOG_FORMAT) выполняет отдельный поток.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter(_parse_rates(LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL.upper())
+
+    # Подробные INFO библиотек (каждый HTTP запрос httpx) только раздувают логи
+    for name in [n.strip() for n in LOG_QUIET_LOGGERS.split(',') if n.strip()]:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -1,41 +1,141 @@
 import logging
 import asyncio
+import functools
+import hmac
+import json
 import os
+import signal
+import tempfile
+import time
+from typing import Optional
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from config import TELEGRAM_BOT_TOKEN, PORT
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from config import (
+    TELEGRAM_BOT_TOKEN, PORT, ADMIN_IDS, BOT_MODE, MAX_CONCURRENT_UPDATES,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS,
+    ADMIN_HTTP_TOKEN, RECORD_UPDATES_FILE, IMPORT_MAX_BYTES, IMPORT_PROGRESS_SECONDS, FIND_PAGE_SIZE,
+    LIST_MAX_RECORDS, TOP_SIZE, is_google_sheets_enabled
+)
+from http_server import AsyncHTTPServer, Request, Response
+from metrics import Exposition, PROMETHEUS_CONTENT_TYPE, collect_registry
+from bot_request import MeasuredHTTPXRequest
+from tracing import start_trace, span, slowest_traces, format_trace
+from profiling import capture_profile, ProfilerBusyError
 from message_parser import SaleMessageParser
 from simple_storage import SimpleStorageManager
+from async_storage import AsyncStorage, StorageBusyError
+from sheets_sync import SheetsReconciler, format_report
+from logging_setup import setup_logging
+from update_processor import ChatOrderedUpdateProcessor
+from flood_control import FloodControl
+from reply_scheduler import ReplyScheduler
+from bulk_import import IMPORT_EXTENSIONS, document_extension, format_progress
+from ledger_stats import parse_top_args
+from exporters import ExportArgumentError, export_filename, parse_export_args, parse_filter_args
+from tenants import Tenant, TenantRegistry
+from update_recorder import UpdateRecorder
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 class SalesBot:
     """Основной класс телеграм бота для учета продаж"""
     
-    def __init__(self):
+    def __init__(self, storage: Optional[AsyncStorage] = None):
+        self.started_at = time.time()
         self.parser = SaleMessageParser()
-        self.storage = SimpleStorageManager()
-        self.application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+        # Диск и Google Sheets - в отдельных потоках, чтобы не останавливать цикл событий
+        self.storage = storage or AsyncStorage(SimpleStorageManager())
+        # Ответы - в рамках лимитов Telegram, подтверждения о продажах склеиваются
+        self.replies = ReplyScheduler()
+        # Разные чаты обрабатываются параллельно, сообщения одного чата - по порядку
+        # Перед обработкой - ограничение частоты по пользователю и чату и очередь приема
+        self.flood_control = FloodControl(replies=self.replies)
+        self.update_processor = ChatOrderedUpdateProcessor(MAX_CONCURRENT_UPDATES, self.flood_control)
+        # Журналы чатов (TENANT_MODE=chat) или один общий журнал на основе self.storage
+        self.tenants = TenantRegistry(Tenant('default', self.storage, self.parser), self.parser)
+        self.application = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .request(MeasuredHTTPXRequest(connection_pool_size=256))
+            .concurrent_updates(self.update_processor)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         self._setup_handlers()
+        self.http_server = self._create_http_server()
+    
+    def _create_http_server(self) -> AsyncHTTPServer:
+        """HTTP сервер в цикле событий бота: проверки для Railway, метрики и вебхук"""
+        server = AsyncHTTPServer('0.0.0.0', PORT)
+        server.route('GET', '/health', self.health_endpoint)
+        server.route('GET', '/ready', self.ready_endpoint)
+        server.route('GET', '/metrics', self.metrics_endpoint)
+        server.route('GET', '/debug/stats', self.debug_stats_endpoint)
+        server.route('GET', '/debug/profile', self.debug_profile_endpoint)
+        if BOT_MODE == "webhook":
+            server.route('POST', WEBHOOK_PATH, self.webhook_endpoint)
+        return server
+    
+    async def _post_init(self, application: Application):
+        """Запуск HTTP сервера и фоновых обработчиков приемников после старта приложения"""
+        await self.storage.fanout.start()
+        await self.http_server.start()
+    
+    async def _post_shutdown(self, application: Application):
+        """Останавливает HTTP сервер, отправляет подтверждения и дописывает очереди приемников"""
+        await self.http_server.stop()
+        await self.replies.stop()
+        await self.tenants.close()
+        await self.tenants.default.export_cache.stop()
+        await self.storage.fanout.stop()
+        await asyncio.get_running_loop().run_in_executor(None, self.storage.close)
     
     def _setup_handlers(self):
         """Настройка обработчиков сообщений"""
+        # Запись входящих обновлений для воспроизведения в loadtest.py
+        if RECORD_UPDATES_FILE:
+            self.application.add_handler(TypeHandler(Update, UpdateRecorder(RECORD_UPDATES_FILE)), group=-1)
+        
         # Команды
         self.application.add_handler(CommandHandler("start", self.start_command))
         self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("stats", self.stats_command))
-        self.application.add_handler(CommandHandler("export", self.export_command))
-        self.application.add_handler(CommandHandler("sheets", self.sheets_command))
+        self.application.add_handler(CommandHandler("stats", self._with_tenant(self.stats_command)))
+        self.application.add_handler(CommandHandler("export", self._with_tenant(self.export_command)))
+        self.application.add_handler(CommandHandler("find", self._with_tenant(self.find_command)))
+        self.application.add_handler(CommandHandler("top", self._with_tenant(self.top_command)))
+        self.application.add_handler(CommandHandler("list", self._with_tenant(self.list_command)))
+        self.application.add_handler(CommandHandler("undo", self._with_tenant(self.undo_command)))
+        self.application.add_handler(CommandHandler("sheets", self._with_tenant(self.sheets_command)))
+        self.application.add_handler(CommandHandler("sync", self._with_tenant(self.sync_command)))
+        self.application.add_handler(CommandHandler("trace", self.trace_command))
+        self.application.add_handler(CommandHandler("profile", self.profile_command))
         
-        # Обработчик всех текстовых сообщений
+        # Импорт записей из документа
+        import_filter = filters.Document.FileExtension(IMPORT_EXTENSIONS[0])
+        for extension in IMPORT_EXTENSIONS[1:]:
+            import_filter |= filters.Document.FileExtension(extension)
         self.application.add_handler(
-            MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message)
+            MessageHandler(filters.UpdateType.MESSAGE & import_filter, self._with_tenant(self.handle_document))
         )
+        
+        # Обработчик всех текстовых сообщений
+        self.application.add_handler(MessageHandler(
+            filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, self._with_tenant(self.handle_message)
+        ))
+        # Исправленные сообщения исправляют свою запись, а не создают новую
+        self.application.add_handler(MessageHandler(
+            filters.UpdateType.EDITED_MESSAGE & filters.TEXT & ~filters.COMMAND,
+            self._with_tenant(self.handle_edited_message)
+        ))
+    
+    def _with_tenant(self, callback):
+        """Обработчик, который получает журнал своего чата (пока он работает, журнал не выгружается)"""
+        @functools.wraps(callback)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            async with self.tenants.use(update.effective_chat.id) as tenant:
+                await callback(update, context, tenant)
+        return wrapper
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
@@ -91,24 +191,46 @@ class SalesBot:
 /start — начать работу
 /help — эта справка
 /stats — статистика размещений
+/stats 01.09 30.09 @ник — статистика за период по покупателю или источнику
 /export — экспорт данных в CSV
+/export 01.09 30.09 @ник xlsx — выгрузка с отбором (csv, gz, xlsx)
+📎 Файл .txt / .csv / .json — импорт всех записей из него
+/find @ник или /find слова источника — поиск записей
+/top sources usdt месяц 5 — лидеры среди покупателей или источников
+/list 20 — последние записи (/list 20 #123 — записи до #123)
+/undo — отменить вашу последнюю запись
+✏️ Отредактируйте сообщение — бот исправит его запись
 /sheets — статус Google Sheets
+/sync — сверка CSV с Google Sheets (для администраторов)
+/trace — самые медленные обновления (для администраторов)
+/profile — профиль CPU и памяти (для администраторов)
         """
         await update.message.reply_text(help_message)
     
-    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /stats"""
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Обработчик команды /stats [с] [по] [источник|@покупатель]"""
+        try:
+            stats_filter = parse_filter_args(context.args or [])
+            if stats_filter.buyer and stats_filter.source:
+                raise ExportArgumentError("укажите либо источник, либо @покупателя")
+        except ExportArgumentError as e:
+            await update.message.reply_text(
+                f"❌ {e}\n\nФормат: /stats [с] [по] [источник|@покупатель]\n"
+                "Например: /stats 01.09 30.09 или /stats сегодня @nikita"
+            )
+            return
+        
         try:
-            stats = self.storage.get_stats()
+            stats = await tenant.storage.stats(stats_filter)
             
             stats_message = f"""
-📊 Статистика рекламы:
+📊 Статистика рекламы{self._stats_scope(stats_filter)}:
 
 📈 Всего размещений: {stats['total']}
 💰 USDT: {stats['usdt_count']} ({stats['usdt_total']:.0f} USDT)
 💴 Рубли: {stats['rub_count']} ({stats['rub_total']:.0f}₽)
 
-💾 Данные сохраняются в файл: sales_data.csv
+💾 Данные сохраняются в файл: {os.path.basename(tenant.storage.filename)}
             """
             
             await update.message.reply_text(stats_message)
@@ -117,35 +239,130 @@ class SalesBot:
             logger.error(f"Ошибка при получении статистики: {e}")
             await update.message.reply_text("❌ Ошибка при получении статистики.")
     
+    async def top_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Обработчик команды /top [buyers|sources] [count|usdt|rub] [период] [N]"""
+        try:
+            kind, metric, limit, period = parse_top_args(context.args or [], default_limit=TOP_SIZE)
+        except ExportArgumentError as e:
+            await update.message.reply_text(
+                f"❌ {e}\n\nФормат: /top [buyers|sources] [count|usdt|rub] [неделя|месяц|год|с по] [N]\n"
+                "Например: /top sources usdt месяц 5"
+            )
+            return
+        limit = min(max(limit, 1), LIST_MAX_RECORDS)
+        
+        try:
+            leaders = await tenant.storage.top(kind, metric, limit, period)
+        except Exception as e:
+            logger.error(f"Ошибка при подсчете лидеров: {e}")
+            await update.message.reply_text("❌ Ошибка при подсчете лидеров.")
+            return
+        
+        title = "покупатели" if kind == 'buyers' else "источники"
+        order = {'total': "по числу размещений", 'usdt_total': "по сумме USDT", 'rub_total': "по сумме в рублях"}[metric]
+        if not leaders:
+            await update.message.reply_text(f"🏆 Нет записей{self._stats_scope(period)}.")
+            return
+        
+        lines = [f"🏆 Топ {title} {order}{self._stats_scope(period)}:", ""]
+        for place, (key, stats) in enumerate(leaders, start=1):
+            name = f"@{key}" if kind == 'buyers' else (key or "(без источника)")
+            lines.append(
+                f"{place}. {name} — {stats['total']:.0f} разм., "
+                f"{stats['usdt_total']:.0f} USDT, {stats['rub_total']:.0f}₽"
+            )
+        await update.message.reply_text("\n".join(lines))
+    
+    @staticmethod
+    def _stats_scope(stats_filter) -> str:
+        """' за 01.09.2025 - 30.09.2025, @nikita' - условия отбора в заголовке /stats (одна дата - с этого дня)"""
+        parts = []
+        if stats_filter.date_from:
+            date_from = stats_filter.date_from.strftime('%d.%m.%Y')
+            if stats_filter.date_to is None:
+                parts.append(f"с {date_from}")
+            elif stats_filter.date_to == stats_filter.date_from:
+                parts.append(f"за {date_from}")
+            else:
+                parts.append(f"за {date_from} - {stats_filter.date_to.strftime('%d.%m.%Y')}")
+        if stats_filter.buyer:
+            parts.append(f"@{stats_filter.buyer}")
+        if stats_filter.source:
+            parts.append(f"«{stats_filter.source}»")
+        return (" " + ", ".join(parts)) if parts else ""
+    
     
-    async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /export"""
+    async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Обработчик команды /export [с] [по] [@покупатель] [источник] [csv|gz|xlsx]"""
         try:
-            # Отправляем CSV файл пользователю
-            with open('sales_data.csv', 'rb') as file:
-                await update.message.reply_document(
-                    document=file,
+            export_filter, export_format = parse_export_args(context.args or [])
+        except ExportArgumentError as e:
+            await update.message.reply_text(
+                f"❌ {e}\n\nФормат: /export [с] [по] [@покупатель] [источник] [csv|gz|xlsx]\n"
+                "Например: /export 01.09 30.09 @nikita xlsx"
+            )
+            return
+        if not export_filter.is_empty or export_format != 'csv':
+            await self._export_filtered(update, tenant, export_filter, export_format)
+            return
+        
+        try:
+            # file_id прошлой загрузки, если журнал не менялся, иначе готовая или новая выгрузка во временном файле
+            document, version = await tenant.export_cache.document()
+            try:
+                sent = await update.message.reply_document(
+                    document=document,
                     filename='sales_data.csv',
                     caption='📊 Экспорт данных о продажах'
                 )
+            finally:
+                if not isinstance(document, str):
+                    document.close()
+            if not isinstance(document, str):
+                tenant.export_cache.remember(version, sent)
         except Exception as e:
             logger.error(f"Ошибка при экспорте: {e}")
             await update.message.reply_text("❌ Ошибка при экспорте данных.")
     
-    async def sheets_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /sheets для проверки статуса Google Sheets"""
+    async def _export_filtered(self, update: Update, tenant: Tenant, export_filter, export_format: str):
+        """Выгрузка с отбором: записи идут потоком во временный файл в пуле потоков хранилища"""
         try:
-            if self.storage.google_sheets.is_connected():
-                message = """
+            output, count = await tenant.storage.export(export_filter, export_format)
+            try:
+                if count == 0:
+                    await update.message.reply_text("🔍 Нет записей, подходящих под условия выгрузки.")
+                    return
+                await update.message.reply_document(
+                    document=output,
+                    filename=export_filename(export_format),
+                    caption=f'📊 Экспорт данных о продажах: {count} зап.'
+                )
+            finally:
+                output.close()
+        except Exception as e:
+            logger.error(f"Ошибка при экспорте: {e}")
+            await update.message.reply_text("❌ Ошибка при экспорте данных.")
+    
+    async def sheets_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Обработчик команды /sheets для проверки статуса Google Sheets (лист журнала этого чата)"""
+        try:
+            if tenant.storage.google_sheets.is_connected():
+                limits = tenant.storage.google_sheets.rate_limiter.snapshot()
+                message = f"""
 ✅ Google Sheets подключен!
 
+📄 Лист: {tenant.storage.google_sheets.sheet_name}
+
 📊 Данные автоматически синхронизируются с Google Sheets
 🔗 Таблица доступна по ссылке из config.py
 
+🚦 Квоты API: чтение {limits['read_tokens']:.0f} токенов ({limits['read_rate_per_minute']:.0f}/мин), запись {limits['write_tokens']:.0f} токенов ({limits['write_rate_per_minute']:.0f}/мин)
+⏳ В очереди: {limits['read_queue_depth'] + limits['write_queue_depth']}, ответов 429: {limits['quota_errors']}
+
 💡 Для настройки Google Sheets используйте инструкцию в файле GOOGLE_SHEETS_SETUP.md
                 """
             else:
-                message = """
+                message = f"""
 ❌ Google Sheets не подключен
 
 📝 Данные сохраняются только в локальный CSV файл
@@ -154,7 +371,7 @@ class SalesBot:
 2. Добавьте файл credentials.json в папку с ботом
 3. Перезапустите бота
 
-💾 Локальные данные доступны в файле sales_data.csv
+💾 Локальные данные доступны в файле {os.path.basename(tenant.storage.filename)}
                 """
             
             await update.message.reply_text(message)
@@ -163,41 +380,231 @@ class SalesBot:
             logger.error(f"Ошибка при проверке Google Sheets: {e}")
             await update.message.reply_text("❌ Ошибка при проверке статуса Google Sheets.")
     
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    def _is_admin(self, update: Update) -> bool:
+        """Проверяет, что команду вызвал администратор из ADMIN_IDS"""
+        return update.effective_user is not None and update.effective_user.id in ADMIN_IDS
+    
+    async def sync_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Обработчик команды /sync - сверка CSV журнала этого чата с его листом (только для администраторов)"""
+        if not self._is_admin(update):
+            await update.message.reply_text("⛔ Команда доступна только администраторам.")
+            return
+        
+        if not tenant.storage.google_sheets.is_connected():
+            await update.message.reply_text("❌ Google Sheets не подключен, сверять не с чем.")
+            return
+        
+        dry_run = bool(context.args) and context.args[0] == "check"
+        try:
+            await update.message.reply_text("🔄 Сверяю CSV и Google Sheets...")
+            reconciler = SheetsReconciler(tenant.storage.manager)
+            report = await tenant.storage.run(reconciler.reconcile, dry_run)
+            await update.message.reply_text(format_report(report))
+            
+        except Exception as e:
+            logger.error(f"Ошибка при сверке с Google Sheets: {e}")
+            await update.message.reply_text("❌ Ошибка при сверке с Google Sheets.")
+    
+    async def find_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Обработчик команды /find @покупатель слова источника [страница]"""
+        args = list(context.args or [])
+        page = max(1, int(args.pop())) if len(args) > 1 and args[-1].isdigit() else 1
+        buyers = [arg for arg in args if arg.startswith('@')]
+        words = [arg for arg in args if not arg.startswith('@')]
+        if not args:
+            await update.message.reply_text(
+                "🔍 Формат: /find @покупатель слова источника [страница]\n"
+                "Например: /find @maxim или /find бизнес 2"
+            )
+            return
+        
+        try:
+            total, records = await tenant.storage.find(buyers, words, (page - 1) * FIND_PAGE_SIZE, FIND_PAGE_SIZE)
+        except Exception as e:
+            logger.error(f"Ошибка при поиске: {e}")
+            await update.message.reply_text("❌ Ошибка при поиске.")
+            return
+        
+        if not records:
+            await update.message.reply_text("🔍 Ничего не найдено." if total == 0 else "🔍 Больше записей нет.")
+            return
+        
+        pages = (total + FIND_PAGE_SIZE - 1) // FIND_PAGE_SIZE
+        lines = [f"🔍 Найдено: {total} (страница {page} из {pages})", ""]
+        for row_id, row in records:
+            lines.append(f"#{row_id} {' | '.join(row)}")
+        if page < pages:
+            lines.extend(["", f"Дальше: /find {' '.join(args)} {page + 1}"])
+        await update.message.reply_text("\n".join(lines))
+    
+    async def list_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Обработчик команды /list [N] [#номер] - последние записи, начиная с конца журнала"""
+        limit = FIND_PAGE_SIZE
+        before = None
+        for arg in context.args or []:
+            if arg.startswith('#') and arg[1:].isdigit():
+                before = int(arg[1:])
+            elif arg.isdigit():
+                limit = min(max(int(arg), 1), LIST_MAX_RECORDS)
+        
+        try:
+            records = await tenant.storage.recent(limit, before)
+        except Exception as e:
+            logger.error(f"Ошибка при чтении последних записей: {e}")
+            await update.message.reply_text("❌ Ошибка при чтении записей.")
+            return
+        
+        if not records:
+            await update.message.reply_text("📋 Записей нет." if before is None else "📋 Больше записей нет.")
+            return
+        
+        lines = ["📋 Последние записи:" if before is None else f"📋 Записи до #{before}:", ""]
+        for row_id, row in records:
+            lines.append(f"#{row_id} {' | '.join(row)}")
+        last_id = records[-1][0]
+        if len(records) == limit and last_id > 1:
+            lines.extend(["", f"Дальше: /list {limit} #{last_id}"])
+        await update.message.reply_text("\n".join(lines))
+    
+    async def undo_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Обработчик команды /undo - отмена последней записи пользователя"""
+        try:
+            undone = await tenant.storage.undo(update.effective_user.id, message_id=update.message.message_id)
+        except Exception as e:
+            logger.error(f"Ошибка при отмене записи: {e}")
+            await update.message.reply_text("❌ Ошибка при отмене записи.")
+            return
+        
+        if undone is None:
+            await update.message.reply_text("↩️ Нечего отменять: ваших записей в журнале нет.")
+            return
+        
+        tenant.export_cache.changed()
+        row_id, row = undone
+        await update.message.reply_text(f"↩️ Запись #{row_id} отменена\n\n{' | '.join(row)}")
+    
+    async def trace_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /trace [N] - самые медленные из последних обновлений (только для администраторов)"""
+        if not self._is_admin(update):
+            await update.message.reply_text("⛔ Команда доступна только администраторам.")
+            return
+        
+        limit = int(context.args[0]) if context.args and context.args[0].isdigit() else 5
+        traces = slowest_traces(limit)
+        if not traces:
+            await update.message.reply_text("🐢 Медленных обновлений пока не было.")
+            return
+        
+        message = "🐢 Самые медленные обновления:\n\n" + "\n\n".join(format_trace(trace) for trace in traces)
+        # Ограничение Telegram на длину сообщения
+        await update.message.reply_text(message[:4000])
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /profile [секунды] - профиль CPU и памяти документом (только для администраторов)"""
+        if not self._is_admin(update):
+            await update.message.reply_text("⛔ Команда доступна только администраторам.")
+            return
+        
+        seconds = float(context.args[0]) if context.args and context.args[0].isdigit() else 10
+        try:
+            await update.message.reply_text(f"🔬 Снимаю профиль за {seconds:.0f} с...")
+            report = await capture_profile(seconds)
+            await update.message.reply_document(
+                document=report.encode('utf-8'),
+                filename=f"profile_{int(time.time())}.txt",
+                caption='🔬 Профиль: функции по суммарному времени и места выделения памяти'
+            )
+        except ProfilerBusyError:
+            await update.message.reply_text("⏳ Профиль уже снимается, дождитесь результата.")
+        except Exception as e:
+            logger.error(f"Ошибка при профилировании: {e}")
+            await update.message.reply_text("❌ Ошибка при профилировании.")
+    
+    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
         """Основной обработчик сообщений о продажах"""
-        message_text = update.message.text
+        with start_trace(
+            'message',
+            update_id=update.update_id,
+            chat_id=update.effective_chat.id,
+            user_id=update.effective_user.id,
+        ):
+            await self._handle_message(update, tenant)
+    
+    async def handle_edited_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Исправленное сообщение: правка записи, созданной исходным сообщением"""
+        with start_trace(
+            'edit',
+            update_id=update.update_id,
+            chat_id=update.effective_chat.id,
+            user_id=update.effective_user.id,
+        ):
+            await self._handle_message(update, tenant)
+    
+    async def _handle_message(self, update: Update, tenant: Tenant):
+        """Разбор, проверка, запись и ответ - каждый этап замеряется в трассировке"""
+        message = update.effective_message
+        message_text = message.text
+        message_key = f"{update.effective_chat.id}:{message.message_id}"
+        edited = update.edited_message is not None
         user_id = update.effective_user.id
         username = update.effective_user.username or "неизвестно"
         
-        logger.info(f"Получено сообщение от {username} ({user_id}): {message_text}")
+        logger.info("Получено сообщение от %s (%s)", username, user_id)
+        logger.debug("Текст сообщения %s: %s", update.update_id, message_text)
         
         try:
             # Парсим сообщение
-            parsed_data = self.parser.parse_message(message_text)
+            with span('parse'):
+                parsed_data = self.parser.parse_message(message_text)
             
             # Проверяем валидность данных
-            is_valid, error_message = self.parser.validate_parsed_data(parsed_data)
+            with span('validate'):
+                is_valid, error_message = self.parser.validate_parsed_data(parsed_data)
             
             if not is_valid:
-                await update.message.reply_text(
-                    f"❌ {error_message}\n\n"
-                    "Попробуйте переформулировать сообщение или используйте /help для примеров.\n\n"
-                    "Примеры правильных сообщений:\n"
-                    "• @nikita 15.12.2025 на 19:30 200usdt \"соль да перец\"\n"
-                    "• @ivan вчера на 14:00 150₽ \"криптоканал\"\n"
-                    "• @maria сегодня на 20:15 0.01btc \"телеграм группа\""
-                )
+                if edited:
+                    error_message += "\nЗапись по этому сообщению не изменена"
+                with span('reply'):
+                    await self.replies.reply(
+                        message,
+                        f"❌ {error_message}\n\n"
+                        "Попробуйте переформулировать сообщение или используйте /help для примеров.\n\n"
+                        "Примеры правильных сообщений:\n"
+                        "• @nikita 15.12.2025 на 19:30 200usdt \"соль да перец\"\n"
+                        "• @ivan вчера на 14:00 150₽ \"криптоканал\"\n"
+                        "• @maria сегодня на 20:15 0.01btc \"телеграм группа\""
+                    )
                 return
             
+            record = [parsed_data['buyer'], parsed_data['datetime'], parsed_data['amount'], parsed_data['source']]
+            if edited:
+                # Правка дописывается в журнал правок, в Google Sheets меняется одна строка
+                with span('amend'):
+                    row_id, record_change = await tenant.storage.amend(
+                        message_key, record, user_id=update.effective_user.id, message_id=message.message_id
+                    )
+                if row_id is not None:
+                    if record_change is not None:
+                        tenant.export_cache.changed()
+                        reply = (
+                            f"✏️ Запись #{row_id} исправлена\n\n"
+                            f"👤 {record[0]}\n📅 {record[1]}\n💰 {record[2]}\n📺 {record[3]}"
+                        )
+                    elif tenant.storage.is_retracted(row_id):
+                        reply = f"↩️ Запись #{row_id} уже отменена, правка не применена"
+                    else:
+                        reply = f"✏️ Запись #{row_id} не изменилась"
+                    with span('reply'):
+                        await self.replies.reply(message, reply)
+                    return
+                # Исходное сообщение записи не создало (например, было с ошибкой) - записываем как новое
+            
             # Сохраняем данные
-            success = self.storage.add_sale_record(
-                buyer=parsed_data['buyer'],
-                datetime=parsed_data['datetime'],
-                amount=parsed_data['amount'],
-                source=parsed_data['source']
-            )
+            with span('store'):
+                success = await tenant.storage.add(*record, message_key=message_key, author=update.effective_user.id)
             
             if success:
+                tenant.export_cache.changed()
                 # Отправляем подтверждение
                 confirmation = f"""
 ✅ Реклама успешно записана!
@@ -207,35 +614,289 @@ class SalesBot:
 💰 Сумма: {parsed_data['amount']}
 📺 Источник размещения: {parsed_data['source']}
 
-💾 Данные сохранены в sales_data.csv
+💾 Данные сохранены в {os.path.basename(tenant.storage.filename)}
 📊 Используйте /stats для просмотра статистики
                 """
-                await update.message.reply_text(confirmation)
-            else:
-                await update.message.reply_text(
-                    "❌ Ошибка при сохранении данных. Попробуйте еще раз."
+                # Уходит через REPLY_COALESCE_SECONDS вместе с другими подтверждениями этого чата
+                self.replies.confirm(
+                    message,
+                    confirmation,
+                    f"{parsed_data['buyer']} - {parsed_data['amount']} - "
+                    f"{parsed_data['source']} ({parsed_data['datetime']})"
                 )
+            else:
+                with span('reply'):
+                    await self.replies.reply(
+                        message,
+                        "❌ Ошибка при сохранении данных. Попробуйте еще раз."
+                    )
+        
+        except StorageBusyError as e:
+            logger.warning(f"Хранилище перегружено: {e}")
+            await self.replies.reply(
+                message,
+                "⏳ Бот сейчас перегружен, запись не сохранена. Отправьте сообщение еще раз через минуту."
+            )
         
         except Exception as e:
             logger.error(f"Ошибка при обработке сообщения: {e}")
-            await update.message.reply_text(
+            await self.replies.reply(
+                message,
                 "❌ Произошла ошибка при обработке сообщения. Попробуйте еще раз."
             )
     
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tenant: Tenant):
+        """Импорт записей из документа: каждая строка разбирается как сообщение о продаже"""
+        document = update.message.document
+        if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+            await self.replies.reply(
+                update.message,
+                f"❌ Файл больше {IMPORT_MAX_BYTES // (1024 * 1024)} МБ, разделите его на части."
+            )
+            return
+        
+        with start_trace('import', update_id=update.update_id, chat_id=update.effective_chat.id,
+                         user_id=update.effective_user.id):
+            status = await self.replies.reply(update.message, "⏳ Загружаю документ...")
+            last_progress = time.monotonic()
+            
+            async def progress(result):
+                # Статус правится не чаще раза в IMPORT_PROGRESS_SECONDS
+                nonlocal last_progress
+                if time.monotonic() - last_progress < IMPORT_PROGRESS_SECONDS:
+                    return
+                last_progress = time.monotonic()
+                try:
+                    await self.replies.edit(status, format_progress(result))
+                except Exception as e:
+                    logger.debug("Не удалось обновить статус импорта: %s", e)
+            
+            extension = document_extension(document.file_name)
+            descriptor, path = tempfile.mkstemp(suffix=f'.{extension}')
+            os.close(descriptor)
+            try:
+                with span('download'):
+                    telegram_file = await document.get_file()
+                    await telegram_file.download_to_drive(path)
+                with span('import'):
+                    result = await tenant.importer.run(path, extension, progress)
+            except StorageBusyError as e:
+                logger.warning(f"Хранилище перегружено при импорте: {e}")
+                await self.replies.edit(status, "⏳ Бот сейчас перегружен, импорт прерван. Попробуйте позже.")
+                return
+            except Exception:
+                logger.exception("Ошибка при импорте документа")
+                await self.replies.edit(status, "❌ Ошибка при импорте документа. Проверьте файл и попробуйте еще раз.")
+                return
+            finally:
+                os.remove(path)
+            
+            try:
+                if result.imported:
+                    tenant.export_cache.changed()
+                await self.replies.edit(status, format_progress(result, done=True))
+                if result.rejected:
+                    await update.message.reply_document(
+                        document=result.rejects_bytes(),
+                        filename='rejected.csv',
+                        caption=f'❌ Строки, которые не удалось разобрать: {result.rejected}'
+                    )
+            finally:
+                result.close()
+    
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ошибок"""
         logger.error(f"Exception while handling an update: {context.error}")
     
+    async def health_endpoint(self, request: Request) -> Response:
+        """GET /health - бот жив"""
+        return Response(200, b'OK')
+    
+    def _readiness(self) -> dict:
+        """Состояние зависимостей для /ready"""
+        primary = self.storage.fanout.primary.health
+        if self.storage.google_sheets.is_connected():
+            sheets = 'connected'
+        elif is_google_sheets_enabled():
+            sheets = 'disconnected'
+        else:
+            sheets = 'disabled'
+        checks = {
+            'bot': self.application.running,
+            'storage': os.path.exists(self.storage.filename) and primary.healthy,
+            'sheets': sheets,
+        }
+        checks['ready'] = checks['bot'] and checks['storage'] and sheets != 'disconnected'
+        return checks
+    
+    async def ready_endpoint(self, request: Request) -> Response:
+        """GET /ready - бот принимает обновления, CSV доступен, Google Sheets подключен (если настроен)"""
+        checks = self._readiness()
+        return Response(
+            200 if checks['ready'] else 503,
+            json.dumps(checks, ensure_ascii=False),
+            content_type='application/json'
+        )
+    
+    def _debug_stats(self) -> dict:
+        """Живые показатели процесса для /debug/stats и /metrics"""
+        return {
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'mode': BOT_MODE,
+            'updates': self.update_processor.snapshot(),
+            'storage': self.storage.snapshot(),
+            'flood': self.flood_control.snapshot(),
+            'replies': self.replies.snapshot(),
+            'export': self.tenants.default.export_cache.snapshot(),
+            'tenants': self.tenants.snapshot(),
+            'sinks': self.storage.fanout.snapshot(),
+            'sheets_quota': self.storage.google_sheets.rate_limiter.snapshot(),
+            'ready': self._readiness(),
+        }
+    
+    async def debug_stats_endpoint(self, request: Request) -> Response:
+        """GET /debug/stats - подробное состояние в JSON (нужен ADMIN_HTTP_TOKEN)"""
+        if not self._is_http_admin(request):
+            return Response(403, b'Forbidden')
+        return Response(
+            200,
+            json.dumps(self._debug_stats(), ensure_ascii=False, indent=2),
+            content_type='application/json'
+        )
+    
+    async def debug_profile_endpoint(self, request: Request) -> Response:
+        """GET /debug/profile?seconds=N - то же, что /profile, текстом (нужен ADMIN_HTTP_TOKEN)"""
+        if not self._is_http_admin(request):
+            return Response(403, b'Forbidden')
+        try:
+            seconds = float(request.query.get('seconds', 10))
+        except ValueError:
+            return Response(400, b'Bad Request')
+        try:
+            return Response(200, await capture_profile(seconds))
+        except ProfilerBusyError:
+            return Response(409, b'Profiling already in progress')
+    
+    def _is_http_admin(self, request: Request) -> bool:
+        """Токен из заголовка Authorization: Bearer ... или параметра ?token=..."""
+        if not ADMIN_HTTP_TOKEN:
+            return False
+        header = request.headers.get('authorization', '')
+        token = header[7:] if header.startswith('Bearer ') else request.query.get('token', '')
+        return token == ADMIN_HTTP_TOKEN
+    
+    async def metrics_endpoint(self, request: Request) -> Response:
+        """GET /metrics - метрики в текстовом формате Prometheus"""
+        stats = self._debug_stats()
+        exposition = Exposition()
+        exposition.gauge('salesbot_up', 'Бот работает', 1)
+        exposition.gauge('salesbot_ready', 'Бот готов принимать обновления', stats['ready']['ready'])
+        exposition.gauge('salesbot_uptime_seconds', 'Время работы процесса', stats['uptime_seconds'])
+        
+        updates = stats['updates']
+        exposition.gauge('salesbot_updates_active', 'Обновления в обработке', updates['active'])
+        exposition.gauge('salesbot_updates_pending', 'Обновления, ждущие очереди своего чата', updates['pending'])
+        exposition.gauge('salesbot_updates_limit', 'Лимит одновременных обновлений', updates['limit'])
+        exposition.gauge('salesbot_ingest_queue_depth', 'Обновления в очереди приема (в обработке и ожидании)',
+                         stats['flood']['in_flight'])
+        exposition.gauge('salesbot_ingest_queue_size', 'Размер очереди приема', stats['flood']['queue_size'])
+        exposition.gauge('salesbot_replies_pending', 'Подтверждения, ждущие склейки и отправки',
+                         stats['replies']['pending_confirmations'])
+        exposition.gauge('salesbot_storage_pending_writes', 'Записи в очереди потока-писателя',
+                         stats['storage']['pending_writes'])
+        
+        for name, sink in stats['sinks'].items():
+            labels = {'sink': name}
+            exposition.gauge('salesbot_sink_queue_depth', 'Записи в очереди приемника', sink['queue_depth'], labels)
+            exposition.gauge('salesbot_sink_healthy', 'Последняя запись в приемник успешна', sink['healthy'], labels)
+            exposition.counter('salesbot_sink_written_total', 'Записано строк в приемник', sink['written'], labels)
+            exposition.counter('salesbot_sink_failed_total', 'Неудачных записей пачек', sink['failed'], labels)
+            exposition.counter('salesbot_sink_dropped_total', 'Отброшено строк', sink['dropped'], labels)
+        
+        quota = stats['sheets_quota']
+        for kind in ('read', 'write'):
+            labels = {'kind': kind}
+            exposition.gauge('salesbot_sheets_tokens', 'Доступные токены квоты Google Sheets',
+                             quota[f'{kind}_tokens'], labels)
+            exposition.gauge('salesbot_sheets_rate_per_minute', 'Текущая скорость запросов к Google Sheets',
+                             quota[f'{kind}_rate_per_minute'], labels)
+            exposition.gauge('salesbot_sheets_queue_depth', 'Запросы, ждущие квоты Google Sheets',
+                             quota[f'{kind}_queue_depth'], labels)
+        exposition.counter('salesbot_sheets_calls_total', 'Запросы к Google Sheets', quota['calls'])
+        exposition.counter('salesbot_sheets_quota_errors_total', 'Ответы 429 от Google Sheets', quota['quota_errors'])
+        exposition.counter('salesbot_sheets_wait_seconds_total', 'Время ожидания квоты', quota['wait_seconds'])
+        
+        # Счетчики и гистограммы конвейера (разбор, CSV, Google Sheets, Telegram)
+        collect_registry(exposition)
+        
+        return Response(200, exposition.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+    
+    async def webhook_endpoint(self, request: Request) -> Response:
+        """POST WEBHOOK_PATH - обновление от Telegram"""
+        # Сравнение за постоянное время; без заголовка запрос отклоняется
+        secret = request.headers.get('x-telegram-bot-api-secret-token')
+        if secret is None or not hmac.compare_digest(secret.encode('utf-8'), WEBHOOK_SECRET.encode('utf-8')):
+            logger.warning("Вебхук с неверным секретом отклонен")
+            return Response(403, b'Forbidden')
+        
+        try:
+            update = Update.de_json(json.loads(request.body), self.application.bot)
+        except (ValueError, TypeError) as e:
+            logger.error(f"Некорректное обновление в вебхуке: {e}")
+            return Response(400, b'Bad Request')
+        
+        # Обработка идет в фоне, Telegram сразу получает ответ
+        await self.application.update_queue.put(update)
+        return Response(200, b'OK')
+    
+    async def _run_webhook(self):
+        """Режим вебхука: обновления Telegram приходят на тот же HTTP сервер, что и /health"""
+        if not WEBHOOK_URL:
+            raise RuntimeError("Для BOT_MODE=webhook нужен WEBHOOK_URL (или RAILWAY_PUBLIC_DOMAIN)")
+        
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                # Windows: остановка по Ctrl+C через KeyboardInterrupt
+                pass
+        
+        await self.application.initialize()
+        await self._post_init(self.application)
+        try:
+            await self.application.start()
+            await self.application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Вебхук установлен: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+            await stop_event.wait()
+        finally:
+            if self.application.running:
+                await self.application.stop()
+            await self._post_shutdown(self.application)
+            await self.application.shutdown()
+    
     def run(self):
         """Запуск бота"""
         # Добавляем обработчик ошибок
         self.application.add_error_handler(self.error_handler)
         
-        logger.info("Запуск бота...")
+        logger.info(f"Запуск бота (режим {BOT_MODE})...")
         print("🤖 Бот запущен! Нажмите Ctrl+C для остановки.")
         
         # Запускаем бота
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if BOT_MODE == "webhook":
+            try:
+                asyncio.run(self._run_webhook())
+            except KeyboardInterrupt:
+                pass
+        else:
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 def test_parser_locally():
     """Локальный тест парсера"""
@@ -278,39 +939,24 @@ def test_parser_locally():
     stats = storage.get_stats()
     print(f"📊 Всего записей: {stats['total']}")
 
-def create_web_server():
-    """Создает простой веб-сервер для Railway"""
-    from http.server import HTTPServer, BaseHTTPRequestHandler
-    import threading
-    
-    class HealthCheckHandler(BaseHTTPRequestHandler):
-        def do_GET(self):
-            if self.path == '/health':
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b'OK')
-            else:
-                self.send_response(404)
-                self.end_headers()
-    
-    def run_server():
-        server = HTTPServer(('0.0.0.0', PORT), HealthCheckHandler)
-        logger.info(f"Web server running on port {PORT}")
-        server.serve_forever()
+def sync_sheets_cli(dry_run: bool = False):
+    """Сверка CSV с Google Sheets из консоли: python main.py sync [--dry-run]"""
+    storage = SimpleStorageManager()
+    if not storage.google_sheets.is_connected():
+        print("❌ Google Sheets не подключен")
+        return
     
-    # Запускаем веб-сервер в отдельном потоке
-    server_thread = threading.Thread(target=run_server, daemon=True)
-    server_thread.start()
+    report = SheetsReconciler(storage).reconcile(dry_run=dry_run)
+    print(format_report(report))
 
 if __name__ == "__main__":
     import sys
+    setup_logging()
     if len(sys.argv) > 1 and sys.argv[1] == "test":
         test_parser_locally()
+    elif len(sys.argv) > 1 and sys.argv[1] == "sync":
+        sync_sheets_cli(dry_run="--dry-run" in sys.argv[2:])
     else:
-        # Запускаем веб-сервер для Railway
-        create_web_server()
-        
-        # Запускаем бота
+        # Запускаем бота (HTTP сервер для Railway стартует вместе с ним)
         bot = SalesBot()
         bot.run()
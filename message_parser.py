@@ -1,11 +1,11 @@
 import re
 import logging
+import time as time_module
 from datetime import datetime
 from typing import Dict, Optional, Tuple
 import pytz
+from metrics import PARSE_SECONDS, VALIDATION_FAILURES
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class SaleMessageParser:
@@ -63,20 +63,21 @@ class SaleMessageParser:
         Returns:
             Dict с ключами: buyer, datetime, amount, source
         """
+        started = time_module.perf_counter()
         original_text = message_text
         message_text_lower = message_text.lower().strip()
-        logger.info(f"Парсинг сообщения: {message_text}")
+        logger.debug("Парсинг сообщения: %s", message_text)
         
         # Сначала пытаемся парсить как неформатированный текст
         is_unformatted = self._is_unformatted_text(message_text)
-        logger.info(f"Текст неформатированный: {is_unformatted}")
+        logger.debug("Текст неформатированный: %s", is_unformatted)
         
         if is_unformatted:
             result = self._parse_unformatted_text(message_text)
-            logger.info(f"Результат неформатированного парсинга: {result}")
+            logger.debug("Результат неформатированного парсинга: %s", result)
             # Проверяем, что хотя бы покупатель определен
             if result and result.get('buyer'):
-                logger.info(f"Результат парсинга (неформатированный): {result}")
+                self._observe(started, 'unformatted', result)
                 return result
         
         # Если не получилось, используем стандартный парсинг
@@ -100,9 +101,17 @@ class SaleMessageParser:
             'source': self._extract_source(original_text)
         }
         
-        logger.info(f"Результат парсинга: {result}")
+        logger.debug("Результат парсинга: %s", result)
+        self._observe(started, 'formatted', result)
         return result
     
+    @staticmethod
+    def _observe(started: float, outcome: str, result: Dict[str, Optional[str]]):
+        """Время разбора по исходу: без покупателя или суммы сообщение будет отклонено"""
+        if not result.get('buyer') or not result.get('amount'):
+            outcome = 'rejected'
+        PARSE_SECONDS.observe(time_module.perf_counter() - started, outcome=outcome)
+    
     def _extract_date(self, text: str) -> Optional[str]:
         """Извлекает дату из текста"""
         # Проверяем специальные слова
@@ -300,9 +309,11 @@ class SaleMessageParser:
             Tuple[bool, str]: (валидность, сообщение об ошибке)
         """
         if not data.get('buyer'):
+            VALIDATION_FAILURES.inc(reason='no_buyer')
             return False, "Не удалось определить ник покупателя"
         
         if not data.get('amount'):
+            VALIDATION_FAILURES.inc(reason='no_amount')
             return False, "Не удалось определить сумму"
         
         # Источник не обязателен для неформатированного текста
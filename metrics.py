@@ -0,0 +1,223 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Тип содержимого текстового формата Prometheus
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if math.isnan(value):
+            return 'NaN'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels.items():
+        escaped = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        parts.append(f'{key}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Exposition:
+    """
+    Сборщик ответа /metrics в текстовом формате Prometheus.
+
+    HELP и TYPE пишутся один раз на метрику, значения с разными
+    метками группируются под ней в порядке добавления.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, List[str]] = {}
+
+    def add(self, name: str, kind: str, help_text: str, value: float,
+            labels: Optional[Dict[str, str]] = None, suffix: str = ''):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        family.append(f'{name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+
+    def gauge(self, name: str, help_text: str, value: float, labels: Optional[Dict[str, str]] = None):
+        self.add(name, 'gauge', help_text, value, labels)
+
+    def counter(self, name: str, help_text: str, value: float, labels: Optional[Dict[str, str]] = None):
+        self.add(name, 'counter', help_text, value, labels)
+
+    def render(self) -> str:
+        return '\n'.join(line for family in self._families.values() for line in family) + '\n'
+
+
+class _ShardedMetric:
+    """
+    Основа счетчиков и гистограмм без блокировок на горячем пути.
+
+    Каждый поток пишет только в свой шард (словарь в threading.local),
+    поэтому запись не требует блокировки. Блокировка берется один раз
+    при появлении нового потока и при чтении для /metrics, где шарды
+    копируются и складываются. Шарды завершившихся потоков при чтении
+    переносятся в общий итог и удаляются - пулы потоков, которые
+    создаются и закрываются, не копят шарды.
+    """
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # Шарды живых потоков по потоку и итог завершившихся
+        self._shards: Dict[threading.Thread, Dict] = {}
+        self._retired: Dict = {}
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards[threading.current_thread()] = shard
+        return shard
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _merge(self, totals: Dict, shard: Dict):
+        """Добавляет значения шарда к totals"""
+        raise NotImplementedError
+
+    def _totals(self) -> Dict:
+        with self._shards_lock:
+            for thread in [thread for thread in self._shards if not thread.is_alive()]:
+                # Завершившийся поток в свой шард больше не пишет
+                self._merge(self._retired, self._shards.pop(thread))
+            totals: Dict = {}
+            self._merge(totals, self._retired)
+            shards = list(self._shards.values())
+        for shard in shards:
+            # dict.copy выполняется целиком под GIL, поэтому копия согласована
+            self._merge(totals, shard.copy())
+        return totals
+
+
+class Counter(_ShardedMetric):
+    """Монотонный счетчик с метками"""
+
+    def inc(self, amount: float = 1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, totals: Dict, shard: Dict):
+        for key, value in shard.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        return self._totals()
+
+    def collect(self, exposition: 'Exposition'):
+        for key, value in sorted(self.values().items()):
+            exposition.counter(self.name, self.help_text, value, dict(zip(self.labelnames, key)))
+
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(_ShardedMetric):
+    """Гистограмма длительностей с метками"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # Счетчики корзин (последняя - +Inf), затем сумма и количество
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Замеряет длительность блока with"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _merge(self, totals: Dict, shard: Dict):
+        for key, state in shard.items():
+            total = totals.get(key)
+            if total is None:
+                totals[key] = list(state)
+            else:
+                for index, value in enumerate(state):
+                    total[index] += value
+
+    def values(self) -> Dict[Tuple[str, ...], List[float]]:
+        return self._totals()
+
+    def collect(self, exposition: 'Exposition'):
+        for key, state in sorted(self.values().items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                exposition.add(self.name, 'histogram', self.help_text, cumulative,
+                               dict(labels, le=_format_value(float(bound))), suffix='_bucket')
+            exposition.add(self.name, 'histogram', self.help_text, state[-2], labels, suffix='_sum')
+            exposition.add(self.name, 'histogram', self.help_text, state[-1], labels, suffix='_count')
+
+
+# Все созданные счетчики и гистограммы - попадают в /metrics
+REGISTRY: List[_ShardedMetric] = []
+
+
+def collect_registry(exposition: Exposition):
+    """Добавляет в ответ /metrics значения всех счетчиков и гистограмм"""
+    for metric in REGISTRY:
+        metric.collect(exposition)
+
+
+# Метрики конвейера разбор -> запись -> синхронизация -> ответ
+PARSE_SECONDS = Histogram(
+    'salesbot_parse_seconds', 'Время разбора сообщения', ['outcome']
+)
+VALIDATION_FAILURES = Counter(
+    'salesbot_validation_failures_total', 'Сообщения, не прошедшие проверку', ['reason']
+)
+CSV_APPEND_SECONDS = Histogram(
+    'salesbot_csv_append_seconds', 'Время дозаписи пачки строк в CSV'
+)
+SHEETS_CALL_SECONDS = Histogram(
+    'salesbot_sheets_call_seconds', 'Время запроса к Google Sheets (с повторами)', ['kind', 'method']
+)
+SHEETS_ERRORS = Counter(
+    'salesbot_sheets_errors_total', 'Ошибки запросов к Google Sheets', ['kind', 'reason']
+)
+TELEGRAM_REQUEST_SECONDS = Histogram(
+    'salesbot_telegram_request_seconds', 'Время запроса к Telegram Bot API', ['method']
+)
+TELEGRAM_ERRORS = Counter(
+    'salesbot_telegram_errors_total', 'Ошибки запросов к Telegram Bot API', ['method']
+)
@@ -0,0 +1,113 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from datetime import datetime
+from typing import List
+from config import PROFILE_MAX_SECONDS, PROFILE_TOP
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusyError(Exception):
+    """Профилирование уже запущено"""
+
+
+# Одновременно снимается только один профиль (все вызовы - из цикла событий бота)
+_running = False
+
+
+def _rss_mb() -> float:
+    """Пиковый объем памяти процесса, МБ (0 если недоступно)"""
+    if resource is None:
+        return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _format_allocations(stats: List[tracemalloc.StatisticDiff], top: int) -> List[str]:
+    lines = []
+    for stat in stats[:top]:
+        frame = stat.traceback[0]
+        lines.append(
+            f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} блоков "
+            f"(всего {stat.size / 1024:.1f} KiB)  {frame.filename}:{frame.lineno}"
+        )
+    return lines
+
+
+async def capture_profile(seconds: float, top: int = PROFILE_TOP) -> str:
+    """
+    Снимает профиль работающего процесса за seconds секунд.
+
+    cProfile включается в потоке цикла событий, поэтому в профиль попадает
+    все, что бот выполнял за это время: обработчики, разбор, ответы.
+    Работа в пулах потоков (запись CSV, Google Sheets) видна как ожидание
+    в run_in_executor. tracemalloc сравнивает снимки памяти в начале и в
+    конце окна и показывает места, где выделено больше всего.
+
+    Returns:
+        str: Текстовый отчет
+
+    Raises:
+        ProfilerBusyError: если профилирование уже идет
+    """
+    global _running
+    if _running:
+        raise ProfilerBusyError("профилирование уже запущено")
+
+    seconds = max(1.0, min(float(seconds), PROFILE_MAX_SECONDS))
+    _running = True
+    try:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(1)
+        before = tracemalloc.take_snapshot()
+        rss_before = _rss_mb()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            after = tracemalloc.take_snapshot()
+            traced_current, traced_peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+    finally:
+        _running = False
+
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ]
+    allocations = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+
+    stats_output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stats_output)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+    lines = [
+        f"Профиль процесса {os.getpid()} от {datetime.now().isoformat(timespec='seconds')}",
+        f"Окно: {elapsed:.1f} с",
+        f"Память (пик RSS): {rss_before:.1f} -> {_rss_mb():.1f} МБ",
+        f"tracemalloc: сейчас {traced_current / 1024 / 1024:.1f} МБ, пик {traced_peak / 1024 / 1024:.1f} МБ",
+        "",
+        f"=== Функции по суммарному времени (топ {top}) ===",
+        stats_output.getvalue().strip(),
+        "",
+        f"=== Места выделения памяти за окно (топ {top}) ===",
+    ]
+    lines += _format_allocations(allocations, top) or ["нет изменений"]
+    logger.info(f"Профиль снят за {elapsed:.1f} с")
+    return '\n'.join(lines) + '\n'
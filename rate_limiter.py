@@ -0,0 +1,198 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from config import (
+    SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE,
+    SHEETS_MAX_RETRIES, SHEETS_MIN_RATE_FACTOR
+)
+from metrics import SHEETS_CALL_SECONDS, SHEETS_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в минуту, не больше capacity за раз"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.base_rate = float(rate_per_minute)
+        self.rate = float(rate_per_minute)
+        self.capacity = float(capacity if capacity is not None else max(rate_per_minute / 6, 1))
+        self.tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate / 60)
+            self._updated_at = now
+
+    def try_acquire(self, now: float, tokens: float = 1) -> float:
+        """
+        Пытается взять токены
+
+        Returns:
+            float: 0 если токены взяты, иначе сколько секунд ждать
+        """
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) * 60 / self.rate
+
+    def current(self, now: float) -> float:
+        """Текущее количество токенов"""
+        self._refill(now)
+        return self.tokens
+
+
+class RateLimitError(Exception):
+    """Квота Google Sheets исчерпана и повторные попытки не помогли"""
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Секунды из заголовка Retry-After ответа 429 (если есть)"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    value = headers.get('Retry-After') if hasattr(headers, 'get') else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_quota_error(error: Exception) -> bool:
+    """Ответ 429 Too Many Requests от Google API"""
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) == 429
+
+
+class SheetsRateLimiter:
+    """
+    Общий ограничитель запросов к Google Sheets API.
+
+    Чтение и запись идут через отдельные корзины токенов. Пока в очереди
+    есть запись, чтения ждут. На ответ 429 все запросы приостанавливаются
+    на Retry-After, а скорость корзин снижается вдвое. После успешных
+    запросов скорость постепенно возвращается к настроенной.
+    """
+
+    def __init__(self, reads_per_minute: float = SHEETS_READS_PER_MINUTE,
+                 writes_per_minute: float = SHEETS_WRITES_PER_MINUTE,
+                 max_retries: int = SHEETS_MAX_RETRIES,
+                 min_rate_factor: float = SHEETS_MIN_RATE_FACTOR):
+        self.buckets = {
+            'read': TokenBucket(reads_per_minute),
+            'write': TokenBucket(writes_per_minute),
+        }
+        self.max_retries = max_retries
+        self.min_rate_factor = min_rate_factor
+        self._condition = threading.Condition()
+        self._waiting = {'read': 0, 'write': 0}
+        self._paused_until = 0.0
+        self._stats = {
+            'calls': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'quota_errors': 0,
+        }
+
+    def acquire(self, kind: str):
+        """Блокирует поток, пока запрос вида kind ('read'/'write') не может быть выполнен"""
+        bucket = self.buckets[kind]
+        started = time.monotonic()
+        waited = False
+        with self._condition:
+            self._waiting[kind] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = self._paused_until - now
+                    if delay <= 0 and kind == 'read' and self._waiting['write']:
+                        # Записи в приоритете: чтение ждет, пока очередь записей не опустеет
+                        delay = 0.05
+                    if delay <= 0:
+                        delay = bucket.try_acquire(now)
+                    if delay <= 0:
+                        break
+                    waited = True
+                    self._condition.wait(timeout=delay)
+            finally:
+                self._waiting[kind] -= 1
+                self._condition.notify_all()
+
+            self._stats['calls'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_seconds'] += time.monotonic() - started
+
+    def call(self, kind: str, method: Callable, *args, **kwargs) -> Any:
+        """Выполняет запрос к API через ограничитель, повторяя его после 429"""
+        attempt = 0
+        started = time.perf_counter()
+        method_name = getattr(method, '__name__', 'call')
+        while True:
+            self.acquire(kind)
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                if not _is_quota_error(e):
+                    SHEETS_ERRORS.inc(kind=kind, reason='error')
+                    raise
+                SHEETS_ERRORS.inc(kind=kind, reason='429')
+                attempt += 1
+                delay = self._on_quota_error(_retry_after(e), attempt)
+                if attempt > self.max_retries:
+                    raise RateLimitError(f"Квота Google Sheets исчерпана: {e}") from e
+                logger.warning(f"Google Sheets вернул 429, пауза {delay:.1f} с (попытка {attempt})")
+                continue
+            self._on_success()
+            SHEETS_CALL_SECONDS.observe(time.perf_counter() - started, kind=kind, method=method_name)
+            return result
+
+    def _on_quota_error(self, retry_after: Optional[float], attempt: int) -> float:
+        """Пауза для всех запросов и снижение скорости корзин"""
+        delay = retry_after if retry_after is not None else min(2 ** attempt, 64)
+        with self._condition:
+            self._stats['quota_errors'] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            for bucket in self.buckets.values():
+                bucket.rate = max(bucket.rate / 2, bucket.base_rate * self.min_rate_factor)
+                bucket.tokens = 0.0
+            self._condition.notify_all()
+        return delay
+
+    def _on_success(self):
+        """Плавно возвращает скорость корзин к настроенной после 429"""
+        with self._condition:
+            for bucket in self.buckets.values():
+                if bucket.rate < bucket.base_rate:
+                    bucket.rate = min(bucket.base_rate, bucket.rate + bucket.base_rate * 0.05)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Метрики ограничителя: токены, скорость, очередь и события троттлинга"""
+        with self._condition:
+            now = time.monotonic()
+            metrics = {
+                'paused_seconds': max(0.0, self._paused_until - now),
+            }
+            for kind, bucket in self.buckets.items():
+                metrics[f'{kind}_tokens'] = round(bucket.current(now), 2)
+                metrics[f'{kind}_rate_per_minute'] = round(bucket.rate, 2)
+                metrics[f'{kind}_queue_depth'] = self._waiting[kind]
+            metrics.update(self._stats)
+            metrics['wait_seconds'] = round(metrics['wait_seconds'], 3)
+            return metrics
+
+
+_rate_limiter: Optional[SheetsRateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> SheetsRateLimiter:
+    """Общий на процесс ограничитель запросов к Google Sheets"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = SheetsRateLimiter()
+        return _rate_limiter
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+from telegram import Message
+from telegram.error import RetryAfter
+from config import (
+    REPLY_COALESCE_SECONDS, REPLY_EDIT_WINDOW, REPLY_MAX_ENTRIES,
+    TELEGRAM_CHAT_PER_MINUTE, TELEGRAM_GLOBAL_PER_SECOND
+)
+from metrics import Counter
+from rate_limiter import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+REPLIES = Counter(
+    'salesbot_replies_total', 'Исходящие ответы по способу отправки', ['kind']
+)
+
+# Сколько раз повторять отправку после RetryAfter
+_MAX_RETRIES = 3
+
+
+class _ChatReplies:
+    """Состояние подтверждений одного чата"""
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        # Небольшой запас подряд: сводки и редкие ответы об ошибках не ждут
+        self.bucket = TokenBucket(TELEGRAM_CHAT_PER_MINUTE, max(TELEGRAM_CHAT_PER_MINUTE / 4, 1))
+        # Подтверждения, ждущие отправки: (сообщение пользователя, полный текст, строка сводки)
+        self.pending: List[tuple] = []
+        self.flush_task: Optional[asyncio.Task] = None
+        # Последнее отправленное подтверждение, которое можно дополнить правкой
+        self.last_message: Optional[Message] = None
+        self.last_lines: List[str] = []
+        self.last_sent_at = 0.0
+
+
+class ReplyScheduler:
+    """
+    Исходящие ответы с учетом лимитов Telegram.
+
+    Подтверждения записей не отправляются сразу: в течение
+    REPLY_COALESCE_SECONDS они копятся по чату и уходят одним сообщением.
+    Если недавно (REPLY_EDIT_WINDOW) в чат уже ушло подтверждение, оно
+    дополняется правкой вместо нового сообщения. Все отправки проходят
+    корзины токенов чата и бота, а после RetryAfter повторяются через
+    указанное Telegram время.
+    """
+
+    def __init__(self, coalesce_seconds: float = REPLY_COALESCE_SECONDS,
+                 edit_window: float = REPLY_EDIT_WINDOW, max_entries: int = REPLY_MAX_ENTRIES):
+        self.coalesce_seconds = coalesce_seconds
+        self.edit_window = edit_window
+        self.max_entries = max_entries
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_PER_SECOND * 60, TELEGRAM_GLOBAL_PER_SECOND)
+        self._chats: Dict[int, _ChatReplies] = {}
+        self._paused_until = 0.0
+
+    def _chat(self, chat_id: int) -> _ChatReplies:
+        state = self._chats.get(chat_id)
+        if state is None:
+            if len(self._chats) > 1000:
+                self._prune()
+            state = self._chats[chat_id] = _ChatReplies(chat_id)
+        return state
+
+    def _prune(self):
+        """Забывает чаты без ожидающих подтверждений и с устаревшим последним ответом"""
+        now = time.monotonic()
+        for chat_id in [
+            chat_id for chat_id, state in self._chats.items()
+            if not state.pending and now - state.last_sent_at > self.edit_window
+        ]:
+            del self._chats[chat_id]
+
+    async def _acquire(self, state: _ChatReplies):
+        """Ждет токен чата и общий токен бота, а также конец паузы после RetryAfter"""
+        for bucket in (state.bucket, self.global_bucket):
+            while True:
+                now = time.monotonic()
+                pause = self._paused_until - now
+                delay = pause if pause > 0 else bucket.try_acquire(now)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+
+    async def _call(self, state: _ChatReplies, method, *args, **kwargs):
+        """Вызов Bot API в рамках лимитов; после RetryAfter ждет и повторяет"""
+        for attempt in range(_MAX_RETRIES + 1):
+            await self._acquire(state)
+            try:
+                return await method(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = float(e.retry_after)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                REPLIES.inc(kind='retry_after')
+                logger.warning(f"Telegram просит подождать {retry_after:.0f} с (чат {state.chat_id})")
+                if attempt == _MAX_RETRIES:
+                    raise
+
+    async def reply(self, message: Message, text: str) -> Optional[Message]:
+        """Обычный ответ на сообщение - сразу, но в рамках лимитов"""
+        REPLIES.inc(kind='reply')
+        return await self._call(self._chat(message.chat_id), message.reply_text, text)
+
+    async def edit(self, message: Message, text: str) -> Optional[Message]:
+        """Правка уже отправленного ботом сообщения (например, статуса) в рамках лимитов"""
+        REPLIES.inc(kind='edit')
+        return await self._call(self._chat(message.chat_id), message.edit_text, text)
+
+    def confirm(self, message: Message, text: str, line: str):
+        """
+        Ставит подтверждение записи в очередь чата
+
+        Args:
+            message: Сообщение пользователя, на которое отвечаем
+            text: Полное подтверждение (если оно окажется единственным)
+            line: Строка для сводного подтверждения
+        """
+        state = self._chat(message.chat_id)
+        state.pending.append((message, text, line))
+        if state.flush_task is None or state.flush_task.done():
+            state.flush_task = asyncio.create_task(self._flush_later(state))
+
+    async def _flush_later(self, state: _ChatReplies):
+        await asyncio.sleep(self.coalesce_seconds)
+        await self._flush(state)
+
+    async def _flush(self, state: _ChatReplies):
+        while state.pending:
+            batch, state.pending = state.pending, []
+            try:
+                await self._send_batch(state, batch)
+            except Exception as e:
+                logger.error(f"Не удалось отправить подтверждение в чат {state.chat_id}: {e}")
+
+    async def _send_batch(self, state: _ChatReplies, batch: List[tuple]):
+        lines = [line for _, _, line in batch]
+        now = time.monotonic()
+        can_edit = (
+            state.last_message is not None
+            and now - state.last_sent_at < self.edit_window
+            and len(state.last_lines) + len(lines) <= self.max_entries
+        )
+        if can_edit:
+            all_lines = state.last_lines + lines
+            await self._call(state, state.last_message.edit_text, self._summary(all_lines))
+            REPLIES.inc(kind='edit')
+            state.last_lines = all_lines
+            state.last_sent_at = now
+            return
+
+        first_message = batch[0][0]
+        for start in range(0, len(lines), self.max_entries):
+            chunk = lines[start:start + self.max_entries]
+            text = batch[0][1] if len(batch) == 1 else self._summary(chunk)
+            sent = await self._call(state, first_message.reply_text, text)
+            REPLIES.inc(kind='confirm')
+            state.last_message = sent
+            state.last_lines = chunk
+            state.last_sent_at = time.monotonic()
+
+    @staticmethod
+    def _summary(lines: List[str]) -> str:
+        return (
+            f"✅ Записано реклам: {len(lines)}\n\n"
+            + "\n".join(f"• {line}" for line in lines)
+            + "\n\n📊 Используйте /stats для просмотра статистики"
+        )
+
+    async def stop(self):
+        """Отправляет накопленные подтверждения без ожидания окна"""
+        for state in list(self._chats.values()):
+            if state.flush_task is not None and not state.flush_task.done():
+                state.flush_task.cancel()
+            await self._flush(state)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Ожидающие подтверждения и пауза после RetryAfter"""
+        return {
+            'pending_confirmations': sum(len(state.pending) for state in self._chats.values()),
+            'chats': len(self._chats),
+            'paused_seconds': round(max(0.0, self._paused_until - time.monotonic()), 1),
+        }
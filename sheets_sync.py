@@ -0,0 +1,478 @@
+import bisect
+import hashlib
+import logging
+import threading
+from array import array
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+from config import SYNC_BLOCK_SIZE, SYNC_WRITE_BATCH
+from ledger_changes import LedgerChanges
+from ledger_index import iter_csv_rows, normalize_buyer
+
+logger = logging.getLogger(__name__)
+
+# Хэш отсутствующего блока: дополняет листья более короткого дерева
+_EMPTY_BLOCK = b'\x00' * 20
+# Длина хэша строки (SHA-1)
+_HASH_SIZE = 20
+
+
+def normalize_row(row: List[str]) -> List[str]:
+    """Приводит строку к 4 колонкам без пробелов по краям (Sheets обрезает пустые хвосты)"""
+    cells = [str(cell).strip() for cell in row[:4]]
+    return cells + [''] * (4 - len(cells))
+
+
+def row_hash(row: List[str]) -> bytes:
+    """Хэш одной строки журнала"""
+    return hashlib.sha1('\x1f'.join(normalize_row(row)).encode('utf-8')).digest()
+
+
+# Хэш пустой строки: так в CSV выглядит отмененная запись, а в листе - стертая строка
+_BLANK_ROW_HASH = row_hash([])
+
+
+def block_hashes(rows: List[List[str]], block_size: int) -> List[bytes]:
+    """Хэши блоков фиксированного размера (последний блок может быть неполным)"""
+    hashes = []
+    for start in range(0, len(rows), block_size):
+        digest = hashlib.sha1()
+        for row in rows[start:start + block_size]:
+            digest.update(row_hash(row))
+        hashes.append(digest.digest())
+    return hashes
+
+
+class MerkleTree:
+    """Дерево хэшей над блоками строк: сравнение двух деревьев спускается только в различающиеся ветви"""
+
+    def __init__(self, leaves: List[bytes], width: int):
+        # Число листьев дополняем до степени двойки, чтобы деревья одинаковой
+        # ширины совпадали по форме и сравнивались узел в узел
+        size = 1
+        while size < max(width, 1):
+            size *= 2
+        level = list(leaves) + [_EMPTY_BLOCK] * (size - len(leaves))
+        self.levels = [level]
+        while len(level) > 1:
+            level = [
+                hashlib.sha1(level[i] + level[i + 1]).digest()
+                for i in range(0, len(level), 2)
+            ]
+            self.levels.append(level)
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[-1][0]
+
+    def diff(self, other: 'MerkleTree') -> List[int]:
+        """Номера различающихся блоков (деревья должны быть одной ширины)"""
+        differing = []
+        stack = [(len(self.levels) - 1, 0)]
+        while stack:
+            depth, index = stack.pop()
+            if self.levels[depth][index] == other.levels[depth][index]:
+                continue
+            if depth == 0:
+                differing.append(index)
+            else:
+                stack.append((depth - 1, index * 2 + 1))
+                stack.append((depth - 1, index * 2))
+        return sorted(differing)
+
+
+class _ShardHashes:
+    """Строки CSV одного листа: номера записей по возрастанию, хэши строк подряд и хэши блоков"""
+
+    def __init__(self):
+        self.row_ids = array('q')
+        self.hashes = bytearray()
+        # Хэши прежних версий исправленных и отмененных записей этого листа
+        self.replaced: Set[bytes] = set()
+        self.leaves: List[bytes] = []
+        self.block_size = 0
+
+    def _position(self, row_id: int) -> Optional[int]:
+        position = bisect.bisect_left(self.row_ids, row_id)
+        if position < len(self.row_ids) and self.row_ids[position] == row_id:
+            return position
+        return None
+
+    def _dirty(self, position: int):
+        """Хэши блоков начиная с блока строки position пересчитываются при следующей сверке"""
+        if self.block_size:
+            del self.leaves[position // self.block_size:]
+
+    def insert(self, row_id: int, digest: bytes):
+        position = bisect.bisect_left(self.row_ids, row_id)
+        self.row_ids.insert(position, row_id)
+        self.hashes[position * _HASH_SIZE:position * _HASH_SIZE] = digest
+        self._dirty(position)
+
+    def replace(self, row_id: int, digest: bytes) -> bool:
+        position = self._position(row_id)
+        if position is None:
+            return False
+        self.hashes[position * _HASH_SIZE:(position + 1) * _HASH_SIZE] = digest
+        self._dirty(position)
+        return True
+
+    def remove(self, row_id: int) -> bool:
+        position = self._position(row_id)
+        if position is None:
+            return False
+        del self.row_ids[position]
+        del self.hashes[position * _HASH_SIZE:(position + 1) * _HASH_SIZE]
+        self._dirty(position)
+        return True
+
+    def refresh(self, block_size: int) -> List[bytes]:
+        """Хэши блоков: считаются только блоки после последнего неизмененного"""
+        if block_size != self.block_size:
+            self.block_size, self.leaves = block_size, []
+        step = block_size * _HASH_SIZE
+        for start in range(len(self.leaves) * step, len(self.hashes), step):
+            # Хэш блока - SHA-1 подряд идущих хэшей строк, как в block_hashes
+            self.leaves.append(hashlib.sha1(self.hashes[start:start + step]).digest())
+        return self.leaves
+
+    def trimmed(self, block_size: int) -> Tuple[int, List[bytes]]:
+        """
+        Число строк без пустого хвоста и хэши блоков для них
+
+        Google Sheets не хранит пустые строки в конце листа, поэтому
+        отмененные записи в конце CSV при сверке не учитываются - так же,
+        как пустой хвост листа (см. GoogleSheetsManager.cached_data_leaves).
+        """
+        leaves = self.refresh(block_size)
+        end = len(self.row_ids)
+        while end and self.hashes[(end - 1) * _HASH_SIZE:end * _HASH_SIZE] == _BLANK_ROW_HASH:
+            end -= 1
+        if end == len(self.row_ids):
+            return end, list(leaves)
+        full_blocks = end // block_size
+        leaves = leaves[:full_blocks]
+        if end % block_size:
+            leaves.append(hashlib.sha1(self.hashes[full_blocks * block_size * _HASH_SIZE:end * _HASH_SIZE]).digest())
+        return end, leaves
+
+
+class LocalShard(NamedTuple):
+    """Снимок строк CSV одного листа для сверки"""
+    row_ids: array
+    hashes: bytes
+    leaves: List[bytes]
+    replaced: Set[bytes]
+
+    @property
+    def rows(self) -> int:
+        return len(self.row_ids)
+
+
+class LocalBlockHashes:
+    """
+    Хэши строк CSV журнала по листам Google Sheets для сверки.
+
+    Строки раскладываются по листам так же, как их пишет GoogleSheetsManager:
+    исправленная запись - на лист своего (нового) периода, отмененная - пустой
+    строкой на своем месте. Хэши строятся одним проходом по журналу при первой
+    сверке, дальше обновляются при дозаписи (on_append - слушатель CsvSink) и
+    правке (on_change), а хэши блоков пересчитываются только с первого
+    измененного блока листа - сверка не перечитывает журнал целиком.
+    """
+
+    def __init__(self, filename: str, changes: LedgerChanges, shard_title: Callable[[str], str]):
+        self.filename = filename
+        self.changes = changes
+        self.shard_title = shard_title
+        # Держится и на время первого прохода, и при правке вместе с записью в журнал правок
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.built = False
+        # Сколько байт журнала и сколько записей учтено
+        self.size = 0
+        self.rows = 0
+        self._shards: Dict[str, _ShardHashes] = {}
+
+    def _shard(self, row: List[str]) -> _ShardHashes:
+        title = self.shard_title(row[1] if len(row) > 1 else '')
+        shard = self._shards.get(title)
+        if shard is None:
+            shard = self._shards[title] = _ShardHashes()
+        return shard
+
+    def _add(self, row_id: int, row: List[str], overrides: Dict[int, Optional[List[str]]]):
+        # Пустые строки CSV не сверяются
+        if not any(row):
+            return
+        shard = self._shard(row)
+        if row_id in overrides:
+            shard.replaced.add(row_hash(row))
+            row = overrides[row_id] or [''] * 4
+            if any(row):
+                shard = self._shard(row)
+        shard.insert(row_id, row_hash(row))
+
+    def _build(self):
+        """Первый проход по журналу с учетом правок"""
+        self._reset()
+        overrides = self.changes.snapshot()
+        row_id = -1
+        for offset, end, row in iter_csv_rows(self.filename):
+            row_id += 1
+            self.size = end
+            if row_id > 0:
+                self._add(row_id, row, overrides)
+        self.rows = max(row_id, 0)
+        self.built = True
+        logger.info(f"Хэши журнала для сверки построены: {self.rows} записей, {len(self._shards)} листов")
+
+    def on_append(self, rows: List[List[str]], offsets: List[int], end: int):
+        """Строки дописаны в журнал (см. CsvSink.add_listener)"""
+        with self.lock:
+            if not self.built:
+                return
+            if offsets and offsets[0] > self.size:
+                # Файл дописывали в обход хранилища - хэши будут построены заново
+                self.built = False
+                return
+            for row, offset in zip(rows, offsets):
+                # Строки, которые первый проход уже успел прочитать, не учитываются второй раз
+                if offset >= self.size:
+                    self.rows += 1
+                    self._add(self.rows, row, {})
+            self.size = max(self.size, end)
+
+    def on_change(self, row_id: int, old: List[str], new: Optional[List[str]]):
+        """Запись исправлена (new) или отменена (new is None); вызывать под self.lock вместе с записью правки"""
+        with self.lock:
+            if not self.built:
+                return
+            source = self._shard(old)
+            source.replaced.add(row_hash(old))
+            row = new or [''] * 4
+            target = self._shard(row) if any(row) else source
+            if target is source:
+                moved = source.replace(row_id, row_hash(row))
+            else:
+                moved = source.remove(row_id)
+                if moved:
+                    target.insert(row_id, row_hash(row))
+            if not moved:
+                logger.warning(f"Запись #{row_id} не найдена в хэшах сверки - они будут построены заново")
+                self.built = False
+
+    def snapshot(self, block_size: int) -> Dict[str, LocalShard]:
+        """
+        Строки (без пустого хвоста) и хэши блоков каждого листа с данными;
+        при первом вызове журнал читается целиком
+        """
+        with self.lock:
+            if not self.built:
+                self._build()
+            shards = {}
+            for title, shard in self._shards.items():
+                if not shard.row_ids:
+                    continue
+                # Лист из одних отмененных записей тоже сверяется - на нем могли остаться их строки
+                rows, leaves = shard.trimmed(block_size)
+                shards[title] = LocalShard(array('q', shard.row_ids[:rows]), bytes(shard.hashes[:rows * _HASH_SIZE]),
+                                           leaves, set(shard.replaced))
+            return shards
+
+
+class SheetsReconciler:
+    """
+    Сверка локального CSV журнала с Google Sheets и дозапись расхождений.
+
+    CSV считается основным журналом: различающиеся блоки листа
+    перезаписываются строками из CSV, недостающие строки дописываются
+    в конец листа. Строки, которые есть только в листе, сначала
+    переносятся в CSV, чтобы перезапись их не потеряла.
+    """
+
+    def __init__(self, storage, block_size: int = SYNC_BLOCK_SIZE, write_batch: int = SYNC_WRITE_BATCH):
+        self.storage = storage
+        self.sheets = storage.google_sheets
+        self.block_size = block_size
+        self.write_batch = write_batch
+
+    def _read_local_rows(self, row_ids: List[int]) -> List[List[str]]:
+        """Строки CSV по номерам записей с учетом правок (отмененные - пустой строкой)"""
+        overrides = self.storage.changes.snapshot()
+        return [
+            overrides.get(row_id, row) or [''] * 4
+            for row_id, row in self.storage.index.read(row_ids)
+        ]
+
+    def _block_range(self, block: int, offset: int) -> Tuple[int, int]:
+        """Диапазон строк листа (1-based) для блока данных"""
+        first = offset + block * self.block_size + 1
+        return first, first + self.block_size - 1
+
+    def reconcile(self, dry_run: bool = False) -> Dict[str, int]:
+        """
+        Сверяет CSV и Google Sheets, при необходимости исправляет листы
+
+        При шардировании строки CSV раскладываются по листам периодов
+        и каждый лист сверяется отдельно. Хэши строк CSV берутся из
+        storage.sync_hashes (см. LocalBlockHashes), хэши строк листа -
+        из кэша GoogleSheetsManager; заново хэшируются только новые и
+        изменившиеся строки, журнал читается только для строк различающихся блоков.
+
+        Args:
+            dry_run: только посчитать расхождения, ничего не записывать
+
+        Returns:
+            Dict: отчет о сверке
+        """
+        report = {
+            'sheets': 0,
+            'local_rows': 0,
+            'sheet_rows': 0,
+            'blocks': 0,
+            'differing_blocks': 0,
+            'downloaded_rows': 0,
+            'rewritten_rows': 0,
+            'appended_rows': 0,
+            'backfilled_rows': 0,
+        }
+        if not self.sheets.is_connected():
+            raise RuntimeError("Google Sheets не подключен")
+
+        for title, local in self.storage.sync_hashes.snapshot(self.block_size).items():
+            self._reconcile_sheet(title, local, dry_run, report)
+            report['sheets'] += 1
+
+        if not dry_run:
+            self.sheets.flush_summary()
+        logger.info(
+            f"Сверка завершена: листов {report['sheets']}, блоков с расхождениями {report['differing_blocks']}, "
+            f"перезаписано {report['rewritten_rows']}, дописано {report['appended_rows']}, "
+            f"перенесено в CSV {report['backfilled_rows']}"
+        )
+        return report
+
+    def _reconcile_sheet(self, title: str, local: LocalShard, dry_run: bool, report: Dict[str, int]):
+        """
+        Сверка одного листа с его частью CSV; результаты добавляются в report.
+        Прежние версии исправленных и отмененных записей (local.replaced),
+        найденные на листе, не переносятся в CSV как недостающие.
+        """
+        report['local_rows'] += local.rows
+
+        remote_count, remote_leaves = 0, []
+        offset = 1
+        if self.sheets.has_sheet(title):
+            # Из листа дочитываются только новые строки, хэши остальных берутся из кэша
+            if self.sheets.fetch_new_rows(title) is None:
+                raise RuntimeError(f"Не удалось прочитать лист {title}")
+            offset = self.sheets.header_rows(title)
+            remote_count, remote_leaves = self.sheets.cached_data_leaves(self.block_size, row_hash, title)
+
+        width, differing = self._diff_blocks(local.leaves, remote_leaves)
+        report['blocks'] += width
+        if differing:
+            # Кэш мог устареть (лист правили руками) - перекачиваем только различающиеся блоки
+            remote_blocks = [b for b in differing if b * self.block_size < remote_count]
+            fresh = self.sheets.refresh_rows([self._block_range(b, offset) for b in remote_blocks], title)
+            report['downloaded_rows'] += sum(len(rows) for rows in fresh.values())
+            if fresh:
+                remote_count, remote_leaves = self.sheets.cached_data_leaves(self.block_size, row_hash, title)
+                width, differing = self._diff_blocks(local.leaves, remote_leaves)
+
+        report['sheet_rows'] += remote_count
+        report['differing_blocks'] += len(differing)
+        if not differing:
+            return
+
+        # Из листа и из CSV берутся только строки различающихся блоков и хвост, которого нет на листе
+        ranges = []
+        remote_rows: List[List[str]] = []
+        for block in differing:
+            start = block * self.block_size
+            if start < remote_count:
+                end = min(start + self.block_size, remote_count)
+                ranges.append((start, end))
+                remote_rows.extend(self.sheets.cached_data_rows(title, start, end))
+        wanted = [position for start, end in ranges for position in range(start, min(end, local.rows))]
+        wanted.extend(range(remote_count, local.rows))
+        local_rows = dict(zip(wanted, self._read_local_rows([local.row_ids[i] for i in wanted])))
+
+        # Строки, которых нет в CSV, переносим в CSV до перезаписи листа
+        orphans = self._find_orphans(remote_rows, local.replaced)
+
+        updates: Dict[int, List[List[str]]] = {}
+        for start, end in ranges:
+            rows = [normalize_row(local_rows[i]) if i < local.rows else [''] * 4 for i in range(start, end)]
+            updates[offset + start + 1] = rows
+        tail = [normalize_row(local_rows[i]) for i in range(remote_count, local.rows)] + orphans
+
+        report['backfilled_rows'] += len(orphans)
+        report['rewritten_rows'] += sum(len(rows) for rows in updates.values())
+        report['appended_rows'] += len(tail)
+        if dry_run:
+            return
+
+        if orphans:
+            self.storage.append_local_records(orphans)
+        self.sheets.update_rows(updates, title)
+        # Лист после перезаписи заканчивается на remote_count строке данных,
+        # поэтому хвост CSV (вместе с перенесенными строками) просто дописываем
+        self.sheets.append_records(tail, batch_size=self.write_batch, title=title)
+
+    def _find_orphans(self, remote_rows: List[List[str]], replaced: Set[bytes]) -> List[List[str]]:
+        """
+        Непустые строки листа, которых нет в журнале, без повторов
+
+        Строка сравнивается не со всем журналом, а с актуальными записями
+        того же покупателя (по индексу журнала, с учетом правок). Прежние
+        версии исправленных и отмененных записей (replaced) недостающими не считаются.
+        """
+        candidates = [row for row in remote_rows if any(row) and row_hash(row) not in replaced]
+        if not candidates:
+            return []
+        overrides = self.storage.changes.snapshot()
+        row_ids: Set[int] = set()
+        for buyer in {normalize_buyer(row[0]) for row in candidates}:
+            row_ids.update(self.storage.index.search([buyer], [], overrides))
+        local_hashes = {
+            row_hash(overrides.get(row_id, row)) for row_id, row in self.storage.index.read(sorted(row_ids))
+        }
+        orphans = []
+        for row in candidates:
+            digest = row_hash(row)
+            if digest not in local_hashes:
+                orphans.append(normalize_row(row))
+                local_hashes.add(digest)
+        return orphans
+
+    def _diff_blocks(self, local_leaves: List[bytes], remote_leaves: List[bytes]) -> Tuple[int, List[int]]:
+        """Число блоков и номера различающихся блоков по двум деревьям хэшей"""
+        width = max(len(local_leaves), len(remote_leaves))
+        local_tree = MerkleTree(local_leaves, width)
+        remote_tree = MerkleTree(remote_leaves, width)
+
+        if local_tree.root == remote_tree.root:
+            return width, []
+        return width, local_tree.diff(remote_tree)
+
+
+def format_report(report: Dict[str, int]) -> str:
+    """Текст отчета о сверке для чата и консоли"""
+    if not report['differing_blocks']:
+        status = "✅ CSV и Google Sheets совпадают"
+    else:
+        status = "🔄 Найдены расхождения"
+    return (
+        f"{status}\n\n"
+        f"🗂 Листов: {report['sheets']}\n"
+        f"📄 Строк в CSV: {report['local_rows']}\n"
+        f"📊 Строк в Google Sheets: {report['sheet_rows']}\n"
+        f"🧱 Блоков: {report['blocks']}, с расхождениями: {report['differing_blocks']}\n"
+        f"⬇️ Перечитано строк из Sheets: {report['downloaded_rows']}\n"
+        f"✏️ Перезаписано строк в Sheets: {report['rewritten_rows']}\n"
+        f"➕ Дописано строк в Sheets: {report['appended_rows']}\n"
+        f"↩️ Перенесено строк в CSV: {report['backfilled_rows']}"
+    )
@@ -2,33 +2,94 @@ import csv
 import os
 import logging
 from typing import List, Optional
-from datetime import datetime
+from datetime import date
 from google_sheets import GoogleSheetsManager
+from ledger_changes import LedgerChanges
+from ledger_index import LedgerIndex
+from ledger_stats import LedgerStats
+from sheets_sync import LocalBlockHashes
+from sinks import CsvSink, RecordChange, SaleSink, SinkFanout, build_secondary_sinks
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class SimpleStorageManager:
     """Простой класс для хранения данных в CSV файле"""
     
-    def __init__(self, filename: str = "sales_data.csv"):
+    def __init__(self, filename: str = "sales_data.csv", google_sheets: Optional[GoogleSheetsManager] = None,
+                 secondary_sinks: Optional[List[SaleSink]] = None):
+        """
+        Args:
+            filename: CSV журнал
+            google_sheets: Подключение к Google Sheets (по умолчанию - из настроек)
+            secondary_sinks: Дополнительные приемники (по умолчанию - из SALE_SINKS)
+        """
         self.filename = filename
         self.headers = ['Ник покупателя', 'Дата и время публикации', 'Сумма', 'Источник размещения']
-        self.google_sheets = GoogleSheetsManager()
+        self.google_sheets = google_sheets or GoogleSheetsManager()
+        if self.google_sheets.is_connected():
+            self.google_sheets.setup_headers()
         self._ensure_file_exists()
+        # Индекс записей: поиск по покупателю и источнику, чтение записи по номеру
+        self.index = LedgerIndex(self.filename)
+        self.index.load()
+        # Исправления и отмены записей: CSV только дописывается, правки хранятся отдельно
+        self.changes = LedgerChanges(self.filename)
+        self.changes.load()
+        # Суммы по дням для /stats: строятся при первом запросе, дальше обновляются при записи и правке
+        self.stats = LedgerStats(self.filename, self.changes)
+        # Хэши строк по листам для сверки с Google Sheets: строятся при первой сверке
+        self.sync_hashes = LocalBlockHashes(self.filename, self.changes, self.google_sheets.shard_title)
+        # CSV - основной приемник, остальные (Google Sheets, SQLite, ...) - из SALE_SINKS
+        primary = CsvSink(self.filename)
+        primary.add_listener(self.index.on_append)
+        primary.add_listener(self.stats.on_append)
+        primary.add_listener(self.sync_hashes.on_append)
+        if secondary_sinks is None:
+            secondary_sinks = build_secondary_sinks(self.google_sheets)
+        self.fanout = SinkFanout(primary, secondary_sinks)
     
     def _ensure_file_exists(self):
         """Создает файл с заголовками, если он не существует"""
         if not os.path.exists(self.filename):
+            if self.google_sheets.is_connected() and self.bootstrap_from_sheets():
+                return
             with open(self.filename, 'w', newline='', encoding='utf-8') as file:
                 writer = csv.writer(file)
                 writer.writerow(self.headers)
             logger.info(f"Создан новый файл: {self.filename}")
     
+    def bootstrap_from_sheets(self) -> bool:
+        """
+        Восстанавливает локальный CSV из Google Sheets постранично
+        
+        Файл собирается во временном файле и подменяется целиком,
+        чтобы оборванная загрузка не оставила неполный журнал.
+        
+        Returns:
+            bool: True если CSV восстановлен
+        """
+        tmp_filename = f"{self.filename}.tmp"
+        total = 0
+        try:
+            with open(tmp_filename, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(self.headers)
+                for page in self.google_sheets.iter_record_pages():
+                    writer.writerows(page)
+                    total += len(page)
+            os.replace(tmp_filename, self.filename)
+            logger.info(f"CSV восстановлен из Google Sheets: {total} записей")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Ошибка при восстановлении CSV из Google Sheets: {e}")
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            return False
+    
     def add_sale_record(self, buyer: str, datetime: str, amount: str, source: str) -> bool:
         """
-        Добавляет запись о продаже в CSV файл и Google Sheets
+        Добавляет запись о продаже в CSV файл и остальные приемники
         
         Args:
             buyer: Ник покупателя
@@ -37,103 +98,96 @@ class SimpleStorageManager:
             source: Источник размещения
             
         Returns:
-            bool: True если запись успешно добавлена
+            bool: True если запись сохранена в CSV
         """
-        success = True
+        success = self.fanout.write([buyer, datetime, amount, source])
+        if success:
+            logger.info("Добавлена запись: %s, %s, %s, %s", buyer, datetime, amount, source)
+        return success
+    
+    def append_local_records(self, rows: List[List[str]]) -> int:
+        """
+        Дописывает строки только в CSV (без Google Sheets), например при сверке
         
-        # Сохраняем в CSV файл
-        try:
-            with open(self.filename, 'a', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow([buyer, datetime, amount, source])
-            
-            logger.info(f"Добавлена запись в CSV: {buyer}, {datetime}, {amount}, {source}")
-            
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении записи в CSV: {e}")
-            success = False
+        Returns:
+            int: Количество записанных строк
+        """
+        self.fanout.primary.write_batch(rows)
+        logger.info(f"В CSV дописано {len(rows)} строк")
+        return len(rows)
+    
+    def read_record(self, row_id: int) -> Optional[List[str]]:
+        """Актуальная строка записи по номеру (с учетом правок); None - нет такой записи или она отменена"""
+        records = self.index.read([row_id])
+        if not records:
+            return None
+        return self.changes.resolve(row_id, records[0][1])
+    
+    def change_record(self, row_id: int, record: Optional[List[str]], **meta) -> Optional[RecordChange]:
+        """
+        Исправляет (record - новая строка) или отменяет (record=None) запись,
+        дописывая правку в журнал правок
         
-        # Сохраняем в Google Sheets (если подключен)
-        if self.google_sheets.is_connected():
-            try:
-                google_success = self.google_sheets.add_record(buyer, datetime, amount, source)
-                if google_success:
-                    logger.info(f"Добавлена запись в Google Sheets: {buyer}, {datetime}, {amount}, {source}")
-                else:
-                    logger.warning("Не удалось добавить запись в Google Sheets")
-            except Exception as e:
-                logger.error(f"Ошибка при добавлении записи в Google Sheets: {e}")
+        Args:
+            row_id: Номер записи
+            record: [buyer, datetime, amount, source] или None
+            meta: Кто и откуда изменил (сохраняется в журнале правок)
+            
+        Returns:
+            RecordChange: правка для остальных приемников или None, если записи нет или она уже отменена
+        """
+        old = self.read_record(row_id)
+        if old is None:
+            return None
+        if record is not None:
+            record = list(record)
+            if record == old:
+                return None
+        # Правка, статистика и хэши сверки меняются вместе, чтобы первый проход не учел правку дважды
+        with self.stats.lock, self.sync_hashes.lock:
+            if record is None:
+                self.changes.append('retract', row_id, **meta)
+            else:
+                self.changes.append('amend', row_id, record, **meta)
+            self.stats.on_change(old, record)
+            self.sync_hashes.on_change(row_id, old, record)
+        if record is None:
+            logger.info("Отменена запись #%d: %s", row_id, old)
         else:
-            logger.info("Google Sheets не подключен, данные сохранены только в CSV")
-        
-        return success
+            logger.info("Исправлена запись #%d: %s -> %s", row_id, old, record)
+        return RecordChange(row_id, old, record)
     
     def get_all_records(self) -> Optional[List[List]]:
         """
-        Получает все записи из CSV файла
+        Получает все записи из CSV файла с учетом исправлений, без отмененных
         
         Returns:
-            List[List]: Список всех записей или None при ошибке
+            List[List]: Список всех записей (первая строка - заголовок) или None при ошибке
         """
         try:
-            records = []
             with open(self.filename, 'r', encoding='utf-8') as file:
                 reader = csv.reader(file)
-                for row in reader:
-                    records.append(row)
+                records = [next(reader, self.headers)]
+                records.extend(row for _, row in self.changes.resolve_all(reader))
             return records
             
         except Exception as e:
             logger.error(f"Ошибка при чтении файла: {e}")
             return None
     
-    def get_stats(self) -> dict:
-        """Получает статистику продаж"""
-        records = self.get_all_records()
-        
-        if not records or len(records) <= 1:
-            return {
-                'total': 0,
-                'usdt_count': 0,
-                'usdt_total': 0,
-                'rub_count': 0,
-                'rub_total': 0
-            }
-        
-        # Исключаем заголовок
-        data_records = records[1:]
-        total = len(data_records)
-        
-        # Подсчитываем по валютам и суммам
-        usdt_count = 0
-        usdt_total = 0
-        rub_count = 0
-        rub_total = 0
-        
-        for record in data_records:
-            if len(record) > 2:
-                amount_str = record[2].lower()
-                if 'usdt' in amount_str:
-                    usdt_count += 1
-                    # Извлекаем число из строки
-                    import re
-                    number_match = re.search(r'(\d+(?:[.,]\d+)?)', record[2])
-                    if number_match:
-                        usdt_total += float(number_match.group(1).replace(',', '.'))
-                elif '₽' in record[2]:
-                    rub_count += 1
-                    # Извлекаем число из строки
-                    import re
-                    number_match = re.search(r'(\d+(?:[.,]\d+)?)', record[2])
-                    if number_match:
-                        rub_total += float(number_match.group(1).replace(',', '.'))
-        
+    def get_stats(self, date_from: Optional[date] = None, date_to: Optional[date] = None,
+                  buyer: Optional[str] = None, source: Optional[str] = None) -> dict:
+        """
+        Статистика продаж за диапазон дат публикации, по всему журналу или
+        по покупателю либо источнику - из сумм по дням (см. LedgerStats), без чтения журнала
+        """
+        stats = self.stats.query(date_from, date_to, buyer, source)
         return {
-            'total': total,
-            'usdt_count': usdt_count,
-            'usdt_total': usdt_total,
-            'rub_count': rub_count,
-            'rub_total': rub_total
+            'total': int(stats['total']),
+            'usdt_count': int(stats['usdt_count']),
+            'usdt_total': stats['usdt_total'],
+            'rub_count': int(stats['rub_count']),
+            'rub_total': stats['rub_total'],
         }
     
     def setup_headers(self) -> bool:
@@ -0,0 +1,497 @@
+import asyncio
+import csv
+import importlib
+import io
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional
+from config import SALE_SINKS, SINK_MAX_RETRIES, sink_setting
+from metrics import CSV_APPEND_SECONDS
+from tracing import bind_context, span
+
+logger = logging.getLogger(__name__)
+
+# Поля записи о продаже в порядке колонок журнала
+RECORD_FIELDS = ['buyer', 'datetime', 'amount', 'source']
+
+
+class SaleRow(list):
+    """
+    Строка записи [buyer, datetime, amount, source] с данными, которые не пишутся
+    в журнал: message_key - чат и сообщение Telegram, из которого запись создана,
+    author - id пользователя Telegram, отправившего сообщение
+    """
+
+    def __init__(self, values, message_key: Optional[str] = None, author: Optional[int] = None):
+        super().__init__(values)
+        self.message_key = message_key
+        self.author = author
+
+
+class RecordChange:
+    """Исправление (new - новая строка) или отмена (new is None) записи row_id"""
+
+    def __init__(self, row_id: int, old: List[str], new: Optional[List[str]]):
+        self.row_id = row_id
+        self.old = old
+        self.new = new
+
+
+class SinkHealth:
+    """Состояние приемника: счетчики и последняя ошибка"""
+
+    def __init__(self):
+        self.healthy = True
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.last_success_at: Optional[float] = None
+
+    def mark_success(self, count: int):
+        self.healthy = True
+        self.written += count
+        self.consecutive_failures = 0
+        self.last_success_at = time.time()
+
+    def mark_failure(self, error: Exception):
+        self.healthy = False
+        self.failed += 1
+        self.consecutive_failures += 1
+        self.last_error = str(error)
+
+    def to_dict(self) -> Dict:
+        return {
+            'healthy': self.healthy,
+            'written': self.written,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+            'last_success_at': self.last_success_at,
+        }
+
+
+class SaleSink:
+    """
+    Базовый приемник записей о продажах.
+
+    Наследник реализует write_batch; ошибку записи сообщает исключением.
+    Размер пачки, интервал сбора пачки и длина очереди настраиваются
+    переменными SINK_<ИМЯ>_BATCH_SIZE, SINK_<ИМЯ>_FLUSH_SECONDS и
+    SINK_<ИМЯ>_QUEUE_SIZE.
+    """
+
+    name = 'sink'
+
+    def __init__(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None,
+                 queue_size: Optional[int] = None):
+        self.batch_size = batch_size or int(sink_setting(self.name, 'BATCH_SIZE', 50))
+        self.flush_interval = flush_interval if flush_interval is not None else float(
+            sink_setting(self.name, 'FLUSH_SECONDS', 1.0)
+        )
+        self.queue_size = queue_size or int(sink_setting(self.name, 'QUEUE_SIZE', 1000))
+        self.health = SinkHealth()
+
+    def is_available(self) -> bool:
+        """Готов ли приемник принимать записи (например, есть подключение)"""
+        return True
+
+    def write_batch(self, rows: List[List[str]]):
+        """Записывает пачку строк [buyer, datetime, amount, source]"""
+        raise NotImplementedError
+
+    def apply_change(self, change: RecordChange):
+        """Применяет исправление или отмену записи; по умолчанию приемник правки не отражает"""
+
+    def close(self):
+        """Освобождает ресурсы и дописывает отложенное"""
+
+
+class CsvSink(SaleSink):
+    """
+    Локальный CSV журнал - основной приемник.
+
+    После каждой дозаписи слушатели (например, LedgerIndex) получают
+    строки, смещения, с которых они записаны, и новый размер файла.
+    """
+
+    name = 'csv'
+
+    def __init__(self, filename: str, **kwargs):
+        super().__init__(**kwargs)
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[List[List[str]], List[int], int], None]] = []
+
+    def add_listener(self, listener: Callable[[List[List[str]], List[int], int], None]):
+        self._listeners.append(listener)
+
+    def write_batch(self, rows: List[List[str]]):
+        with span('csv.append'), self._lock, CSV_APPEND_SECONDS.time():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            encoded = []
+            for row in rows:
+                writer.writerow(row)
+                encoded.append(buffer.getvalue().encode('utf-8'))
+                buffer.seek(0)
+                buffer.truncate()
+            with open(self.filename, 'ab') as file:
+                offset = file.seek(0, io.SEEK_END)
+                file.write(b''.join(encoded))
+            offsets = []
+            for line in encoded:
+                offsets.append(offset)
+                offset += len(line)
+            for listener in self._listeners:
+                try:
+                    listener(rows, offsets, offset)
+                except Exception as e:
+                    logger.error(f"Ошибка слушателя журнала: {e}")
+
+
+class GoogleSheetsSink(SaleSink):
+    """Google Sheets: пачка пишется одним append_rows на каждый лист"""
+
+    name = 'sheets'
+
+    def __init__(self, manager, **kwargs):
+        super().__init__(**kwargs)
+        self.manager = manager
+
+    def is_available(self) -> bool:
+        return self.manager.is_connected()
+
+    def write_batch(self, rows: List[List[str]]):
+        by_sheet: Dict[str, List[List[str]]] = {}
+        for row in rows:
+            by_sheet.setdefault(self.manager.shard_title(row[1]), []).append(row)
+        for title, sheet_rows in by_sheet.items():
+            # Пачку уже ограничил обработчик очереди; пачки импорта пишутся запросами до 500 строк
+            self.manager.append_records(sheet_rows, title=title)
+
+    def apply_change(self, change: RecordChange):
+        # Одна правка диапазона строки; отмененная запись становится пустой строкой
+        if not self.manager.replace_record(change.old, change.new or [''] * len(RECORD_FIELDS), change.row_id):
+            # Повтор не поможет: строку исправит /sync
+            logger.warning(f"Запись #{change.row_id} не найдена в листе, правка пропущена")
+
+    def close(self):
+        self.manager.flush_summary()
+
+
+class SqliteSink(SaleSink):
+    """SQLite база для отчетов и выборок"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or sink_setting(self.name, 'PATH', 'sales_data.sqlite3')
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sales ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, buyer TEXT, datetime TEXT, "
+            "amount TEXT, source TEXT, created_at REAL)"
+        )
+        self._connection.commit()
+
+    def write_batch(self, rows: List[List[str]]):
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO sales (buyer, datetime, amount, source, created_at) VALUES (?, ?, ?, ?, ?)",
+                [list(row[:4]) + [now] for row in rows]
+            )
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class JsonlSink(SaleSink):
+    """Файл JSON Lines - по объекту на запись"""
+
+    name = 'jsonl'
+
+    def __init__(self, path: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or sink_setting(self.name, 'PATH', 'sales_data.jsonl')
+        self._lock = threading.Lock()
+
+    def write_batch(self, rows: List[List[str]]):
+        lines = [
+            json.dumps(dict(zip(RECORD_FIELDS, row)), ensure_ascii=False) + '\n'
+            for row in rows
+        ]
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.writelines(lines)
+
+
+class _RowBatch(list):
+    """Пачка строк в очереди приемника (см. SinkFanout.publish_batch)"""
+
+
+class SinkFanout:
+    """
+    Раздача записей по приемникам.
+
+    Запись считается сохраненной, когда ее подтвердил основной приемник
+    (CSV). Остальные приемники получают записи через собственные
+    ограниченные очереди: у каждого свой фоновый обработчик, размер
+    пачки и состояние, так что медленный приемник не задерживает ответ
+    в чате.
+    """
+
+    def __init__(self, primary: SaleSink, secondaries: List[SaleSink]):
+        self.primary = primary
+        self.secondaries = secondaries
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def write(self, row: List[str]) -> bool:
+        """Синхронная запись во все приемники по очереди (для консоли и тестов)"""
+        if not self._write_primary([row]):
+            return False
+        for sink in self.secondaries:
+            if sink.is_available():
+                self._write_sink(sink, [row])
+        return True
+
+    def _write_primary(self, rows: List[List[str]]) -> bool:
+        try:
+            self.primary.write_batch(rows)
+            self.primary.health.mark_success(len(rows))
+            return True
+        except Exception as e:
+            self.primary.health.mark_failure(e)
+            logger.error(f"Ошибка записи в основной приемник {self.primary.name}: {e}")
+            return False
+
+    @staticmethod
+    def _write_sink(sink: SaleSink, rows: List[List[str]]) -> bool:
+        try:
+            sink.write_batch(rows)
+            sink.health.mark_success(len(rows))
+            return True
+        except Exception as e:
+            sink.health.mark_failure(e)
+            logger.error(f"Ошибка записи в приемник {sink.name}: {e}")
+            return False
+
+    async def start(self):
+        """Запускает по обработчику на каждый дополнительный приемник"""
+        if self._workers:
+            return
+        for sink in self.secondaries:
+            queue = asyncio.Queue(maxsize=sink.queue_size)
+            self._queues[sink.name] = queue
+            self._workers.append(asyncio.create_task(self._worker(sink, queue), name=f"sink-{sink.name}"))
+        logger.info(f"Запущены приемники: {', '.join(s.name for s in self.secondaries) or 'нет'}")
+
+    async def publish(self, row: List[str], executor: Optional[Executor] = None) -> bool:
+        """
+        Записывает строку в основной приемник и ставит в очереди остальных
+
+        Args:
+            row: Строка [buyer, datetime, amount, source]
+            executor: Пул потоков для записи в основной приемник (None - писать в цикле событий)
+
+        Returns:
+            bool: True если основной приемник подтвердил запись
+        """
+        loop = asyncio.get_running_loop()
+        if not self.running:
+            if executor is None:
+                return self.write(row)
+            return await loop.run_in_executor(executor, bind_context(self.write), row)
+
+        if executor is None:
+            written = self._write_primary([row])
+        else:
+            written = await loop.run_in_executor(executor, bind_context(self._write_primary), [row])
+        if not written:
+            return False
+
+        for sink in self.secondaries:
+            try:
+                self._queues[sink.name].put_nowait(row)
+            except asyncio.QueueFull:
+                sink.health.dropped += 1
+                logger.warning(f"Очередь приемника {sink.name} переполнена, запись пропущена")
+        return True
+
+    async def publish_batch(self, rows: List[List[str]], executor: Optional[Executor] = None) -> bool:
+        """
+        Записывает пачку строк в основной приемник одной операцией и ставит ее
+        в очереди остальных; при заполненной очереди ждет место, а не пропускает пачку
+
+        Returns:
+            bool: True если основной приемник подтвердил запись
+        """
+        if not rows:
+            return True
+        loop = asyncio.get_running_loop()
+        if executor is None:
+            written = self._write_primary(rows)
+        else:
+            written = await loop.run_in_executor(executor, bind_context(self._write_primary), rows)
+        if not written:
+            return False
+
+        for sink in self.secondaries:
+            if not self.running:
+                if sink.is_available():
+                    await loop.run_in_executor(executor, self._write_sink, sink, rows)
+                continue
+            # Пачка занимает одно место в очереди и уходит в приемник целиком
+            await self._queues[sink.name].put(_RowBatch(rows))
+        return True
+
+    async def publish_change(self, change: RecordChange, executor: Optional[Executor] = None):
+        """Ставит исправление или отмену записи в очереди приемников - после строк, поставленных раньше"""
+        loop = asyncio.get_running_loop()
+        for sink in self.secondaries:
+            if not self.running:
+                if sink.is_available():
+                    await loop.run_in_executor(executor, self._apply_change, sink, change)
+                continue
+            await self._queues[sink.name].put(change)
+
+    @staticmethod
+    def _apply_change(sink: SaleSink, change: RecordChange) -> bool:
+        try:
+            sink.apply_change(change)
+            return True
+        except Exception as e:
+            sink.health.mark_failure(e)
+            logger.error(f"Ошибка правки записи в приемнике {sink.name}: {e}")
+            return False
+
+    async def _worker(self, sink: SaleSink, queue: asyncio.Queue):
+        """
+        Собирает пачку (batch_size строк или flush_interval секунд) и пишет ее в приемник.
+        Правка записи закрывает пачку: сначала пишутся строки до нее, затем правка.
+        """
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            if item is None:
+                break
+            batch: List[List[str]] = []
+            change = item if isinstance(item, RecordChange) else None
+            if change is None:
+                batch = list(item) if isinstance(item, _RowBatch) else [item]
+            deadline = loop.time() + sink.flush_interval
+            while change is None and len(batch) < sink.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, RecordChange):
+                    change = item
+                elif isinstance(item, _RowBatch):
+                    batch.extend(item)
+                else:
+                    batch.append(item)
+
+            if not sink.is_available():
+                sink.health.dropped += len(batch) + (change is not None)
+                continue
+            if batch:
+                await self._retry(sink, self._write_sink, batch, len(batch))
+            if change is not None:
+                await self._retry(sink, self._apply_change, change, 1)
+
+    async def _retry(self, sink: SaleSink, method, argument, count: int):
+        """Запись в приемник с повторами; после SINK_MAX_RETRIES неудач count записей считаются потерянными"""
+        loop = asyncio.get_running_loop()
+        for attempt in range(SINK_MAX_RETRIES + 1):
+            if await loop.run_in_executor(None, method, sink, argument):
+                return
+            if attempt < SINK_MAX_RETRIES:
+                await asyncio.sleep(min(2 ** attempt, 30))
+        sink.health.dropped += count
+
+    async def stop(self, timeout: float = 30.0):
+        """Дописывает очереди и останавливает обработчики"""
+        for sink in self.secondaries:
+            queue = self._queues.get(sink.name)
+            if queue is not None:
+                await queue.put(None)
+        if self._workers:
+            done, pending = await asyncio.wait(self._workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        self._workers = []
+        self._queues = {}
+        for sink in [self.primary] + self.secondaries:
+            try:
+                sink.close()
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии приемника {sink.name}: {e}")
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Состояние приемников и глубина их очередей"""
+        result = {}
+        for sink in [self.primary] + self.secondaries:
+            state = sink.health.to_dict()
+            queue = self._queues.get(sink.name)
+            state['queue_depth'] = queue.qsize() if queue is not None else 0
+            state['primary'] = sink is self.primary
+            result[sink.name] = state
+        return result
+
+
+def _load_custom_sink(spec: str) -> SaleSink:
+    """Приемник пользователя из строки вида 'package.module:ClassName'"""
+    module_name, _, class_name = spec.partition(':')
+    sink_class = getattr(importlib.import_module(module_name), class_name)
+    return sink_class()
+
+
+def build_secondary_sinks(google_sheets, names: str = SALE_SINKS,
+                          base_path: Optional[str] = None) -> List[SaleSink]:
+    """
+    Дополнительные приемники по списку из SALE_SINKS
+
+    Args:
+        base_path: Путь без расширения для файлов sqlite и jsonl (например, журнала чата);
+            None - пути из SINK_<ИМЯ>_PATH
+    """
+    sinks = []
+    for name in [n.strip() for n in names.split(',') if n.strip()]:
+        try:
+            if name == 'sheets':
+                sinks.append(GoogleSheetsSink(google_sheets))
+            elif name == 'sqlite':
+                sinks.append(SqliteSink(f"{base_path}.sqlite3" if base_path else None))
+            elif name == 'jsonl':
+                sinks.append(JsonlSink(f"{base_path}.jsonl" if base_path else None))
+            elif ':' in name:
+                sinks.append(_load_custom_sink(name))
+            else:
+                logger.warning(f"Неизвестный приемник {name}, пропускаю")
+        except Exception as e:
+            logger.error(f"Не удалось создать приемник {name}: {e}")
+    return sinks
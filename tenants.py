@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from config import TENANT_MODE, TENANT_DIR, TENANT_CACHE_SIZE, TENANT_SHEET_TEMPLATE, TENANT_SHEETS
+from async_storage import AsyncStorage
+from bulk_import import BulkImporter
+from export_cache import ExportCache
+from message_parser import SaleMessageParser
+from simple_storage import SimpleStorageManager
+from sinks import build_secondary_sinks
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_sheet_names(value: str) -> Dict[str, str]:
+    """'-100123=Команда А,-100456=Команда Б' -> {'-100123': 'Команда А', ...}"""
+    result = {}
+    for item in value.split(','):
+        key, _, title = item.partition('=')
+        if key.strip() and title.strip():
+            result[key.strip()] = title.strip()
+    return result
+
+
+class Tenant:
+    """Журнал одного чата: хранилище со своим CSV, индексом и листом, кэш /export и импорт"""
+
+    def __init__(self, key: str, storage: AsyncStorage, parser: SaleMessageParser):
+        self.key = key
+        self.storage = storage
+        self.export_cache = ExportCache(storage)
+        self.importer = BulkImporter(parser, storage)
+        # Сколько обработчиков сейчас работают с журналом - такой журнал не выгружается
+        self.leases = 0
+
+    async def close(self):
+        await self.export_cache.stop()
+        await self.storage.fanout.stop()
+        # Остановка пулов и сохранение индекса блокируют - не в цикле событий, где работают остальные чаты
+        await asyncio.get_running_loop().run_in_executor(None, self.storage.close)
+
+
+class TenantRegistry:
+    """
+    Журналы по чатам.
+
+    При TENANT_MODE=single все чаты пишут в общий журнал (default). При
+    TENANT_MODE=chat у каждого чата свой CSV в TENANT_DIR и свой лист в
+    Google Sheets (TENANT_SHEETS или TENANT_SHEET_TEMPLATE). Журналы
+    открываются при первом обращении в пуле потоков и держатся в LRU
+    на TENANT_CACHE_SIZE чатов; давно не использованные закрываются
+    (очереди приемников дописываются, индекс сохраняется).
+    """
+
+    def __init__(self, default: Tenant, parser: SaleMessageParser, mode: str = TENANT_MODE,
+                 capacity: int = TENANT_CACHE_SIZE, directory: str = TENANT_DIR):
+        self.default = default
+        self.parser = parser
+        self.per_chat = mode == 'chat'
+        self.capacity = max(capacity, 1)
+        self.directory = directory
+        self.sheet_names = _parse_sheet_names(TENANT_SHEETS)
+        self._tenants: 'OrderedDict[str, Tenant]' = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Журналы, которые сейчас закрываются (дописывают очереди приемников)
+        self._closing: Dict[str, asyncio.Task] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def key_for(self, chat_id: int) -> Optional[str]:
+        """Ключ журнала чата; None - общий журнал"""
+        return str(chat_id) if self.per_chat else None
+
+    @asynccontextmanager
+    async def use(self, chat_id: int) -> AsyncIterator[Tenant]:
+        """Журнал чата на время обработки обновления"""
+        key = self.key_for(chat_id)
+        tenant = self.default if key is None else await self._get(key)
+        tenant.leases += 1
+        try:
+            yield tenant
+        finally:
+            tenant.leases -= 1
+
+    async def _get(self, key: str) -> Tenant:
+        tenant = self._tenants.get(key)
+        if tenant is not None:
+            self._tenants.move_to_end(key)
+            return tenant
+
+        # Один чат открывается один раз, даже если обновления пришли одновременно
+        future = self._loading.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._loading[key] = asyncio.get_running_loop().create_future()
+        try:
+            closing = self._closing.get(key)
+            if closing is not None:
+                await closing
+            tenant = await asyncio.get_running_loop().run_in_executor(None, self._open, key)
+            await tenant.storage.fanout.start()
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; без них future не должен ругаться в лог
+            future.exception()
+            raise
+        finally:
+            self._loading.pop(key, None)
+        self._tenants[key] = tenant
+        self.loads += 1
+        future.set_result(tenant)
+        self._evict(keep=key)
+        return tenant
+
+    def _open(self, key: str) -> Tenant:
+        """Открывает журнал чата: CSV, индекс и лист Google Sheets (блокирующие операции)"""
+        os.makedirs(self.directory, exist_ok=True)
+        base_path = os.path.join(self.directory, key)
+        sheet_name = self.sheet_names.get(key) or TENANT_SHEET_TEMPLATE.format(chat_id=key)
+        google_sheets = self.default.storage.google_sheets.for_sheet(sheet_name)
+        manager = SimpleStorageManager(
+            f"{base_path}.csv",
+            google_sheets=google_sheets,
+            secondary_sinks=build_secondary_sinks(google_sheets, base_path=base_path),
+        )
+        logger.info(f"Открыт журнал чата {key} ({manager.index.rows} записей)")
+        return Tenant(key, AsyncStorage(manager), self.parser)
+
+    def _evict(self, keep: str):
+        """Закрывает в фоне давно не использованные журналы сверх capacity (кроме занятых и keep)"""
+        for key in list(self._tenants):
+            if len(self._tenants) <= self.capacity:
+                break
+            tenant = self._tenants[key]
+            if tenant.leases or key == keep:
+                continue
+            del self._tenants[key]
+            self.evictions += 1
+            logger.info(f"Журнал чата {key} выгружается из памяти")
+            self._closing[key] = asyncio.create_task(self._close(tenant))
+
+    async def _close(self, tenant: Tenant):
+        try:
+            await tenant.close()
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии журнала чата {tenant.key}: {e}")
+        finally:
+            self._closing.pop(tenant.key, None)
+
+    async def close(self):
+        """Закрывает все открытые журналы чатов (общий журнал закрывает SalesBot)"""
+        tenants, self._tenants = list(self._tenants.values()), OrderedDict()
+        for tenant in tenants:
+            await self._close(tenant)
+        if self._closing:
+            await asyncio.gather(*self._closing.values())
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            'mode': 'chat' if self.per_chat else 'single',
+            'loaded': len(self._tenants),
+            'capacity': self.capacity,
+            'loads': self.loads,
+            'evictions': self.evictions,
+        }
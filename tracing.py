@@ -0,0 +1,135 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from config import SLOW_TRACE_MS, SLOW_LOG_FILE, SLOW_LOG_MAX_BYTES, SLOW_LOG_BACKUPS, TRACE_KEEP
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """Трассировка одного обновления: этапы с началом и длительностью в миллисекундах"""
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.total_ms: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'ts': datetime.fromtimestamp(self.started_at).isoformat(timespec='milliseconds'),
+            'name': self.name,
+            'total_ms': self.total_ms,
+            'attrs': self.attrs,
+            'spans': self.spans,
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('trace', default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('span', default=None)
+
+# Последние медленные обновления для /trace
+_slow_traces: deque = deque(maxlen=TRACE_KEEP)
+_slow_lock = threading.Lock()
+
+# Отдельный логгер пишет медленные обновления в JSONL с ротацией
+_slow_logger = logging.getLogger('salesbot.slow')
+_slow_logger.propagate = False
+
+
+def _slow_log() -> logging.Logger:
+    if not _slow_logger.handlers and SLOW_LOG_FILE:
+        handler = RotatingFileHandler(
+            SLOW_LOG_FILE, maxBytes=SLOW_LOG_MAX_BYTES, backupCount=SLOW_LOG_BACKUPS, encoding='utf-8'
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _slow_logger.addHandler(handler)
+        _slow_logger.setLevel(logging.INFO)
+    return _slow_logger
+
+
+@contextmanager
+def start_trace(name: str, **attrs) -> Iterator[Trace]:
+    """
+    Начинает трассировку обновления.
+
+    Все span() внутри блока (в том числе в потоках, запущенных через
+    bind_context) попадают в нее. Если обновление заняло больше
+    SLOW_TRACE_MS, трассировка пишется в журнал медленных обновлений.
+    """
+    trace = Trace(name, attrs)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        trace.total_ms = round((time.perf_counter() - trace.started) * 1000, 2)
+        if trace.total_ms >= SLOW_TRACE_MS:
+            _record_slow(trace)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Замеряет этап текущего обновления; вне трассировки ничего не делает"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        # list.append атомарен, этапы из потоков пула добавляются без блокировки
+        trace.spans.append({
+            'name': name,
+            'parent': parent,
+            'start_ms': round((started - trace.started) * 1000, 2),
+            'ms': round((time.perf_counter() - started) * 1000, 2),
+        })
+
+
+def bind_context(method: Callable) -> Callable:
+    """Переносит текущую трассировку в поток пула (run_in_executor не копирует contextvars)"""
+    return functools.partial(contextvars.copy_context().run, method)
+
+
+def _record_slow(trace: Trace):
+    data = trace.to_dict()
+    with _slow_lock:
+        _slow_traces.append(data)
+    try:
+        _slow_log().info(json.dumps(data, ensure_ascii=False))
+    except Exception as e:
+        logger.error(f"Не удалось записать медленное обновление в журнал: {e}")
+
+
+def slowest_traces(limit: int = 5) -> List[Dict[str, Any]]:
+    """Самые медленные из последних TRACE_KEEP медленных обновлений"""
+    with _slow_lock:
+        traces = list(_slow_traces)
+    return sorted(traces, key=lambda trace: trace['total_ms'], reverse=True)[:limit]
+
+
+def format_trace(trace: Dict[str, Any]) -> str:
+    """Текстовая разбивка трассировки по этапам для ответа в чат"""
+    attrs = ', '.join(f"{key}={value}" for key, value in trace['attrs'].items())
+    lines = [f"⏱ {trace['total_ms']:.0f} мс - {trace['name']} ({trace['ts']}) {attrs}".rstrip()]
+    for item in sorted(trace['spans'], key=lambda s: s['start_ms']):
+        indent = '   ' if item['parent'] else ' '
+        lines.append(f"{indent}• {item['name']}: {item['ms']:.1f} мс (с {item['start_ms']:.0f} мс)")
+    return '\n'.join(lines)
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import sys
+from typing import Any, Awaitable, Dict, List, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from flood_control import FloodControl
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления разных чатов обрабатываются одновременно (не больше
+    max_concurrent_updates сразу), а обновления одного чата - строго по
+    очереди, в порядке поступления. Так медленная запись в одном чате не
+    задерживает остальные, а порядок строк в журнале совпадает с порядком
+    сообщений.
+
+    Сначала берется блокировка чата и только потом слот общего лимита,
+    поэтому обновления, ждущие своей очереди в чате, слоты не занимают.
+    Если передан flood_control, обновление сначала проходит его проверку
+    и занимает место в очереди приема до конца обработки.
+    """
+
+    def __init__(self, max_concurrent_updates: int, flood_control: Optional[FloodControl] = None):
+        # Семафор базового класса не гарантирует порядок ожидающих и занимался бы
+        # обновлениями, ждущими своего чата, поэтому он ничего не ограничивает,
+        # а лимит считается в _run
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должен быть положительным")
+        self._limit = max_concurrent_updates
+        self.flood_control = flood_control
+        self._slots: Optional[asyncio.BoundedSemaphore] = None
+        # chat_id -> [блокировка, сколько обновлений ее держат или ждут]
+        self._chat_locks: Dict[int, List[Any]] = {}
+        self._active = 0
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if self.flood_control is None:
+            await self._process_in_order(update, coroutine)
+            return
+
+        if not await self.flood_control.admit(update):
+            # Обработчик так и не будет запущен - закрываем корутину без предупреждения "never awaited"
+            coroutine.close()
+            return
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            await self.flood_control.release(update)
+
+    async def _process_in_order(self, update: object, coroutine: Awaitable[Any]):
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._chat_locks.get(chat_id)
+        if entry is None:
+            entry = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[chat_id]
+
+    async def _run(self, coroutine: Awaitable[Any]):
+        if self._slots is None:
+            await self.initialize()
+        async with self._slots:
+            self._active += 1
+            try:
+                await coroutine
+            finally:
+                self._active -= 1
+
+    async def initialize(self) -> None:
+        # Семафор создается уже внутри цикла событий, в котором работает бот
+        if self._slots is None:
+            self._slots = asyncio.BoundedSemaphore(self._limit)
+
+    async def shutdown(self) -> None:
+        pass
+
+    def snapshot(self) -> Dict[str, int]:
+        """Сколько обновлений выполняется сейчас и сколько чатов ждут своей очереди"""
+        return {
+            'active': self._active,
+            'limit': self._limit,
+            'chats': len(self._chat_locks),
+            'pending': sum(entry[1] for entry in self._chat_locks.values()),
+        }
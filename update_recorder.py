@@ -0,0 +1,22 @@
+import asyncio
+import json
+import threading
+import time
+from telegram import Update
+
+
+class UpdateRecorder:
+    """Обработчик TypeHandler(Update), дописывающий каждое обновление в JSONL для replay (см. loadtest.py)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    async def __call__(self, update: Update, context):
+        line = json.dumps({'ts': time.time(), 'update': update.to_dict()}, ensure_ascii=False) + '\n'
+        await asyncio.get_running_loop().run_in_executor(None, self._append, line)
+
+    def _append(self, line: str):
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line)